@@ -0,0 +1,192 @@
+# Checkpointing, restoring and forking of long-running simulations
+
+import os
+import json
+import hashlib
+import numpy as np
+from .error_handling import DataImportError
+from .parallel_processing import process_pool_executor
+
+_MANIFEST = 'checkpoint.json'
+
+def _content_hash(array):
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{array.dtype.str}{array.shape}'.encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+def _fsync_directory(directory):
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def _state_version(versions, key):
+    """Version of the array ``key`` in ``NeuronSimulation.state_versions``, None if untracked."""
+    return versions.get(key, versions.get(key.split('/', 1)[0]))
+
+class Checkpoint:
+    """Directory holding a binary snapshot of a simulation.
+
+    Every state array of the simulation (see ``NeuronSimulation.checkpoint_state``)
+    is stored as its own ``.npy`` file named after its content hash, next to a
+    JSON manifest with ``current_time`` and the RNG state. Saving again into
+    the same directory only writes arrays whose content changed. Arrays of
+    owners that track their changes (``state_version``, see
+    ``NeuronSimulation.state_versions``) are not even read while they are
+    unchanged since the last save or restore through this object. Data
+    files and the directory are synced before the manifest is replaced
+    atomically, and unreferenced files are removed afterwards, so a crash
+    during a save leaves the previous checkpoint usable.
+
+    Restores memory-map the files copy-on-write: the simulation starts
+    without reading its state up front, pages are shared between processes
+    restoring the same checkpoint, and writes never reach the files.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        # Key -> (array, owner state_version, file name) of the last save or restore.
+        self._saved = {}
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, _MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def load_manifest(self):
+        if not self.exists():
+            raise DataImportError(f"No checkpoint found in {self.directory}")
+        with open(self.manifest_path) as file:
+            return json.load(file)
+
+    def save(self, simulation, current_time=None):
+        """Write the simulation state, reusing files of unchanged arrays.
+
+        Args:
+            simulation (NeuronSimulation): Simulation to snapshot.
+            current_time (int): Step count to record; defaults to ``simulation.current_time``.
+
+        Returns:
+            dict: Number of arrays 'written', 'reused' and 'hashed' and the 'bytes_written'.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.load_manifest()['arrays'] if self.exists() else {}
+        versions = simulation.state_versions()
+        files = {}
+        saved = {}
+        stats = {'written': 0, 'reused': 0, 'hashed': 0, 'bytes_written': 0}
+        for key, array in simulation.checkpoint_state().items():
+            version = _state_version(versions, key)
+            last = self._saved.get(key)
+            if version is not None and last is not None and last[0] is array and last[1] == version:
+                file_name = last[2]
+            else:
+                file_name = f"{key.replace('/', '.')}-{_content_hash(array)}.npy"
+                stats['hashed'] += 1
+            files[key] = file_name
+            saved[key] = (array, version, file_name)
+            path = os.path.join(self.directory, file_name)
+            if previous.get(key) == file_name and os.path.exists(path):
+                stats['reused'] += 1
+                continue
+            with open(path, 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+                file.flush()
+                os.fsync(file.fileno())
+            stats['written'] += 1
+            stats['bytes_written'] += array.nbytes
+        _fsync_directory(self.directory)
+
+        manifest = {
+            'current_time': simulation.current_time if current_time is None else current_time,
+            'rng_state': simulation.rng.bit_generator.state,
+            'arrays': files,
+        }
+        temporary = self.manifest_path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.manifest_path)
+        _fsync_directory(self.directory)
+        self._saved = saved
+
+        referenced = set(files.values())
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name not in referenced:
+                os.remove(os.path.join(self.directory, name))
+        return stats
+
+    def restore(self, simulation, mmap_mode='c'):
+        """Load the checkpoint into a simulation built with the same structure.
+
+        With the default copy-on-write ``mmap_mode`` state arrays are paged
+        in on first access; pass ``mmap_mode=None`` to read them eagerly.
+        """
+        manifest = self.load_manifest()
+        arrays = {key: np.load(os.path.join(self.directory, file_name), mmap_mode=mmap_mode)
+                  for key, file_name in manifest['arrays'].items()}
+        simulation.restore_state(arrays)
+        versions = simulation.state_versions()
+        self._saved = {key: (array, _state_version(versions, key), manifest['arrays'][key])
+                       for key, array in arrays.items()}
+        simulation.rng.bit_generator.state = manifest['rng_state']
+        simulation.current_time = manifest['current_time']
+        return simulation
+
+class CheckpointMonitor:
+    """Saves a checkpoint every ``interval`` steps of a running simulation.
+
+    Register it with ``simulation.add_monitor``. Monitors run before
+    ``current_time`` advances, so the completed step is counted here.
+    """
+    def __init__(self, checkpoint, interval):
+        self.checkpoint = checkpoint
+        self.interval = int(interval)
+
+    def __call__(self, simulation):
+        completed = simulation.current_time + 1
+        if completed % self.interval == 0:
+            self.checkpoint.save(simulation, completed)
+
+def _run_variant(directory, build_simulation, variant, steps, collect):
+    simulation = build_simulation()
+    Checkpoint(directory).restore(simulation)
+    if variant is not None:
+        variant(simulation)
+    simulation.run(simulation.current_time + steps)
+    return collect(simulation)
+
+def _final_spikes(simulation):
+    return simulation.spikes
+
+def fork_variants(checkpoint, build_simulation, variants, steps, collect=None, max_workers=None):
+    """Continue one warmed-up checkpoint as several independent variants in parallel.
+
+    Each worker builds a fresh simulation, restores the checkpoint
+    copy-on-write (so the snapshot is shared rather than copied), applies
+    its variant and runs ``steps`` further steps. The warm-up transient is
+    simulated only once.
+
+    Args:
+        checkpoint (Checkpoint): Snapshot of the warmed-up simulation.
+        build_simulation (function): Builds an initialized simulation with the same structure.
+        variants (list): Functions ``variant(simulation)`` that modify parameters or
+            state before the run; ``None`` runs the snapshot unchanged.
+        steps (int): Number of steps to simulate after the snapshot.
+        collect (function): Extracts the result of a finished simulation;
+            defaults to the spikes of the last step.
+        max_workers (int): Maximum number of worker processes.
+
+    All functions must be picklable (module-level or ``functools.partial``).
+
+    Returns:
+        list: One result per variant, in order.
+    """
+    collect = _final_spikes if collect is None else collect
+    args_list = [(checkpoint.directory, build_simulation, variant, steps, collect) for variant in variants]
+    return process_pool_executor(_run_variant, args_list, max_workers)
@@ -1,12 +1,37 @@
 # Managing configuration settings for simulations
 
+import copy
+import hashlib
 import json
 import os
+from contextlib import contextmanager
+
+def config_hash(config):
+    """Stable hash of a JSON-serializable configuration, independent of key order."""
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def set_nested(config, key, value):
+    """Set ``value`` under a dotted key such as ``'network.n_neurons'``."""
+    *parents, leaf = key.split('.')
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[leaf] = value
 
 class ConfigManager:
-    def __init__(self, config_file_path='config.json'):
+    """JSON-backed configuration.
+
+    Changes are written to disk immediately when ``autosave`` is set; inside
+    ``deferred()`` they are collected and written once at the end. Code that
+    reads the configuration repeatedly should take a ``snapshot()`` instead
+    of going through the manager.
+    """
+    def __init__(self, config_file_path='config.json', autosave=True):
         self.config_file_path = config_file_path
+        self.autosave = autosave
         self.config = self.load_config()
+        self._deferred = 0
+        self._dirty = False
 
     def load_config(self):
         """Load configuration from a JSON file."""
@@ -20,6 +45,23 @@ class ConfigManager:
         """Save the current configuration to a JSON file."""
         with open(self.config_file_path, 'w') as file:
             json.dump(self.config, file, indent=4)
+        self._dirty = False
+
+    def _changed(self):
+        self._dirty = True
+        if self.autosave and not self._deferred:
+            self.save_config()
+
+    @contextmanager
+    def deferred(self):
+        """Collect changes made inside the block and save them once on exit."""
+        self._deferred += 1
+        try:
+            yield self
+        finally:
+            self._deferred -= 1
+            if not self._deferred and self._dirty and self.autosave:
+                self.save_config()
 
     def get_config(self, key, default=None):
         """Retrieve a configuration value."""
@@ -28,9 +70,16 @@ class ConfigManager:
     def set_config(self, key, value):
         """Set a configuration value."""
         self.config[key] = value
-        self.save_config()
+        self._changed()
 
     def update_config(self, updates):
         """Update multiple configuration values."""
         self.config.update(updates)
-        self.save_config()
+        self._changed()
+
+    def snapshot(self):
+        """Independent deep copy of the configuration, safe to hand to worker processes."""
+        return copy.deepcopy(self.config)
+
+    def config_hash(self):
+        return config_hash(self.config)
@@ -4,6 +4,12 @@ import pandas as pd
 import numpy as np
 import json
 import csv
+import os
+import queue
+import struct
+import threading
+import zlib
+from .error_handling import DataImportError, DataValidationError, ParameterValueError
 
 def read_csv(file_path, delimiter=','):
     """Read data from a CSV file."""
@@ -61,4 +67,361 @@ def split_data(data, test_size=0.2):
     from sklearn.model_selection import train_test_split
     return train_test_split(data, test_size=test_size)
 
+def save_arrays(directory, arrays, metadata=None):
+    """Store named NumPy arrays as ``.npy`` files plus a JSON manifest.
+
+    The binary files can later be memory-mapped by ``load_arrays`` instead
+    of being parsed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'arrays': sorted(arrays), 'metadata': metadata or {}}
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file)
+
+def load_arrays(directory, mmap_mode='r'):
+    """Open arrays written by ``save_arrays`` without copying them into memory.
+
+    With a ``mmap_mode`` ('r', 'r+' or 'c') every array is a memory map, so
+    only the pages touched by later slicing are read from disk. Pass
+    ``mmap_mode=None`` to load everything eagerly.
+
+    Returns:
+        tuple: ``(arrays, metadata)``.
+    """
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        raise DataImportError(f"No array manifest found in {directory}")
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+              for name in manifest['arrays']}
+    return arrays, manifest['metadata']
+
+# Recording file layout: a magic string followed by records, each a fixed
+# header (kind, stream id, row count, first and last time, payload size) and
+# its payload. Declarations carry a JSON description of a stream; chunks
+# carry one block per column, each prefixed by its size, which is either
+# zlib-compressed or the raw array bytes.
+_RECORDING_MAGIC = b'BSPREC01'
+_RECORD_HEADER = struct.Struct('<BHIddQ')
+_COLUMN_SIZE = struct.Struct('<Q')
+_DECLARATION = 0
+_CHUNK = 1
+
+class _RecordedStream:
+    """Preallocated column buffers that collect one stream until a chunk is full."""
+    def __init__(self, stream_id, columns, chunk_rows, neurons=None):
+        self.stream_id = stream_id
+        self.columns = columns
+        self.chunk_rows = int(chunk_rows)
+        self.neurons = neurons
+        self._allocate()
+
+    def _allocate(self):
+        self.buffers = [np.empty((self.chunk_rows,) + tuple(column['shape']), dtype=column['dtype'])
+                        for column in self.columns]
+        self.rows = 0
+
+    def take_chunk(self):
+        """Hand out the filled rows and start a fresh set of buffers."""
+        chunk = [buffer[:self.rows] for buffer in self.buffers]
+        times = self.buffers[0]
+        bounds = (float(times[0]), float(times[self.rows - 1]))
+        rows = self.rows
+        self._allocate()
+        return rows, bounds, chunk
+
+class ChunkedRecorder:
+    """Streams spikes and sampled state variables to a compressed columnar file.
+
+    Records are collected in preallocated buffers of ``chunk_size`` rows
+    (spike events or state values). Full chunks are handed to a background
+    thread that compresses and appends them to the file, so the simulation
+    loop only waits on disk when more than ``max_pending`` chunks are
+    queued. Every chunk stores the time span it covers, which lets
+    ``RecordingReader`` answer time-window queries by decompressing only the
+    chunks that overlap the window. Times must be recorded in
+    non-decreasing order. With ``compression_level=None`` the columns are
+    stored raw and the reader memory-maps them instead of decompressing.
+
+    Args:
+        file_path (str): Output file, overwritten if it exists.
+        chunk_size (int): Values buffered per chunk.
+        compression_level (int): zlib compression level (0-9), or None for raw columns.
+        max_pending (int): Chunks that may wait for the writer thread.
+        state_dtype: Storage type of sampled state variables.
+    """
+    def __init__(self, file_path, chunk_size=65536, compression_level=1, max_pending=8,
+                 state_dtype=np.float32):
+        if chunk_size < 1:
+            raise ParameterValueError('chunk_size', "Chunks must hold at least one value")
+        self.file_path = file_path
+        self.chunk_size = int(chunk_size)
+        self.compression_level = compression_level
+        self.state_dtype = np.dtype(state_dtype)
+        self._streams = {}
+        self._error = None
+        self._closed = False
+        self._file = open(file_path, 'wb')
+        self._file.write(_RECORDING_MAGIC)
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _declare(self, name, kind, columns, chunk_rows, neurons=None):
+        if name in self._streams:
+            raise DataValidationError(f"Stream '{name}' is already recorded")
+        stream = _RecordedStream(len(self._streams), columns, chunk_rows, neurons)
+        declaration = {'name': name, 'kind': kind, 'compressed': self.compression_level is not None,
+                       'columns': [dict(column, dtype=np.dtype(column['dtype']).str) for column in columns]}
+        if neurons is not None:
+            declaration['neurons'] = neurons.tolist()
+        self._submit((_DECLARATION, stream.stream_id, 0, 0.0, 0.0, json.dumps(declaration).encode()))
+        self._streams[name] = stream
+        return stream
+
+    def add_spike_stream(self, name='spikes'):
+        """Declare a stream of ``(time, neuron)`` spike events."""
+        columns = [{'name': 'time', 'dtype': np.float64, 'shape': ()},
+                   {'name': 'neuron', 'dtype': np.int32, 'shape': ()}]
+        self._declare(name, 'spikes', columns, self.chunk_size)
+
+    def add_state_stream(self, name, neurons):
+        """Declare a stream of state samples taken from the given neurons."""
+        neurons = np.asarray(neurons, dtype=np.int64)
+        columns = [{'name': 'time', 'dtype': np.float64, 'shape': ()},
+                   {'name': 'values', 'dtype': self.state_dtype, 'shape': (len(neurons),)}]
+        self._declare(name, 'state', columns, max(self.chunk_size // max(len(neurons), 1), 1), neurons)
+
+    def record_spikes(self, time, neurons, stream='spikes'):
+        """Append spikes of the given neurons, all emitted at ``time`` (ms)."""
+        if stream not in self._streams:
+            self.add_spike_stream(stream)
+        buffer = self._streams[stream]
+        start = 0
+        while start < len(neurons):
+            count = min(len(neurons) - start, buffer.chunk_rows - buffer.rows)
+            rows = slice(buffer.rows, buffer.rows + count)
+            buffer.buffers[0][rows] = time
+            buffer.buffers[1][rows] = neurons[start:start + count]
+            buffer.rows += count
+            start += count
+            if buffer.rows == buffer.chunk_rows:
+                self._flush(buffer)
+
+    def record_state(self, stream, time, values):
+        """Append one sample of a state stream from a full population array."""
+        buffer = self._streams[stream]
+        buffer.buffers[0][buffer.rows] = time
+        buffer.buffers[1][buffer.rows] = values[buffer.neurons]
+        buffer.rows += 1
+        if buffer.rows == buffer.chunk_rows:
+            self._flush(buffer)
+
+    def _flush(self, buffer):
+        if buffer.rows:
+            rows, (t_start, t_end), chunk = buffer.take_chunk()
+            self._submit((_CHUNK, buffer.stream_id, rows, t_start, t_end, chunk))
+
+    def _submit(self, record):
+        if self._error is not None:
+            raise self._error
+        self._pending.put(record)
+
+    def _write_loop(self):
+        while True:
+            record = self._pending.get()
+            if record is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                kind, stream_id, rows, t_start, t_end, payload = record
+                if kind == _CHUNK:
+                    parts = []
+                    for column in payload:
+                        data = np.ascontiguousarray(column)
+                        if self.compression_level is not None:
+                            data = zlib.compress(data, self.compression_level)
+                        else:
+                            data = data.tobytes()
+                        parts += [_COLUMN_SIZE.pack(len(data)), data]
+                    payload = b''.join(parts)
+                self._file.write(_RECORD_HEADER.pack(kind, stream_id, rows, t_start, t_end, len(payload)))
+                self._file.write(payload)
+            except Exception as e:
+                self._error = e
+
+    def flush(self):
+        """Write all buffered records, including partially filled chunks."""
+        for buffer in self._streams.values():
+            self._flush(buffer)
+
+    def close(self):
+        """Flush all buffers, wait for the writer thread and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._writer.join()
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+class RecordingReader:
+    """Random access to a file written by ``ChunkedRecorder``.
+
+    Opening the file only scans the record headers and memory-maps it;
+    chunk payloads are paged in when a query overlaps their time span.
+    Uncompressed columns are used in place, and within each chunk only the
+    rows of the requested window are copied. A record cut short by an
+    interrupted run is ignored.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.streams = {}
+        chunks = {}
+        with open(file_path, 'rb') as file:
+            if file.read(len(_RECORDING_MAGIC)) != _RECORDING_MAGIC:
+                raise DataImportError(f"{file_path} is not a recording file")
+            file.seek(0, 2)
+            file_size = file.tell()
+            file.seek(len(_RECORDING_MAGIC))
+            names = {}
+            while True:
+                header = file.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                kind, stream_id, rows, t_start, t_end, payload_size = _RECORD_HEADER.unpack(header)
+                offset = file.tell()
+                if offset + payload_size > file_size:
+                    break
+                if kind == _DECLARATION:
+                    declaration = json.loads(file.read(payload_size))
+                    names[stream_id] = declaration['name']
+                    self.streams[declaration['name']] = declaration
+                    chunks[declaration['name']] = []
+                else:
+                    chunks[names[stream_id]].append((t_start, t_end, rows, offset, payload_size))
+                    file.seek(payload_size, 1)
+        self._map = np.memmap(file_path, dtype=np.uint8, mode='r')
+        self._chunks = {name: np.array(entries, dtype=[('t_start', np.float64), ('t_end', np.float64),
+                                                       ('rows', np.int64), ('offset', np.int64),
+                                                       ('size', np.int64)])
+                        for name, entries in chunks.items()}
+
+    def _stream(self, name, kind):
+        if name not in self.streams or self.streams[name]['kind'] != kind:
+            raise DataValidationError(f"No {kind} stream named '{name}' in {self.file_path}")
+        return self.streams[name]
+
+    def _read(self, name, t_start, t_stop):
+        """Rows of all chunks overlapping ``[t_start, t_stop)``, one array per column."""
+        declaration = self.streams[name]
+        specs = declaration['columns']
+        index = self._chunks[name]
+        selected = index[(index['t_end'] >= t_start) & (index['t_start'] < t_stop)]
+        columns = [[] for _ in specs]
+        for chunk in selected:
+            position = int(chunk['offset'])
+            chunk_columns = []
+            for spec in specs:
+                size, = _COLUMN_SIZE.unpack(self._map[position:position + _COLUMN_SIZE.size])
+                position += _COLUMN_SIZE.size
+                data = self._map[position:position + size]
+                position += size
+                if declaration.get('compressed', True):
+                    data = zlib.decompress(data)
+                values = np.frombuffer(data, dtype=spec['dtype'])
+                chunk_columns.append(values.reshape((-1,) + tuple(spec['shape'])))
+            times = chunk_columns[0]
+            rows = slice(np.searchsorted(times, t_start, 'left'), np.searchsorted(times, t_stop, 'left'))
+            for column, values in zip(columns, chunk_columns):
+                column.append(values[rows])
+        return [np.concatenate(column) if column else
+                np.empty((0,) + tuple(spec['shape']), dtype=spec['dtype'])
+                for column, spec in zip(columns, specs)]
+
+    def time_range(self, name):
+        """First and last recorded time of a stream."""
+        index = self._chunks[name]
+        if len(index) == 0:
+            return None
+        return float(index['t_start'].min()), float(index['t_end'].max())
+
+    def spikes(self, t_start=-np.inf, t_stop=np.inf, neurons=None, stream='spikes'):
+        """Spike times and neuron ids within ``[t_start, t_stop)``, optionally for a subset of neurons."""
+        self._stream(stream, 'spikes')
+        times, ids = self._read(stream, t_start, t_stop)
+        if neurons is not None:
+            keep = np.isin(ids, neurons)
+            times, ids = times[keep], ids[keep]
+        return times, ids
+
+    def state(self, stream, t_start=-np.inf, t_stop=np.inf, neurons=None):
+        """Sample times and a ``(samples, neurons)`` array of a state stream.
+
+        ``neurons`` selects columns by neuron id; all of them must have been
+        recorded.
+        """
+        declaration = self._stream(stream, 'state')
+        times, values = self._read(stream, t_start, t_stop)
+        if neurons is not None:
+            recorded = np.asarray(declaration['neurons'])
+            order = np.argsort(recorded)
+            positions = np.searchsorted(recorded, neurons, sorter=order)
+            positions = order[np.minimum(positions, len(recorded) - 1)]
+            if np.any(recorded[positions] != neurons):
+                raise DataValidationError(f"Stream '{stream}' does not contain all requested neurons")
+            values = values[:, positions]
+        return times, values
+
+    def spikes_dataframe(self, t_start=-np.inf, t_stop=np.inf, neurons=None, stream='spikes'):
+        """Spikes in a window as a DataFrame, e.g. for ``write_csv``."""
+        times, ids = self.spikes(t_start, t_stop, neurons, stream)
+        return pd.DataFrame({'time': times, 'neuron': ids})
+
+class RecordingMonitor:
+    """Records one population of a ``NeuronSimulation`` after every step.
+
+    Register it with ``simulation.add_monitor``. Spikes are stamped with the
+    end of the step in which they were emitted; state variables of the
+    selected neurons are sampled every ``interval`` steps.
+    """
+    def __init__(self, recorder, population_index, state_variables=(), neurons=None, interval=1,
+                 prefix=None):
+        self.recorder = recorder
+        self.population_index = population_index
+        self.state_variables = tuple(state_variables)
+        self.neurons = neurons
+        self.interval = int(interval)
+        self.prefix = f'population{population_index}' if prefix is None else prefix
+        self.spike_stream = f'{self.prefix}.spikes'
+        self.state_streams = {}
+        recorder.add_spike_stream(self.spike_stream)
+
+    def __call__(self, simulation):
+        time = (simulation.current_time + 1) * simulation.time_step
+        self.recorder.record_spikes(time, simulation.spikes[self.population_index], self.spike_stream)
+        if not self.state_variables or simulation.current_time % self.interval:
+            return
+        population = simulation.populations[self.population_index]
+        for name in self.state_variables:
+            if name not in self.state_streams:
+                neurons = np.arange(population.size) if self.neurons is None else self.neurons
+                self.state_streams[name] = f'{self.prefix}.{name}'
+                self.recorder.add_state_stream(self.state_streams[name], neurons)
+            self.recorder.record_state(self.state_streams[name], time, population.state[name])
+
 # Additional data handling functions can be added here as required
@@ -1,8 +1,15 @@
 # Utilities for multi-threading and multi-processing
 
+import os
+import time
 import threading
+import traceback
 import multiprocessing
+from multiprocessing import shared_memory
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from .error_handling import ParameterValueError, SimulationError
+from .simulation_framework import Simulation
 
 def run_in_threads(target, args_list):
     """Run a function in parallel using threads.
@@ -47,6 +54,10 @@ def thread_pool_executor(target, args_list, max_workers=None):
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         executor.map(lambda p: target(*p), args_list)
 
+def _call_with_args(target, args):
+    """Module-level trampoline so process pools can pickle the call."""
+    return target(*args)
+
 def process_pool_executor(target, args_list, max_workers=None):
     """Run a function in parallel using a process pool executor.
 
@@ -54,6 +65,338 @@ def process_pool_executor(target, args_list, max_workers=None):
         target (function): The function to run in parallel.
         args_list (list): A list of argument tuples for each invocation of the function.
         max_workers (int): The maximum number of processes that can be used to execute the given calls.
+
+    Returns:
+        list: The return values of all invocations, in order.
     """
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(lambda p: target(*p), args_list)
+        return list(executor.map(_call_with_args, [target] * len(args_list), args_list))
+
+class SharedArray:
+    """NumPy array placed in a named ``multiprocessing.shared_memory`` block.
+
+    Pickling only transfers the block name, shape and dtype, so handing a
+    shared array to a worker process never copies its contents.
+    """
+    def __init__(self, shape, dtype=np.float64, name=None):
+        self.shape = (int(shape),) if np.isscalar(shape) else tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def from_array(cls, values):
+        """Create a shared array holding a copy of ``values``."""
+        values = np.asarray(values)
+        shared = cls(values.shape, values.dtype)
+        shared.array[...] = values
+        return shared
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype.str, 'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['shape'], state['dtype'], state['name'])
+
+    def close(self):
+        """Release this process's mapping and, for the creator, free the block."""
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _partition_worker(index, bounds, population_factory, population_kwargs, connectivity, window,
+                      max_delay, shared, pending, barrier, connection):
+    """Advance one partition of a PartitionedSimulation on command of the parent.
+
+    ``pending`` optionally holds the synaptic input of all neurons to
+    start from, ``(max_delay + 2, size)``: the input of the next step
+    followed by the delay queue with its next slot first.
+    """
+    from ..neurons.synapse_model import SynapticDelayQueue
+
+    start, stop = int(bounds[index]), int(bounds[index + 1])
+    population = population_factory(stop - start, **population_kwargs)
+    population.bind_arrays({name: array.array[start:stop] for name, array in shared['arrays'].items()})
+    queue = SynapticDelayQueue(stop - start, max_delay)
+    if pending is not None:
+        population.synaptic_input[:] = pending.array[0, start:stop]
+        queue.buffer[:] = pending.array[1:, start:stop]
+    connection.send(('done', None))
+    outbox_ids = shared['outbox_ids'].array
+    outbox_offsets = shared['outbox_offsets'].array
+    outbox_counts = shared['outbox_counts'].array
+    spike_counts = shared['spike_counts'].array[start:stop]
+    busy_time = shared['busy_time'].array
+    outbox_start = [int(bound) * window for bound in bounds]
+
+    while True:
+        command, argument = connection.recv()
+        if command == 'stop':
+            break
+        if command == 'export':
+            argument.array[0, start:stop] = population.synaptic_input
+            argument.array[1:, start:stop] = np.roll(queue.buffer, -queue.head, axis=0)
+            connection.send(('done', None))
+            continue
+        n_windows = argument
+        try:
+            for _ in range(n_windows):
+                count = 0
+                window_start = time.perf_counter()
+                for offset in range(window):
+                    spikes = population.update()
+                    queue.deliver(population.synaptic_input)
+                    spike_counts[spikes] += 1
+                    slot = slice(outbox_start[index] + count, outbox_start[index] + count + len(spikes))
+                    outbox_ids[slot] = spikes + start
+                    outbox_offsets[slot] = offset
+                    count += len(spikes)
+                outbox_counts[index] = count
+                busy_time[index] += time.perf_counter() - window_start
+                barrier.wait()
+
+                ids = np.concatenate([outbox_ids[first:first + outbox_counts[p]]
+                                      for p, first in enumerate(outbox_start[:-1])])
+                offsets = np.concatenate([outbox_offsets[first:first + outbox_counts[p]]
+                                          for p, first in enumerate(outbox_start[:-1])])
+                synapses = connectivity.outgoing(ids)
+                per_spike = connectivity.indptr[ids + 1] - connectivity.indptr[ids]
+                # The queue has already handed out the input for the first step
+                # of the next window, so shorten each delay by the steps that
+                # have passed since the spike was emitted.
+                delays = connectivity.delays[synapses] - (window - np.repeat(offsets, per_spike))
+                queue.schedule(connectivity.indices[synapses], delays, connectivity.weights[synapses])
+                barrier.wait()
+            connection.send(('done', None))
+        except Exception:
+            barrier.abort()
+            connection.send(('error', traceback.format_exc()))
+
+class PartitionedSimulation(Simulation):
+    """Fixed-step network simulation split across persistent worker processes.
+
+    Each worker owns a contiguous range of neurons and the synapses onto
+    them. Per-neuron arrays live in shared memory, so the parent can read
+    or modify them through ``arrays`` without copying. Workers run
+    independently for a window of ``min_delay`` steps and then exchange only
+    the spikes emitted during that window, which is exact because no spike
+    can reach its target sooner than the shortest synaptic delay.
+
+    ``repartition`` migrates neurons between workers, e.g. on the advice of
+    ``network_topology.LoadBalancer``. Neurons are renumbered so that every
+    partition stays contiguous; ``neuron_order[i]`` is the original index
+    of neuron ``i`` of ``arrays``, ``spike_counts`` and ``connectivity``.
+
+    The network is one population of a single class with one recurrent
+    connectivity matrix; unlike ``NeuronSimulation`` there are no separate
+    populations, projections, monitors or processes. Networks of several
+    populations must be merged into one matrix over all neurons, with
+    per-neuron parameters set through ``arrays``.
+
+    Args:
+        parameters (dict): Simulation parameters; ``n_workers`` (defaults to the
+            CPU count) and ``bounds`` (partition boundaries, see
+            ``network_topology.partition_bounds``) are optional.
+        population_factory (type): Builds a population of a given size, e.g. ``LIFPopulation``.
+        size (int): Total number of neurons.
+        connectivity (ConnectivityMatrix): Recurrent synapses of the network.
+        population_kwargs (dict): Extra keyword arguments for ``population_factory``.
+    """
+    def __init__(self, parameters, population_factory, size, connectivity, population_kwargs=None):
+        super().__init__(parameters)
+        self.population_factory = population_factory
+        self.population_kwargs = dict(population_kwargs or {})
+        self.size = int(size)
+        if connectivity.n_pre != self.size or connectivity.n_post != self.size:
+            raise ParameterValueError('connectivity', "Connectivity must be recurrent over all neurons")
+        self.connectivity = connectivity
+        self.n_workers = int(self.parameters.get('n_workers') or os.cpu_count() or 1)
+        bounds = self.parameters.get('bounds')
+        if bounds is None:
+            bounds = np.linspace(0, self.size, self.n_workers + 1).round().astype(np.int64)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        if len(self.bounds) != self.n_workers + 1 or self.bounds[0] != 0 or self.bounds[-1] != self.size:
+            raise ParameterValueError('bounds', "Partition bounds must cover all neurons once per worker")
+        self.window = int(connectivity.delays.min()) if connectivity.n_synapses else 1
+        self.max_delay = max(int(connectivity.delays.max()) if connectivity.n_synapses else 1, 1)
+        self.neuron_order = np.arange(self.size)
+        self.arrays = {}
+        self._shared = None
+        self._workers = []
+        self._connections = []
+
+    def initialize(self):
+        """Allocate shared state and start one persistent worker per partition."""
+        template = self.population_factory(self.size, **self.population_kwargs)
+        self._shared = {
+            'arrays': {name: SharedArray.from_array(values) for name, values in template.arrays().items()},
+            'outbox_ids': SharedArray(self.window * self.size, np.int64),
+            'outbox_offsets': SharedArray(self.window * self.size, np.int32),
+            'outbox_counts': SharedArray(self.n_workers, np.int64),
+            'spike_counts': SharedArray(self.size, np.int64),
+            'busy_time': SharedArray(self.n_workers, np.float64),
+        }
+        self._shared['spike_counts'].array.fill(0)
+        self._shared['busy_time'].array.fill(0.0)
+        self.arrays = {name: shared.array for name, shared in self._shared['arrays'].items()}
+        self.spike_counts = self._shared['spike_counts'].array
+        self._start_workers()
+        self.current_time = 0
+
+    def _start_workers(self, pending=None):
+        barrier = multiprocessing.Barrier(self.n_workers)
+        for index in range(self.n_workers):
+            parent_end, worker_end = multiprocessing.Pipe()
+            local = self.connectivity.column_slice(int(self.bounds[index]), int(self.bounds[index + 1]))
+            worker = multiprocessing.Process(
+                target=_partition_worker,
+                args=(index, self.bounds, self.population_factory, self.population_kwargs, local,
+                      self.window, self.max_delay, self._shared, pending, barrier, worker_end),
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+            self._connections.append(parent_end)
+        self._collect()
+
+    def _stop_workers(self):
+        if self._workers:
+            self._command('stop')
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+        self._connections = []
+
+    def _collect(self):
+        errors = [message for status, message in (connection.recv() for connection in self._connections)
+                  if status == 'error']
+        if errors:
+            raise SimulationError("Partition worker failed:\n" + errors[0])
+
+    def _command(self, command, argument=0):
+        for connection in self._connections:
+            connection.send((command, argument))
+        if command != 'stop':
+            self._collect()
+
+    def repartition(self, labels):
+        """Migrate neurons so that worker ``p`` owns every neuron labelled ``p``.
+
+        The neurons' state, spike counts and queued synaptic input move with
+        them, so the run continues exactly as before. Workers are restarted
+        on their new neuron ranges.
+
+        Args:
+            labels (np.ndarray): Worker of every neuron, indexed by original
+                neuron number (see ``neuron_order``), e.g. from ``LoadBalancer.rebalance``.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        if labels.shape != (self.size,) or labels.min() < 0 or labels.max() >= self.n_workers:
+            raise ParameterValueError('labels', "Need one worker label in [0, n_workers) per neuron")
+        if self._shared is None:
+            raise SimulationError("Initialize the simulation before repartitioning it")
+        order = np.argsort(labels, kind='stable')
+        bounds = np.zeros(self.n_workers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=self.n_workers), out=bounds[1:])
+        position = np.empty(self.size, dtype=np.int64)
+        position[self.neuron_order] = np.arange(self.size)
+        take = position[order]
+
+        pending = SharedArray((self.max_delay + 2, self.size))
+        try:
+            self._command('export', pending)
+            self._stop_workers()
+            for values in self.arrays.values():
+                values[:] = values[take]
+            self.spike_counts[:] = self.spike_counts[take]
+            pending.array[:] = pending.array[:, take]
+            self.connectivity = self.connectivity.permuted(take)
+            self.neuron_order = order
+            self.bounds = bounds
+            self._start_workers(pending)
+        finally:
+            pending.close()
+
+    def partition_times(self, reset=True):
+        """Seconds each worker spent updating its partition, excluding spike exchange.
+
+        Suitable as input for a load balancer; with ``reset`` the counters
+        start again from zero.
+        """
+        busy_time = self._shared['busy_time'].array
+        times = busy_time.copy()
+        if reset:
+            busy_time.fill(0.0)
+        return times
+
+    def step(self):
+        """Advance all partitions by one synchronization window."""
+        self._command('run', 1)
+
+    def run(self, duration):
+        """Run for at least ``duration`` steps, rounded up to whole windows."""
+        self.is_running = True
+        start_time = time.time()
+        n_windows = -(-max(duration - self.current_time, 0) // self.window)
+        if n_windows:
+            self._command('run', n_windows)
+            self.current_time += n_windows * self.window
+        end_time = time.time()
+        print(f"Simulation completed in {end_time - start_time} seconds.")
+
+    def stop(self):
+        """Stop the workers and release the shared memory."""
+        self.is_running = False
+        self._stop_workers()
+        if self._shared is not None:
+            self.arrays = {}
+            self.spike_counts = None
+            for shared in self._shared['arrays'].values():
+                shared.close()
+            for name in ('outbox_ids', 'outbox_offsets', 'outbox_counts', 'spike_counts', 'busy_time'):
+                self._shared[name].close()
+            self._shared = None
+
+def benchmark_strong_scaling(population_factory, size, connectivity, duration, worker_counts=None,
+                             population_kwargs=None, initial_arrays=None):
+    """Measure wall-clock time of a fixed network for increasing worker counts.
+
+    Args:
+        population_factory (type): Population class, e.g. ``LIFPopulation``.
+        size (int): Number of neurons.
+        connectivity (ConnectivityMatrix): Recurrent synapses.
+        duration (int): Number of time steps per run.
+        worker_counts (iterable): Worker counts to measure; defaults to 1..cpu_count.
+        population_kwargs (dict): Extra keyword arguments for the population.
+        initial_arrays (dict): Values written into the shared per-neuron arrays
+            before running, e.g. ``{'bias_current': currents}``.
+
+    Returns:
+        dict: Mapping of worker count to elapsed seconds, speedup and parallel efficiency.
+    """
+    worker_counts = worker_counts or range(1, (os.cpu_count() or 1) + 1)
+    elapsed = {}
+    for n_workers in worker_counts:
+        simulation = PartitionedSimulation({'n_workers': n_workers}, population_factory, size,
+                                           connectivity, population_kwargs)
+        simulation.initialize()
+        try:
+            for name, values in (initial_arrays or {}).items():
+                simulation.arrays[name][:] = values
+            start_time = time.perf_counter()
+            simulation.run(duration)
+            elapsed[n_workers] = time.perf_counter() - start_time
+        finally:
+            simulation.stop()
+    baseline_workers = min(elapsed)
+    results = {}
+    for n_workers, seconds in elapsed.items():
+        speedup = elapsed[baseline_workers] / seconds
+        results[n_workers] = {'seconds': seconds, 'speedup': speedup,
+                              'efficiency': speedup * baseline_workers / n_workers}
+    return results
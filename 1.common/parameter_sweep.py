@@ -0,0 +1,170 @@
+# Parameter sweeps over configuration settings
+
+import copy
+import itertools
+import json
+import os
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+from .config_manager import ConfigManager, config_hash, set_nested
+from .error_handling import ParameterValueError
+
+def grid_design(space):
+    """All combinations of the values listed for each (dotted) config key."""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+def random_design(space, n_points, rng=None):
+    """Random points of a parameter space.
+
+    Each key maps to a list of choices or to a ``(low, high)`` tuple that is
+    sampled uniformly.
+    """
+    rng = np.random.default_rng(rng)
+    columns = {}
+    for key, values in space.items():
+        if isinstance(values, tuple):
+            if len(values) != 2:
+                raise ParameterValueError(key, "Continuous ranges must be given as (low, high)")
+            columns[key] = rng.uniform(values[0], values[1], size=n_points).tolist()
+        else:
+            columns[key] = [values[index] for index in rng.integers(0, len(values), size=n_points)]
+    return [{key: columns[key][point] for key in space} for point in range(n_points)]
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ResultStore:
+    """SQLite table of sweep results indexed by configuration hash."""
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "config_hash TEXT PRIMARY KEY, point TEXT, config TEXT, status TEXT, "
+            "result TEXT, elapsed REAL, finished REAL)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def completed(self):
+        """Hashes of all configurations that finished successfully."""
+        rows = self.connection.execute("SELECT config_hash FROM results WHERE status = 'completed'")
+        return {row[0] for row in rows}
+
+    def add(self, digest, point, config, status, result, elapsed):
+        """Insert or replace the outcome of one configuration."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (digest, json.dumps(point, default=_to_json), json.dumps(config, default=_to_json), status,
+             json.dumps(result, default=_to_json), elapsed, time.time()))
+        self.connection.commit()
+
+    def get(self, digest):
+        """Result of one configuration, or None if it has not completed."""
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE config_hash = ? AND status = 'completed'", (digest,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def to_dataframe(self, status='completed'):
+        """One row per configuration with the swept values and the result fields as columns."""
+        rows = self.connection.execute(
+            "SELECT config_hash, point, result, elapsed FROM results WHERE status = ?", (status,))
+        records = []
+        for digest, point, result, elapsed in rows:
+            record = {'config_hash': digest, 'elapsed': elapsed}
+            record.update(json.loads(point))
+            result = json.loads(result)
+            record.update(result if isinstance(result, dict) else {'result': result})
+            records.append(record)
+        return pd.DataFrame(records)
+
+def _run_point(run_function, config):
+    start = time.perf_counter()
+    try:
+        result = run_function(config)
+        # Results are stored as JSON; checking here fails only this point if one cannot be.
+        json.dumps(result, default=_to_json)
+        return 'completed', result, time.perf_counter() - start
+    except Exception:
+        return 'failed', traceback.format_exc(), time.perf_counter() - start
+
+class ParameterSweep:
+    """Runs a function once per point of a parameter design across a process pool.
+
+    Each point is applied (dotted keys allowed) to a copy of the base
+    configuration and the resulting plain dict is passed to
+    ``run_function(config)`` in a worker process, so the run never touches
+    the configuration file. At most ``max_pending`` points are in flight at
+    a time and every result is written to the ``ResultStore`` as soon as it
+    arrives, which bounds memory use for arbitrarily large designs.
+    Configurations already completed in the store are skipped, so an
+    interrupted sweep resumes where it stopped; failed points are retried.
+
+    Args:
+        base_config (dict or ConfigManager): Settings shared by all points.
+        design (iterable): Parameter points, e.g. from ``grid_design`` or ``random_design``;
+            a generator keeps even huge designs out of memory.
+        run_function (function): Picklable function returning a JSON-serializable result.
+        store (ResultStore): Destination of the results.
+        max_workers (int): Number of worker processes.
+        max_pending (int): Points submitted but not yet stored; defaults to twice the workers.
+    """
+    def __init__(self, base_config, design, run_function, store, max_workers=None, max_pending=None):
+        if isinstance(base_config, ConfigManager):
+            base_config = base_config.snapshot()
+        self.base_config = base_config
+        self.design = design
+        self.run_function = run_function
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+
+    def configurations(self):
+        """Yield ``(hash, point, config)`` for every point of the design."""
+        for point in self.design:
+            config = copy.deepcopy(self.base_config)
+            for key, value in point.items():
+                set_nested(config, key, value)
+            yield config_hash(config), point, config
+
+    def run(self):
+        """Run all points not yet completed; returns counts of the outcomes."""
+        done = self.store.completed()
+        summary = {'skipped': 0, 'completed': 0, 'failed': 0}
+        max_workers = self.max_workers or os.cpu_count() or 1
+        max_pending = self.max_pending or 2 * max_workers
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+
+            def collect(futures):
+                for future in futures:
+                    digest, point, config = pending.pop(future)
+                    try:
+                        status, result, elapsed = future.result()
+                    except Exception as error:
+                        # The worker died or its result could not be sent back.
+                        status, result, elapsed = 'failed', f"{type(error).__name__}: {error}", None
+                    self.store.add(digest, point, config, status, result, elapsed)
+                    summary[status] += 1
+
+            for digest, point, config in self.configurations():
+                if digest in done:
+                    summary['skipped'] += 1
+                    continue
+                done.add(digest)
+                if len(pending) >= max_pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                pending[executor.submit(_run_point, self.run_function, config)] = (digest, point, config)
+            collect(wait(pending)[0])
+        return summary
@@ -42,4 +42,19 @@ def calculate_accuracy(y_true, y_pred, threshold=0.5):
     y_pred_binarized = np.where(y_pred > threshold, 1, 0)
     return np.mean(y_true == y_pred_binarized)
 
+def measure_throughput(func, work_units, repeats=3):
+    """Measure how many units of work per second a callable achieves.
+
+    Args:
+        func (function): Zero-argument callable performing the measured work.
+        work_units (int): Units of work done by one call (e.g. neuron updates).
+        repeats (int): Number of timed calls; the fastest one is reported.
+    """
+    best_time = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return work_units / best_time
+
 # More specialized performance metrics can be added as needed
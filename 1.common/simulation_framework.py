@@ -1,6 +1,11 @@
 # Base classes and functions for setting up and running simulations
 
 import time
+import heapq
+import itertools
+import numpy as np
+from .constants import SIMULATION_TIME_STEP
+from .error_handling import DataValidationError, SimulationError
 
 class Simulation:
     def __init__(self, parameters):
@@ -30,12 +35,357 @@ class Simulation:
         """Stop the simulation."""
         self.is_running = False
 
+class NeuronPopulation:
+    """Homogeneous group of neurons stored as a struct of arrays.
+
+    Every state variable listed in ``state_variables`` is held in one
+    contiguous NumPy array of length ``size`` so that a whole population is
+    advanced by a single batched update per time step. Subclasses implement
+    ``reset`` and ``update``; ``update`` must work in place on the
+    preallocated arrays so the simulation loop does not allocate per step.
+    Per-neuron parameters that may differ between neurons (for example a
+    bias current) are listed in ``parameter_arrays``.
+    """
+    state_variables = ()
+    parameter_arrays = ()
+
+    def __init__(self, size, time_step=SIMULATION_TIME_STEP):
+        self.size = int(size)
+        self.time_step = time_step
+        self.state = {name: np.zeros(self.size) for name in self.state_variables}
+        self.synaptic_input = np.zeros(self.size)
+        self.spiked = np.zeros(self.size, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    def arrays(self):
+        """Return all per-neuron state and parameter arrays by name."""
+        arrays = dict(self.state)
+        for name in self.parameter_arrays:
+            arrays[name] = getattr(self, name)
+        return arrays
+
+    def bind_arrays(self, buffers):
+        """Back per-neuron arrays with caller-provided buffers, e.g. shared memory.
+
+        The buffers must already hold the desired values; they are used in
+        place from then on.
+        """
+        for name, buffer in buffers.items():
+            if name in self.state:
+                self.state[name] = buffer
+            elif name in self.parameter_arrays:
+                setattr(self, name, buffer)
+
+    def checkpoint_state(self):
+        """Arrays that together capture the population for a checkpoint."""
+        arrays = self.arrays()
+        arrays['synaptic_input'] = self.synaptic_input
+        arrays['spiked'] = self.spiked
+        return arrays
+
+    def restore_state(self, arrays):
+        """Adopt arrays produced by ``checkpoint_state`` (e.g. memory maps) in place."""
+        self.bind_arrays(arrays)
+        self.synaptic_input = arrays['synaptic_input']
+        self.spiked = arrays['spiked']
+
+    def reset(self):
+        """Return all state variables to their initial values."""
+        raise NotImplementedError("Reset method must be implemented.")
+
+    def update(self):
+        """Advance every neuron by one time step.
+
+        Consumes and clears ``synaptic_input``, updates ``spiked`` and
+        returns the indices of the neurons that fired during the step.
+        """
+        raise NotImplementedError("Update method must be implemented.")
+
+class MultiRateScheduler:
+    """Runs slow processes at their own periods from within the fixed-step loop.
+
+    Processes such as weight decay or consolidation act on timescales of
+    seconds or longer, so running them every step wastes nearly all of
+    their cost. Each registered process is called as
+    ``process(simulation, time)`` once every ``period`` ms, with ``time``
+    the end of the step just completed. Due processes are kept in a heap,
+    so steps on which nothing is due cost a single comparison. Periods
+    that were missed, e.g. because the simulation clock was moved by a
+    restore, are skipped rather than replayed.
+    """
+    def __init__(self, time_step=SIMULATION_TIME_STEP):
+        self.time_step = time_step
+        self.processes = []
+        self._queue = []
+
+    def register(self, process, period, phase=None, start=0):
+        """Call ``process`` every ``period`` ms, first ``phase`` ms (default one period) after step ``start``."""
+        period_steps = int(round(period / self.time_step))
+        if period_steps < 1:
+            raise SimulationError("Process period must be at least one time step")
+        first = period_steps if phase is None else max(int(round(phase / self.time_step)), 1)
+        heapq.heappush(self._queue, (int(start) + first, len(self.processes), period_steps, process))
+        self.processes.append(process)
+
+    def __call__(self, simulation):
+        # Monitors run before ``current_time`` advances; the completed step is counted here.
+        completed = simulation.current_time + 1
+        while self._queue and self._queue[0][0] <= completed:
+            due, order, period_steps, process = heapq.heappop(self._queue)
+            process(simulation, completed * self.time_step)
+            due += period_steps * ((completed - due) // period_steps + 1)
+            heapq.heappush(self._queue, (due, order, period_steps, process))
+
+    def checkpoint_state(self):
+        """Next due step of every process, in registration order."""
+        due = np.empty(len(self.processes), dtype=np.int64)
+        for step, order, _, _ in self._queue:
+            due[order] = step
+        return {'due': due}
+
+    def restore_state(self, arrays):
+        due = np.asarray(arrays['due'])
+        if due.shape != (len(self.processes),):
+            raise DataValidationError("Checkpointed schedule does not match the registered processes")
+        self._queue = [(int(due[order]), order, period_steps, process)
+                       for _, order, period_steps, process in self._queue]
+        heapq.heapify(self._queue)
+
 class NeuronSimulation(Simulation):
+    """Fixed-step simulation of one or more neuron populations.
+
+    ``current_time`` counts elapsed steps of ``time_step`` milliseconds.
+    Each step advances every population with one vectorized update, after
+    which ``spikes[i]`` holds the indices of the neurons of population ``i``
+    that fired during that step. Spikes are then routed through the
+    registered projections into the ``synaptic_input`` of their targets.
+    Monitors added with ``add_monitor`` are called with the simulation at the
+    end of every step, e.g. to stream spikes to disk; slow processes added
+    with ``add_process`` only run at their own period.
+    """
+    def __init__(self, parameters, populations=None):
+        super().__init__(parameters)
+        self.time_step = self.parameters.get('time_step', SIMULATION_TIME_STEP)
+        self.rng = np.random.default_rng(self.parameters.get('seed'))
+        self.populations = []
+        self.spikes = []
+        self.projections = []
+        self.monitors = []
+        self.scheduler = None
+        for population in populations or []:
+            self.add_population(population)
+
+    def add_population(self, population):
+        """Register a population and return its index in the simulation."""
+        self.populations.append(population)
+        self.spikes.append(np.empty(0, dtype=np.intp))
+        return len(self.populations) - 1
+
+    def connect(self, source, target, connectivity):
+        """Route spikes of population ``source`` into population ``target``.
+
+        ``connectivity`` must provide ``propagate(spike_indices, target_input)``,
+        such as a sparse connectivity matrix.
+        """
+        self.projections.append((source, target, connectivity))
+
+    def add_monitor(self, monitor):
+        """Call ``monitor(simulation)`` after every step."""
+        self.monitors.append(monitor)
+
+    def add_process(self, process, period, phase=None):
+        """Call ``process(simulation, time)`` every ``period`` ms (see ``MultiRateScheduler``)."""
+        if self.scheduler is None:
+            self.scheduler = MultiRateScheduler(self.time_step)
+            self.add_monitor(self.scheduler)
+        self.scheduler.register(process, period, phase, self.current_time)
+
+    @property
+    def time(self):
+        """Elapsed simulated time in milliseconds."""
+        return self.current_time * self.time_step
+
     def initialize(self):
         """Initialize neuron-specific simulation settings."""
         print("Initializing Neuron Simulation with parameters:", self.parameters)
+        for population in self.populations:
+            population.reset()
+        self.current_time = 0
+
+    def _state_owners(self):
+        owners = [(f'population{index}', population) for index, population in enumerate(self.populations)]
+        owners += [(f'projection{index}', connectivity)
+                   for index, (_, _, connectivity) in enumerate(self.projections)]
+        owners += [(f'monitor{index}', monitor) for index, monitor in enumerate(self.monitors)]
+        if self.scheduler is not None:
+            owners += [(f'process{index}', process) for index, process in enumerate(self.scheduler.processes)]
+        return owners
+
+    def checkpoint_state(self):
+        """All state arrays of the populations, projections, monitors and processes, keyed by owner."""
+        arrays = {}
+        for prefix, owner in self._state_owners():
+            if hasattr(owner, 'checkpoint_state'):
+                for name, array in owner.checkpoint_state().items():
+                    arrays[f'{prefix}/{name}'] = array
+        return arrays
+
+    def state_versions(self):
+        """``state_version`` of every owner that tracks changes to its state.
+
+        An owner's ``state_version`` covers all of its arrays, or is a dict
+        with one version per array name for owners whose arrays change at
+        different rates. Keys are owner prefixes or, for such dicts, keys of
+        ``checkpoint_state``.
+        """
+        versions = {}
+        for prefix, owner in self._state_owners():
+            version = getattr(owner, 'state_version', None)
+            if isinstance(version, dict):
+                versions.update((f'{prefix}/{name}', value) for name, value in version.items())
+            elif version is not None:
+                versions[prefix] = version
+        return versions
+
+    def restore_state(self, arrays):
+        """Hand arrays from ``checkpoint_state`` back to their owners.
+
+        The simulation must have been built with the same populations,
+        projections, monitors and processes, in the same order, as the one
+        that was checkpointed.
+        """
+        grouped = {}
+        for key, array in arrays.items():
+            prefix, name = key.split('/', 1)
+            grouped.setdefault(prefix, {})[name] = array
+        for prefix, owner in self._state_owners():
+            if hasattr(owner, 'restore_state'):
+                if prefix not in grouped:
+                    raise DataValidationError(f"Checkpoint holds no state for {prefix}")
+                owner.restore_state(grouped.pop(prefix))
+        if grouped:
+            raise DataValidationError(f"Checkpoint state does not match the simulation: {sorted(grouped)}")
 
     def step(self):
         """Advance neuron simulation by one time step."""
-        # Implement neuron simulation logic here
-        pass
+        for index, population in enumerate(self.populations):
+            self.spikes[index] = population.update()
+        for source, target, connectivity in self.projections:
+            connectivity.propagate(self.spikes[source], self.populations[target].synaptic_input)
+        for monitor in self.monitors:
+            monitor(self)
+
+class EventDrivenSimulation(NeuronSimulation):
+    """Clock-free simulation that jumps analytically from one spike event to the next.
+
+    Instead of stepping every neuron, the simulation keeps a heap of
+    predicted threshold crossings and pending spike deliveries and only
+    touches the neurons involved in the next event. Populations must have a
+    closed-form subthreshold solution and provide ``evolve(neurons, elapsed)``,
+    ``apply_input(neurons, values)``, ``threshold_reached(neurons)``,
+    ``fire(neurons)`` and ``time_to_threshold(neurons)``. Projections must
+    expose CSR ``indices``, ``weights`` and ``delays`` (in steps of
+    ``time_step``) with an ``outgoing`` lookup, like a sparse connectivity
+    matrix. ``run(duration)`` takes the same number of steps as the
+    fixed-step loop; spikes are collected in ``spike_log``.
+    """
+    THRESHOLD_EVENT = 0
+    DELIVERY_EVENT = 1
+
+    def __init__(self, parameters, populations=None):
+        super().__init__(parameters, populations)
+        self.spike_log = []
+        self._queue = []
+        self._counter = itertools.count()
+        self._last_update = []
+        self._version = []
+
+    def connect(self, source, target, connectivity):
+        """Route spikes of population ``source`` into population ``target``."""
+        super().connect(source, target, getattr(connectivity, 'connectivity', connectivity))
+
+    def initialize(self):
+        """Reset all populations and predict their first threshold crossings."""
+        super().initialize()
+        self._queue = []
+        self._last_update = [np.zeros(population.size) for population in self.populations]
+        self._version = [np.zeros(population.size, dtype=np.int64) for population in self.populations]
+        self.spike_log = [[] for _ in self.populations]
+        for index, population in enumerate(self.populations):
+            self._predict(index, np.arange(population.size), 0.0)
+
+    def checkpoint_state(self):
+        raise SimulationError("Event-driven simulations cannot be checkpointed")
+
+    def spike_times(self, population_index):
+        """Return the (neuron, time) pairs of all spikes of a population."""
+        log = self.spike_log[population_index]
+        if not log:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        neurons = np.concatenate([entry[0] for entry in log])
+        times = np.concatenate([np.full(len(entry[0]), entry[1]) for entry in log])
+        return neurons, times
+
+    def _predict(self, index, neurons, now):
+        waits = self.populations[index].time_to_threshold(neurons)
+        version = self._version[index]
+        for neuron, wait in zip(neurons.tolist(), waits.tolist()):
+            if wait != np.inf:
+                heapq.heappush(self._queue, (now + wait, next(self._counter), self.THRESHOLD_EVENT,
+                                             index, (neuron, version[neuron])))
+
+    def _advance(self, index, neurons, now):
+        self.populations[index].evolve(neurons, now - self._last_update[index][neurons])
+        self._last_update[index][neurons] = now
+
+    def _emit(self, index, neurons, now):
+        self.populations[index].fire(neurons)
+        self._version[index][neurons] += 1
+        self.spike_log[index].append((neurons, now))
+        for projection, (source, _, connectivity) in enumerate(self.projections):
+            if source != index:
+                continue
+            synapses = connectivity.outgoing(neurons)
+            delays = connectivity.delays[synapses]
+            for delay in np.unique(delays).tolist():
+                heapq.heappush(self._queue, (now + delay * self.time_step, next(self._counter),
+                                             self.DELIVERY_EVENT, projection, synapses[delays == delay]))
+        self._predict(index, neurons, now)
+
+    def _deliver(self, projection, synapses, now):
+        _, index, connectivity = self.projections[projection]
+        population = self.populations[index]
+        neurons, inverse = np.unique(connectivity.indices[synapses], return_inverse=True)
+        neurons = neurons.astype(np.intp)
+        values = np.bincount(inverse, weights=connectivity.weights[synapses], minlength=len(neurons))
+        self._advance(index, neurons, now)
+        population.apply_input(neurons, values)
+        self._version[index][neurons] += 1
+        crossed = population.threshold_reached(neurons)
+        if np.any(crossed):
+            self._emit(index, neurons[crossed], now)
+        self._predict(index, neurons[~crossed], now)
+
+    def run(self, duration):
+        """Process all events up to ``duration`` time steps."""
+        self.is_running = True
+        start_time = time.time()
+        end = duration * self.time_step
+        while self.is_running and self._queue and self._queue[0][0] <= end:
+            now, _, kind, index, payload = heapq.heappop(self._queue)
+            if kind == self.THRESHOLD_EVENT:
+                neuron, version = payload
+                if version != self._version[index][neuron]:
+                    continue
+                neurons = np.array([neuron], dtype=np.intp)
+                self._advance(index, neurons, now)
+                self._emit(index, neurons, now)
+            else:
+                self._deliver(index, payload, now)
+            self.current_time = now / self.time_step
+        if self.is_running:
+            self.current_time = duration
+        end_time = time.time()
+        print(f"Simulation completed in {end_time - start_time} seconds.")
@@ -1 +1,92 @@
-# Simulates brain energy metabolism and its impact on brain function
\ No newline at end of file
+# Simulates brain energy metabolism and its impact on brain function
+
+import numpy as np
+from ..common.error_handling import ParameterValueError
+from ..common.reaction_network import ReactionNetwork, ReactionBatch
+
+def lactate_shuttle_network(blood_flow=0.01, blood_glucose=5.0, atp_turnover=0.06):
+    """Region-level glucose supply and astrocyte-neuron lactate shuttle, in mM and s.
+
+    Glucose enters from the blood in proportion to ``blood_flow`` (1/s) and
+    is either oxidized by neurons or, for every glutamate molecule that
+    astrocytes take up, converted to two lactate that neurons oxidize in
+    turn. Glutamate clearance takes milliseconds while the metabolite pools
+    change over minutes, which makes the network stiff.
+    """
+    network = ReactionNetwork(['glucose', 'lactate', 'glutamate', 'atp', 'adp'],
+                              initial={'glucose': 2.0, 'lactate': 1.0, 'atp': 2.5, 'adp': 0.1})
+    network.add_reaction([], 'glucose', blood_flow * blood_glucose, name='glucose_delivery')
+    network.add_reaction('glucose', [], blood_flow, name='glucose_clearance')
+    network.add_reaction([], 'glutamate', 0.0, name='glutamate_release')
+    network.add_reaction(['glutamate', 'glucose'], {'lactate': 2}, 100.0, name='astrocytic_glycolysis')
+    network.add_michaelis_menten('glucose', {'atp': 30}, 0.045, 1.0, enzyme='adp', cosubstrates={'adp': 30},
+                                 name='neuronal_glucose_oxidation')
+    network.add_michaelis_menten('lactate', {'atp': 15}, 0.03, 0.5, enzyme='adp', cosubstrates={'adp': 15},
+                                 name='neuronal_lactate_oxidation')
+    network.add_reaction('lactate', [], blood_flow, name='lactate_clearance')
+    network.add_reaction('atp', 'adp', atp_turnover, name='atp_hydrolysis')
+    return network
+
+class RegionalMetabolism:
+    """Energy metabolism of every brain region, coupled to its activity and blood flow.
+
+    Activity releases glutamate and raises neuronal ATP consumption, both
+    linearly in the activity level; blood flow sets glucose delivery and
+    the clearance of glucose and lactate. All regions are integrated by one
+    stiff batch, and regions at steady state are skipped.
+
+    Args:
+        n_regions (int): Number of regions.
+        blood_flow (float or np.ndarray): Initial blood flow per region in 1/s.
+        blood_glucose (float): Arterial glucose in mM.
+        glutamate_per_activity (float): Glutamate release (mM/s) per unit of activity.
+        atp_cost_per_activity (float): Added ATP hydrolysis rate constant (1/s) per unit of activity.
+    """
+    def __init__(self, n_regions, blood_flow=0.01, blood_glucose=5.0, glutamate_per_activity=0.01,
+                 atp_cost_per_activity=0.06, rtol=1e-4, atol=1e-9):
+        self.n_regions = n_regions
+        self.blood_glucose = blood_glucose
+        self.glutamate_per_activity = glutamate_per_activity
+        self.atp_cost_per_activity = atp_cost_per_activity
+        self.network = lactate_shuttle_network(blood_glucose=blood_glucose)
+        self.batch = ReactionBatch(self.network, n_regions, rtol=rtol, atol=atol)
+        self._resting_turnover = self.batch.rate_constants[:, self.network.reaction_index('atp_hydrolysis')].copy()
+        self.set_blood_flow(blood_flow)
+
+    def set_blood_flow(self, blood_flow):
+        """Set blood flow (1/s) per region, e.g. from a neurovascular coupling model."""
+        blood_flow = np.broadcast_to(np.asarray(blood_flow, dtype=np.float64), self.n_regions)
+        if np.any(blood_flow < 0):
+            raise ParameterValueError('blood_flow', "Blood flow must not be negative")
+        self.batch.set_rate_constant('glucose_delivery', blood_flow * self.blood_glucose)
+        self.batch.set_rate_constant('glucose_clearance', blood_flow)
+        self.batch.set_rate_constant('lactate_clearance', blood_flow)
+
+    def set_activity(self, activity):
+        """Set the activity level of every region until the next call."""
+        activity = np.broadcast_to(np.asarray(activity, dtype=np.float64), self.n_regions)
+        if np.any(activity < 0):
+            raise ParameterValueError('activity', "Activity must not be negative")
+        self.batch.set_rate_constant('glutamate_release', self.glutamate_per_activity * activity)
+        self.batch.set_rate_constant('atp_hydrolysis', self._resting_turnover + self.atp_cost_per_activity * activity)
+
+    def step(self, duration):
+        """Integrate all regions over ``duration`` seconds; returns the number integrated."""
+        return self.batch.advance(duration)
+
+    def concentration(self, species):
+        return self.batch.concentration(species)
+
+    def _rates(self, name):
+        rates = self.network.rates(self.batch.state, self.batch.rate_constants)
+        return rates[:, self.network.reaction_index(name)]
+
+    def glucose_consumption(self):
+        """Glucose used per second (mM/s) by neurons and astrocytes of every region."""
+        return self._rates('neuronal_glucose_oxidation') + self._rates('astrocytic_glycolysis')
+
+    def lactate_shuttle_fraction(self):
+        """Share of neuronal ATP synthesis fuelled by astrocytic lactate in every region."""
+        from_lactate = 15.0 * self._rates('neuronal_lactate_oxidation')
+        from_glucose = 30.0 * self._rates('neuronal_glucose_oxidation')
+        return from_lactate / np.maximum(from_lactate + from_glucose, 1e-300)
@@ -1 +1,164 @@
-# Integrates connectome data for comprehensive brain modeling
\ No newline at end of file
+# Integrates connectome data for comprehensive brain modeling
+
+import os
+import time
+import numpy as np
+import pandas as pd
+from ..common.data_handling import read_csv, write_csv, read_json, write_json, load_arrays, save_arrays
+from ..common.error_handling import DataImportError
+from ..circuits.connectivity_matrix import ConnectivityMatrix
+
+class Connectome:
+    """Synaptic connectivity of a whole brain together with per-neuron annotations.
+
+    The arrays are usually memory maps opened by ``load_connectome``, so
+    extracting a region or sub-network only reads the rows it touches.
+    """
+    def __init__(self, connectivity, region_labels=None, positions=None):
+        self.connectivity = connectivity
+        self.region_labels = region_labels
+        self.positions = positions
+
+    @property
+    def n_neurons(self):
+        return self.connectivity.n_pre
+
+    def region_neurons(self, region):
+        """Indices of the neurons assigned to a region."""
+        if self.region_labels is None:
+            raise DataImportError("Connectome has no region labels")
+        return np.flatnonzero(np.asarray(self.region_labels) == region)
+
+    def subnetwork(self, neurons):
+        """Synapses among the given neurons, renumbered in ascending neuron order.
+
+        Args:
+            neurons (slice or np.ndarray): A contiguous range or a set of neuron indices.
+        """
+        if isinstance(neurons, slice):
+            start, stop, _ = neurons.indices(self.n_neurons)
+            return self.connectivity.row_slice(start, stop).column_slice(start, stop)
+        neurons = np.unique(neurons)
+        connectivity = self.connectivity
+        synapses = connectivity.outgoing(neurons)
+        new_index = np.full(connectivity.n_post, -1, dtype=np.int64)
+        new_index[neurons] = np.arange(len(neurons))
+        post = new_index[connectivity.indices[synapses]]
+        keep = post >= 0
+        counts = connectivity.indptr[neurons + 1] - connectivity.indptr[neurons]
+        pre = np.repeat(np.arange(len(neurons)), counts)[keep]
+        indptr = np.zeros(len(neurons) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pre, minlength=len(neurons)), out=indptr[1:])
+        synapses = synapses[keep]
+        return ConnectivityMatrix(indptr, post[keep], connectivity.weights[synapses],
+                                  connectivity.delays[synapses], len(neurons), connectivity.time_step)
+
+    def region_subnetwork(self, region):
+        """Synapses among the neurons of one region."""
+        return self.subnetwork(self.region_neurons(region))
+
+def save_connectome(directory, connectome):
+    """Store a connectome as binary arrays that ``load_connectome`` can memory-map."""
+    connectome.connectivity.save(os.path.join(directory, 'connectivity'))
+    annotations = {name: values for name, values in (('region_labels', connectome.region_labels),
+                                                     ('positions', connectome.positions))
+                   if values is not None}
+    save_arrays(os.path.join(directory, 'neurons'), annotations)
+
+def load_connectome(directory, mmap_mode='r'):
+    """Open a connectome written by ``save_connectome`` without parsing or copying it."""
+    connectivity = ConnectivityMatrix.load(os.path.join(directory, 'connectivity'), mmap_mode)
+    annotations, _ = load_arrays(os.path.join(directory, 'neurons'), mmap_mode)
+    return Connectome(connectivity, annotations.get('region_labels'), annotations.get('positions'))
+
+def _edge_table(connectivity):
+    return {
+        'pre': connectivity.presynaptic_indices(),
+        'post': connectivity.indices,
+        'weight': connectivity.weights,
+        'delay': connectivity.delays * connectivity.time_step,
+    }
+
+def write_connectome_csv(file_path, connectivity):
+    """Write the synapses as a CSV edge list (delays in ms)."""
+    write_csv(pd.DataFrame(_edge_table(connectivity)), file_path)
+
+def read_connectome_csv(file_path, n_pre, n_post, time_step):
+    """Parse a CSV edge list written by ``write_connectome_csv``."""
+    edges = read_csv(file_path)
+    return ConnectivityMatrix.from_edges(edges['pre'].to_numpy(), edges['post'].to_numpy(),
+                                         edges['weight'].to_numpy(), n_pre, n_post,
+                                         edges['delay'].to_numpy(), time_step)
+
+def write_connectome_json(file_path, connectivity):
+    """Write the synapses as a JSON object of edge lists (delays in ms)."""
+    table = {name: values.tolist() for name, values in _edge_table(connectivity).items()}
+    table.update(n_pre=connectivity.n_pre, n_post=connectivity.n_post, time_step=connectivity.time_step)
+    write_json(table, file_path)
+
+def read_connectome_json(file_path):
+    """Parse a JSON edge list written by ``write_connectome_json``."""
+    table = read_json(file_path)
+    return ConnectivityMatrix.from_edges(table['pre'], table['post'], table['weight'], table['n_pre'],
+                                         table['n_post'], table['delay'], table['time_step'])
+
+def _drop_page_cache(path):
+    """Ask the OS to evict a file (or all files below a directory) from the page cache."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    paths = [path] if os.path.isfile(path) else \
+        [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    for file_path in paths:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def _disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def benchmark_connectome_loading(connectivity, directory, subnetwork=None):
+    """Compare cold-start load time of the CSV, JSON and memory-mapped formats.
+
+    Every format is written to ``directory`` and evicted from the page cache
+    (where the OS supports it) before timing. For the memory-mapped format
+    the time to open the connectome and the time to extract ``subnetwork``
+    (a slice, by default the first tenth of the neurons) are reported
+    separately, since opening reads no synapse data at all.
+
+    Returns:
+        dict: Seconds and bytes on disk per format.
+    """
+    os.makedirs(directory, exist_ok=True)
+    csv_path = os.path.join(directory, 'connectome.csv')
+    json_path = os.path.join(directory, 'connectome.json')
+    binary_path = os.path.join(directory, 'connectome')
+    write_connectome_csv(csv_path, connectivity)
+    write_connectome_json(json_path, connectivity)
+    save_connectome(binary_path, Connectome(connectivity))
+    if subnetwork is None:
+        subnetwork = slice(0, max(connectivity.n_pre // 10, 1))
+
+    results = {}
+    for name, path, load in (
+            ('csv', csv_path, lambda: read_connectome_csv(csv_path, connectivity.n_pre, connectivity.n_post,
+                                                         connectivity.time_step)),
+            ('json', json_path, lambda: read_connectome_json(json_path))):
+        _drop_page_cache(path)
+        start = time.perf_counter()
+        load()
+        results[name] = {'load_seconds': time.perf_counter() - start, 'bytes': _disk_size(path)}
+
+    _drop_page_cache(binary_path)
+    start = time.perf_counter()
+    connectome = load_connectome(binary_path)
+    opened = time.perf_counter()
+    connectome.subnetwork(subnetwork)
+    results['memmap'] = {'load_seconds': opened - start,
+                         'subnetwork_seconds': time.perf_counter() - opened,
+                         'bytes': _disk_size(binary_path)}
+    return results
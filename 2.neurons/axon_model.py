@@ -1 +1,42 @@
-# Axonal characteristics and signal transmission
\ No newline at end of file
+# Axonal characteristics and signal transmission
+
+import numpy as np
+from ..common.constants import AXONAL_CONDUCTION_VELOCITY
+from ..common.error_handling import ParameterValueError
+
+def conduction_delay(axon_length, conduction_velocity=AXONAL_CONDUCTION_VELOCITY, synaptic_delay=0.0):
+    """Time in ms for a spike to reach the synapse at the end of an axon.
+
+    Args:
+        axon_length (float or np.ndarray): Axon length in mm.
+        conduction_velocity (float or np.ndarray): Conduction velocity in m/s (equal to mm/ms).
+        synaptic_delay (float): Fixed transmission delay added at the synapse, in ms.
+    """
+    conduction_velocity = np.asarray(conduction_velocity, dtype=np.float64)
+    if np.any(conduction_velocity <= 0):
+        raise ParameterValueError('conduction_velocity', "Conduction velocity must be positive")
+    return synaptic_delay + np.asarray(axon_length, dtype=np.float64) / conduction_velocity
+
+def axon_lengths(connectivity, pre_positions, post_positions):
+    """Straight-line axon length (mm) of every synapse of a connectivity matrix.
+
+    Args:
+        connectivity (ConnectivityMatrix): Synapses to measure.
+        pre_positions (np.ndarray): ``(n_pre, 3)`` soma coordinates in mm.
+        post_positions (np.ndarray): ``(n_post, 3)`` soma coordinates in mm.
+    """
+    pre = connectivity.presynaptic_indices()
+    offsets = np.asarray(post_positions)[connectivity.indices] - np.asarray(pre_positions)[pre]
+    return np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+
+def assign_conduction_delays(connectivity, lengths, conduction_velocity=AXONAL_CONDUCTION_VELOCITY,
+                             synaptic_delay=0.0):
+    """Overwrite the per-synapse delays of a connectivity matrix from axon lengths.
+
+    Delays are rounded to whole time steps of the matrix (at least one),
+    ready to be used by a delay queue.
+    """
+    delays = conduction_delay(lengths, conduction_velocity, synaptic_delay)
+    steps = np.rint(delays / connectivity.time_step)
+    connectivity.delays[:] = np.maximum(steps, 1)
+    return connectivity
@@ -1 +1,177 @@
-# Dendritic properties and functions
\ No newline at end of file
+# Dendritic properties and functions
+
+import time
+import numpy as np
+from ..common.constants import NEURON_RESTING_POTENTIAL, SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+
+UM_TO_CM = 1e-4
+
+def axial_conductances(morphology, axial_resistivity=100.0):
+    """Conductance (mS) between every compartment and its parent; zero for the root.
+
+    Each compartment contributes the resistance of its half cylinder.
+
+    Args:
+        morphology (Morphology): Compartment tree.
+        axial_resistivity (float): Cytoplasmic resistivity in Ohm cm.
+    """
+    radius = morphology.diameters / 2.0 * UM_TO_CM
+    half_resistance = axial_resistivity * (morphology.lengths / 2.0 * UM_TO_CM) / (np.pi * radius ** 2)
+    parents = np.maximum(morphology.parents, 0)
+    conductance = 1e3 / (half_resistance + half_resistance[parents])
+    conductance[morphology.parents < 0] = 0.0
+    return conductance
+
+class CableSolver:
+    """Implicit (backward Euler) cable equation for many cells sharing one morphology.
+
+    The compartment tree gives a matrix that is tridiagonal up to branch
+    points, which Hines elimination solves in O(n) instead of the O(n^3) of
+    a dense solve. Compartments are processed in levels of equal depth from
+    the root, so all cells of the batch and all compartments of a level are
+    handled by one vectorized operation. Because only leak conductances
+    enter the matrix, it is factored once and every step only performs the
+    forward elimination and back substitution of the right-hand side.
+
+    State arrays have shape ``(n_compartments, n_cells)``. Per-cell geometry
+    can be varied by giving membrane parameters of that shape. The
+    morphology must be Hines-ordered, as renumbering it here would change
+    the compartment index of every current and voltage; renumber other
+    morphologies with ``morphology.reordered()`` first.
+
+    Units: mV, ms, nA, uF/cm^2, mS/cm^2 and Ohm cm.
+    """
+    def __init__(self, morphology, n_cells=1, time_step=SIMULATION_TIME_STEP, capacitance=1.0,
+                 g_leak=0.1, e_leak=NEURON_RESTING_POTENTIAL, axial_resistivity=100.0):
+        if not morphology.is_hines_ordered():
+            raise DataValidationError("Cable solver needs a Hines-ordered morphology; see Morphology.reordered")
+        if time_step <= 0:
+            raise ParameterValueError('time_step', "Time step must be positive")
+        self.morphology = morphology
+        self.n_cells = int(n_cells)
+        self.time_step = time_step
+        self.e_leak = e_leak
+        shape = (morphology.n_compartments, self.n_cells)
+        area = morphology.surface_areas()[:, None] * UM_TO_CM ** 2
+        self.membrane_capacitance = np.broadcast_to(capacitance * area, shape).copy()
+        self.leak_conductance = np.broadcast_to(g_leak * area, shape).copy()
+        self.axial = np.broadcast_to(axial_conductances(morphology, axial_resistivity)[:, None], shape).copy()
+        self.v = np.full(shape, float(e_leak))
+        self._rhs = np.empty(shape)
+        self._levels = self._build_levels()
+        self._factor()
+
+    def _build_levels(self):
+        """Group non-root compartments by depth, sorted by parent for segmented sums."""
+        parents = self.morphology.parents
+        depths = self.morphology.depths()
+        levels = []
+        for depth in range(1, depths.max() + 1 if len(depths) > 1 else 1):
+            nodes = np.flatnonzero(depths == depth)
+            nodes = nodes[np.argsort(parents[nodes], kind='stable')]
+            node_parents = parents[nodes]
+            unique_parents, starts = np.unique(node_parents, return_index=True)
+            shared = len(unique_parents) < len(nodes)
+            levels.append((nodes, node_parents, unique_parents, starts if shared else None))
+        return levels
+
+    def _scatter_subtract(self, target, level, values):
+        nodes, node_parents, unique_parents, starts = level
+        if starts is None:
+            target[node_parents] -= values
+        else:
+            target[unique_parents] -= np.add.reduceat(values, starts, axis=0)
+
+    def _factor(self):
+        """Eliminate the matrix from the leaves to the root once."""
+        parents = self.morphology.parents
+        diagonal = self.membrane_capacitance / self.time_step + self.leak_conductance + self.axial
+        child_sum = np.zeros_like(diagonal)
+        np.add.at(child_sum, parents[1:], self.axial[1:])
+        diagonal += child_sum
+        self._off_diagonal = -self.axial
+        self._factors = np.zeros_like(diagonal)
+        for level in reversed(self._levels):
+            nodes = level[0]
+            factors = self._off_diagonal[nodes] / diagonal[nodes]
+            self._factors[nodes] = factors
+            self._scatter_subtract(diagonal, level, factors * self._off_diagonal[nodes])
+        self._diagonal = diagonal
+
+    def step(self, current=None):
+        """Advance all cells by one time step.
+
+        Args:
+            current (np.ndarray): Injected current in nA, broadcastable to
+                ``(n_compartments, n_cells)``.
+        """
+        rhs = self._rhs
+        np.multiply(self.membrane_capacitance, self.v, out=rhs)
+        rhs /= self.time_step
+        rhs += self.leak_conductance * self.e_leak
+        if current is not None:
+            rhs += np.asarray(current) * 1e-3
+        for level in reversed(self._levels):
+            nodes = level[0]
+            self._scatter_subtract(rhs, level, self._factors[nodes] * rhs[nodes])
+        v = self.v
+        np.divide(rhs[0], self._diagonal[0], out=v[0])
+        for nodes, node_parents, _, _ in self._levels:
+            v[nodes] = (rhs[nodes] - self._off_diagonal[nodes] * v[node_parents]) / self._diagonal[nodes]
+        return v
+
+    def dense_matrix(self, cell=0):
+        """System matrix of one cell, for verification against a dense solve."""
+        n = self.morphology.n_compartments
+        parents = self.morphology.parents
+        matrix = np.zeros((n, n))
+        matrix[np.arange(n), np.arange(n)] = self.membrane_capacitance[:, cell] / self.time_step + \
+            self.leak_conductance[:, cell]
+        for i in range(1, n):
+            g = self.axial[i, cell]
+            p = parents[i]
+            matrix[i, i] += g
+            matrix[p, p] += g
+            matrix[i, p] = matrix[p, i] = -g
+        return matrix
+
+def benchmark_cable_solver(morphology, cell_counts=(1, 100, 1000), steps=100, dense_limit=2000):
+    """Compartments updated per second by the batched Hines solver.
+
+    For morphologies up to ``dense_limit`` compartments a per-cell dense
+    ``np.linalg.solve`` is timed as the baseline, and the largest difference
+    between the two solutions is reported. The morphology is renumbered
+    into Hines order first if necessary.
+    """
+    if not morphology.is_hines_ordered():
+        morphology = morphology.reordered()
+    results = {}
+    for n_cells in cell_counts:
+        solver = CableSolver(morphology, n_cells)
+        current = np.zeros((morphology.n_compartments, n_cells))
+        current[0] = 0.1
+        start = time.perf_counter()
+        for _ in range(steps):
+            solver.step(current)
+        elapsed = time.perf_counter() - start
+        results[n_cells] = {'compartments_per_second': morphology.n_compartments * n_cells * steps / elapsed}
+
+    if morphology.n_compartments <= dense_limit:
+        solver = CableSolver(morphology, 1)
+        matrix = solver.dense_matrix()
+        current = np.zeros((solver.morphology.n_compartments, 1))
+        current[0] = 0.1
+        v = solver.v[:, 0].copy()
+        dense_steps = max(steps // 10, 1)
+        start = time.perf_counter()
+        for _ in range(dense_steps):
+            rhs = solver.membrane_capacitance[:, 0] * v / solver.time_step + \
+                solver.leak_conductance[:, 0] * solver.e_leak + current[:, 0] * 1e-3
+            v = np.linalg.solve(matrix, rhs)
+        elapsed = time.perf_counter() - start
+        for _ in range(dense_steps):
+            solver.step(current)
+        results['dense'] = {'compartments_per_second': morphology.n_compartments * dense_steps / elapsed,
+                            'max_difference': float(np.abs(solver.v[:, 0] - v).max())}
+    return results
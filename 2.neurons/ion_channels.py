@@ -1 +1,190 @@
-# Detailed ion channel models
\ No newline at end of file
+# Detailed ion channel models
+
+import numpy as np
+from ..common.constants import (
+    NA_CONCENTRATION_OUT,
+    NA_CONCENTRATION_IN,
+    K_CONCENTRATION_OUT,
+    K_CONCENTRATION_IN,
+    BRAIN_TEMPERATURE,
+    SIMULATION_TIME_STEP,
+)
+from ..common.error_handling import ParameterValueError
+
+GAS_CONSTANT = 8.314462618  # J / (mol K)
+FARADAY_CONSTANT = 96485.33212  # C / mol
+HH_REFERENCE_TEMPERATURE = 6.3  # Celsius, temperature of the squid axon recordings
+
+def nernst_potential(concentration_out, concentration_in, valence, temperature=BRAIN_TEMPERATURE):
+    """Reversal potential (mV) of an ion from its concentrations on both sides of the membrane."""
+    kelvin = temperature + 273.15
+    return 1e3 * GAS_CONSTANT * kelvin / (valence * FARADAY_CONSTANT) * np.log(concentration_out / concentration_in)
+
+SODIUM_REVERSAL_POTENTIAL = nernst_potential(NA_CONCENTRATION_OUT, NA_CONCENTRATION_IN, 1)
+POTASSIUM_REVERSAL_POTENTIAL = nernst_potential(K_CONCENTRATION_OUT, K_CONCENTRATION_IN, 1)
+
+def temperature_factor(temperature, q10=3.0, reference=HH_REFERENCE_TEMPERATURE):
+    """Q10 scaling of the gating rates at ``temperature`` relative to ``reference``."""
+    return q10 ** ((temperature - reference) / 10.0)
+
+def _linear_exponential(x, y):
+    """``x / (1 - exp(-x / y))`` with its removable singularity at ``x = 0`` filled in."""
+    x = np.asarray(x, dtype=np.float64)
+    ratio = x / y
+    small = np.abs(ratio) < 1e-6
+    safe = np.where(small, 1.0, ratio)
+    return np.where(small, y * (1.0 + ratio / 2.0), x / -np.expm1(-safe))
+
+# Hodgkin-Huxley rate functions (1/ms) at 6.3 C, membrane potential in mV with rest near -65 mV.
+def sodium_activation_alpha(v):
+    return 0.1 * _linear_exponential(v + 40.0, 10.0)
+
+def sodium_activation_beta(v):
+    return 4.0 * np.exp(-(v + 65.0) / 18.0)
+
+def sodium_inactivation_alpha(v):
+    return 0.07 * np.exp(-(v + 65.0) / 20.0)
+
+def sodium_inactivation_beta(v):
+    return 1.0 / (1.0 + np.exp(-(v + 35.0) / 10.0))
+
+def potassium_activation_alpha(v):
+    return 0.01 * _linear_exponential(v + 55.0, 10.0)
+
+def potassium_activation_beta(v):
+    return 0.125 * np.exp(-(v + 65.0) / 80.0)
+
+def gate_coefficients(alpha, beta, v, time_step, rate_factor=1.0):
+    """Steady state and one-step decay factor of a gate, evaluated directly.
+
+    With these, the exponential-Euler step ``x = x_inf + (x - x_inf) * decay``
+    is exact for a membrane potential held constant over the step and
+    stable for any time step.
+    """
+    alpha_v = rate_factor * alpha(v)
+    beta_v = rate_factor * beta(v)
+    total = alpha_v + beta_v
+    return alpha_v / total, np.exp(-time_step * total)
+
+class VoltageGrid:
+    """Evenly spaced membrane potentials on which rate tables are sampled."""
+    def __init__(self, v_min=-120.0, v_max=80.0, resolution=0.01):
+        if resolution <= 0 or v_max <= v_min:
+            raise ParameterValueError('resolution', "Voltage grid needs a positive resolution and range")
+        self.v_min = v_min
+        self.v_max = v_max
+        self.resolution = resolution
+        self.size = int(np.ceil((v_max - v_min) / resolution)) + 1
+        self.voltages = v_min + resolution * np.arange(self.size)
+
+    def key(self):
+        return (self.v_min, self.v_max, self.resolution)
+
+    def locate(self, v, index, fraction):
+        """Write the grid cell and position within it of every potential into ``index`` and ``fraction``.
+
+        Potentials outside the grid are clamped to its ends.
+        """
+        np.subtract(v, self.v_min, out=fraction)
+        fraction *= 1.0 / self.resolution
+        np.clip(fraction, 0.0, self.size - 1.000001, out=fraction)
+        np.copyto(index, fraction, casting='unsafe')
+        fraction -= index
+
+class RateTable:
+    """Steady state and decay factor of one gate, tabulated over membrane potential.
+
+    Evaluating the rate exponentials of every gate of every neuron on every
+    step dominates the cost of conductance-based models; the table replaces
+    them with two interpolated lookups. A table depends only on the rate
+    functions, time step and temperature and is shared by all neurons (and
+    populations) of a type through ``rate_table``.
+    """
+    def __init__(self, alpha, beta, time_step=SIMULATION_TIME_STEP, rate_factor=1.0, grid=None):
+        self.grid = VoltageGrid() if grid is None else grid
+        self.steady_state, self.decay = gate_coefficients(alpha, beta, self.grid.voltages, time_step, rate_factor)
+        self._steady_state_slope = np.diff(self.steady_state, append=self.steady_state[-1])
+        self._decay_slope = np.diff(self.decay, append=self.decay[-1])
+
+    def interpolate(self, index, fraction, steady_state, decay, scratch):
+        """Linearly interpolate both tables at located potentials (see ``VoltageGrid.locate``)."""
+        np.take(self.steady_state, index, out=steady_state)
+        np.take(self._steady_state_slope, index, out=scratch)
+        scratch *= fraction
+        steady_state += scratch
+        np.take(self.decay, index, out=decay)
+        np.take(self._decay_slope, index, out=scratch)
+        scratch *= fraction
+        decay += scratch
+
+_RATE_TABLES = {}
+
+def rate_table(alpha, beta, time_step=SIMULATION_TIME_STEP, rate_factor=1.0, grid=None):
+    """Return the shared rate table for a gate, building it on first use."""
+    grid = VoltageGrid() if grid is None else grid
+    key = (alpha, beta, time_step, rate_factor, grid.key())
+    if key not in _RATE_TABLES:
+        _RATE_TABLES[key] = RateTable(alpha, beta, time_step, rate_factor, grid)
+    return _RATE_TABLES[key]
+
+class IonChannel:
+    """Ohmic channel whose conductance is ``g_max`` times a product of gating variables.
+
+    ``gates`` maps each gating variable to ``(power, alpha, beta)``. Gating
+    variables are named per channel type and become state variables of the
+    population that uses the channel.
+
+    Units: mS/cm^2 and mV.
+    """
+    gates = {}
+
+    def __init__(self, g_max, reversal_potential):
+        if np.any(np.asarray(g_max) < 0):
+            raise ParameterValueError('g_max', "Maximal conductance must not be negative")
+        self.g_max = g_max
+        self.reversal_potential = reversal_potential
+
+    def steady_state(self, v, rate_factor=1.0):
+        """Steady-state value of every gate at membrane potential ``v``."""
+        values = {}
+        for name, (_, alpha, beta) in self.gates.items():
+            alpha_v = rate_factor * alpha(v)
+            values[name] = alpha_v / (alpha_v + rate_factor * beta(v))
+        return values
+
+    def conductance(self, state, out):
+        """Write the present conductance of every neuron into ``out``."""
+        out[:] = self.g_max
+        for name, (power, _, _) in self.gates.items():
+            gate = state[name]
+            for _ in range(power):
+                out *= gate
+        return out
+
+class SodiumChannel(IonChannel):
+    """Fast sodium channel with three activation gates and one inactivation gate."""
+    gates = {
+        'm': (3, sodium_activation_alpha, sodium_activation_beta),
+        'h': (1, sodium_inactivation_alpha, sodium_inactivation_beta),
+    }
+
+    def __init__(self, g_max=120.0, reversal_potential=SODIUM_REVERSAL_POTENTIAL):
+        super().__init__(g_max, reversal_potential)
+
+class PotassiumChannel(IonChannel):
+    """Delayed-rectifier potassium channel with four activation gates."""
+    gates = {
+        'n': (4, potassium_activation_alpha, potassium_activation_beta),
+    }
+
+    def __init__(self, g_max=36.0, reversal_potential=POTASSIUM_REVERSAL_POTENTIAL):
+        super().__init__(g_max, reversal_potential)
+
+class LeakChannel(IonChannel):
+    """Voltage-independent leak conductance.
+
+    Without an explicit reversal potential, the population that owns the
+    channel sets it so that its resting potential is an equilibrium.
+    """
+    def __init__(self, g_max=0.3, reversal_potential=None):
+        super().__init__(g_max, reversal_potential)
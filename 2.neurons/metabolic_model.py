@@ -1 +1,78 @@
-# Neuronal metabolism and energy use
\ No newline at end of file
+# Neuronal metabolism and energy use
+
+import numpy as np
+from ..common.error_handling import ParameterValueError
+from ..common.reaction_network import ReactionNetwork, ReactionBatch
+
+def energy_metabolism_network(glucose=1.2, atp=2.5, adp=0.1, phosphocreatine=5.0, creatine=5.0,
+                              atp_turnover=6.4e-5):
+    """Glycolysis, lactate dehydrogenase, oxidative phosphorylation and the creatine kinase buffer, in mM and ms.
+
+    Glycolysis and oxidative phosphorylation saturate in their substrate and
+    scale with ADP, so ATP production follows demand. Lactate
+    dehydrogenase and creatine kinase are near equilibrium and orders of
+    magnitude faster than the pathways they buffer, which makes the network
+    stiff. ``atp_turnover`` is the resting rate constant of ATP hydrolysis.
+    """
+    network = ReactionNetwork(
+        ['glucose', 'pyruvate', 'lactate', 'atp', 'adp', 'phosphocreatine', 'creatine'],
+        initial={'glucose': glucose, 'pyruvate': 0.1, 'lactate': 1.0, 'atp': atp, 'adp': adp,
+                 'phosphocreatine': phosphocreatine, 'creatine': creatine},
+    )
+    network.add_reaction([], 'glucose', 2e-5, name='glucose_uptake')
+    network.add_reaction('glucose', [], 1e-5, name='glucose_efflux')
+    network.add_michaelis_menten('glucose', {'pyruvate': 2, 'atp': 2}, 5e-5, 0.05, enzyme='adp',
+                                 cosubstrates={'adp': 2}, name='glycolysis')
+    network.add_reversible('pyruvate', 'lactate', 1.0, 0.1, name='lactate_dehydrogenase')
+    network.add_reaction('lactate', [], 1e-6, name='lactate_export')
+    network.add_michaelis_menten('pyruvate', {'atp': 15}, 1.5e-4, 0.05, enzyme='adp',
+                                 cosubstrates={'adp': 15}, name='oxidative_phosphorylation')
+    network.add_reaction('atp', 'adp', atp_turnover, name='atp_hydrolysis')
+    network.add_reversible(['phosphocreatine', 'adp'], ['creatine', 'atp'], 0.5, 0.02, name='creatine_kinase')
+    return network
+
+class NeuronalMetabolism:
+    """Energy metabolism of every neuron in a population, driven by its firing rate.
+
+    ATP hydrolysis rises linearly with the firing rate above the resting
+    turnover; the batch engine integrates all neurons together and skips
+    those whose metabolism is at steady state.
+
+    Args:
+        size (int): Number of neurons.
+        network (ReactionNetwork): Metabolic network; defaults to ``energy_metabolism_network()``.
+        cost_per_hz (float): Added ATP hydrolysis rate constant (1/ms) per Hz of firing.
+    """
+    def __init__(self, size, network=None, cost_per_hz=2e-6, rtol=1e-4, atol=1e-9):
+        if cost_per_hz < 0:
+            raise ParameterValueError('cost_per_hz', "Activity cost must not be negative")
+        self.size = size
+        self.batch = ReactionBatch(energy_metabolism_network() if network is None else network, size,
+                                   rtol=rtol, atol=atol)
+        self.cost_per_hz = cost_per_hz
+        self._hydrolysis = self.batch.network.reaction_index('atp_hydrolysis')
+        self._resting_turnover = self.batch.rate_constants[:, self._hydrolysis].copy()
+
+    def set_activity(self, firing_rates):
+        """Set the firing rate (Hz) that drives ATP consumption until the next call."""
+        firing_rates = np.broadcast_to(np.asarray(firing_rates, dtype=np.float64), self.size)
+        self.batch.set_rate_constant(self._hydrolysis, self._resting_turnover + self.cost_per_hz * firing_rates)
+
+    def step(self, duration):
+        """Integrate metabolism; returns the number of neurons that needed integration."""
+        return self.batch.advance(duration)
+
+    def concentration(self, species):
+        return self.batch.concentration(species)
+
+    def energy_charge(self):
+        """``ATP / (ATP + ADP)`` of every neuron."""
+        atp = self.batch.concentration('atp')
+        return atp / (atp + self.batch.concentration('adp'))
+
+    def atp_production(self):
+        """Rate of ATP synthesis (mM/ms) by glycolysis and oxidative phosphorylation of every neuron."""
+        network = self.batch.network
+        rates = network.rates(self.batch.state, self.batch.rate_constants)
+        return 2.0 * rates[:, network.reaction_index('glycolysis')] + \
+            15.0 * rates[:, network.reaction_index('oxidative_phosphorylation')]
@@ -1 +1,169 @@
-# Neuron shape and structural properties
\ No newline at end of file
+# Neuron shape and structural properties
+
+import hashlib
+import numpy as np
+from ..common.error_handling import DataImportError, DataValidationError
+
+# SWC structure identifiers
+SWC_SOMA = 1
+SWC_AXON = 2
+SWC_BASAL_DENDRITE = 3
+SWC_APICAL_DENDRITE = 4
+
+class Morphology:
+    """Tree of cylindrical compartments stored as a parent-index array.
+
+    ``parents[i]`` is the index of the compartment that compartment ``i``
+    hangs from, or -1 for the root (usually the soma). Lengths, diameters
+    and positions are in um; ``types`` holds SWC structure identifiers.
+    """
+    def __init__(self, parents, lengths, diameters, positions=None, types=None):
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.diameters = np.asarray(diameters, dtype=np.float64)
+        n = len(self.parents)
+        self.positions = np.zeros((n, 3)) if positions is None else np.asarray(positions, dtype=np.float64)
+        self.types = np.full(n, SWC_SOMA, dtype=np.int32) if types is None else np.asarray(types, dtype=np.int32)
+        self.validate()
+
+    @property
+    def n_compartments(self):
+        return len(self.parents)
+
+    def validate(self):
+        """Check that the parent array describes a single tree."""
+        n = self.n_compartments
+        if not len(self.lengths) == len(self.diameters) == n:
+            raise DataValidationError("Lengths and diameters must hold one entry per compartment")
+        if np.count_nonzero(self.parents < 0) != 1:
+            raise DataValidationError("Morphology must have exactly one root compartment")
+        if np.any(self.parents >= n) or np.any(self.parents == np.arange(n)):
+            raise DataValidationError("Parent index out of range")
+        if np.any(self.lengths <= 0) or np.any(self.diameters <= 0):
+            raise DataValidationError("Compartment lengths and diameters must be positive")
+
+    def children(self):
+        """CSR arrays ``(indptr, indices)`` listing the children of every compartment."""
+        n = self.n_compartments
+        child = np.flatnonzero(self.parents >= 0)
+        order = np.argsort(self.parents[child], kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.parents[child], minlength=n), out=indptr[1:])
+        return indptr, child[order]
+
+    def is_hines_ordered(self):
+        """True if the root comes first and every parent precedes its children."""
+        return self.parents[0] < 0 and bool(np.all(self.parents[1:] < np.arange(1, self.n_compartments)))
+
+    def hines_order(self):
+        """Depth-first numbering from the root, so every parent precedes its children.
+
+        Each branch occupies a contiguous block, which keeps the elimination
+        of a branch within neighbouring memory.
+        """
+        indptr, indices = self.children()
+        root = int(np.flatnonzero(self.parents < 0)[0])
+        order = np.empty(self.n_compartments, dtype=np.int64)
+        stack = [root]
+        position = 0
+        while stack:
+            node = stack.pop()
+            order[position] = node
+            position += 1
+            stack.extend(indices[indptr[node]:indptr[node + 1]][::-1].tolist())
+        if position != self.n_compartments:
+            raise DataValidationError("Morphology contains compartments not connected to the root")
+        return order
+
+    def reordered(self, order=None):
+        """Copy of the morphology renumbered so new compartment ``i`` is old ``order[i]``."""
+        order = self.hines_order() if order is None else np.asarray(order)
+        new_index = np.empty(self.n_compartments, dtype=np.int64)
+        new_index[order] = np.arange(self.n_compartments)
+        old_parents = self.parents[order]
+        parents = np.where(old_parents < 0, -1, new_index[np.maximum(old_parents, 0)])
+        return Morphology(parents, self.lengths[order], self.diameters[order], self.positions[order],
+                          self.types[order])
+
+    def depths(self):
+        """Number of compartments between each compartment and the root."""
+        if not self.is_hines_ordered():
+            raise DataValidationError("Depths require a Hines-ordered morphology")
+        depths = np.zeros(self.n_compartments, dtype=np.int64)
+        for i in range(1, self.n_compartments):
+            depths[i] = depths[self.parents[i]] + 1
+        return depths
+
+    def surface_areas(self):
+        """Lateral surface of every compartment in um^2."""
+        return np.pi * self.diameters * self.lengths
+
+    def total_length(self):
+        return self.lengths.sum()
+
+    def topology_key(self):
+        """Hash of the branching structure; equal keys mean cells can share a batched solve."""
+        return hashlib.sha1(self.parents.tobytes()).hexdigest()
+
+def parse_swc(file_path):
+    """Read an SWC reconstruction into a ``Morphology`` in file order.
+
+    Every sample point becomes a cylinder reaching back to its parent
+    point. The root sample is treated as a sphere and represented by a
+    cylinder of equal length and diameter, which has the same surface.
+    """
+    try:
+        samples = np.loadtxt(file_path, comments='#', ndmin=2)
+    except (OSError, ValueError) as e:
+        raise DataImportError(f"Could not read SWC file {file_path}: {e}")
+    if samples.shape[1] < 7:
+        raise DataImportError("SWC rows need id, type, x, y, z, radius and parent")
+    ids = samples[:, 0].astype(np.int64)
+    parent_ids = samples[:, 6].astype(np.int64)
+    index_of = dict(zip(ids.tolist(), range(len(ids))))
+    try:
+        parents = np.array([index_of[p] if p >= 0 else -1 for p in parent_ids.tolist()], dtype=np.int64)
+    except KeyError as e:
+        raise DataImportError(f"SWC sample refers to unknown parent {e}")
+    positions = samples[:, 2:5]
+    diameters = 2.0 * samples[:, 5]
+    offsets = positions - positions[np.maximum(parents, 0)]
+    lengths = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+    lengths = np.where(parents < 0, diameters, lengths)
+    # Coincident sample points (common at branch roots) would give zero-length cylinders.
+    lengths = np.maximum(lengths, 1e-3)
+    return Morphology(parents, lengths, diameters, positions, samples[:, 1].astype(np.int32))
+
+_MORPHOLOGY_CACHE = {}
+
+def load_morphology(file_path):
+    """Load an SWC file as a Hines-ordered morphology, memoized by file content.
+
+    Reconstructions are usually loaded many times (one per cell instance),
+    so the parsed and reordered morphology is cached under the SHA-1 of the
+    file. The returned object is shared and must not be modified.
+    """
+    with open(file_path, 'rb') as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    if digest not in _MORPHOLOGY_CACHE:
+        _MORPHOLOGY_CACHE[digest] = parse_swc(file_path).reordered()
+    return _MORPHOLOGY_CACHE[digest]
+
+def random_morphology(n_compartments, branch_probability=0.05, length=20.0, soma_diameter=20.0,
+                      diameter_range=(0.5, 3.0), rng=None):
+    """Random dendritic tree for testing and benchmarks, already Hines-ordered.
+
+    Each new compartment continues the previous one or, with
+    ``branch_probability``, starts a branch from a random earlier compartment.
+    """
+    rng = np.random.default_rng(rng)
+    parents = np.arange(-1, n_compartments - 1)
+    branches = np.flatnonzero(rng.random(n_compartments) < branch_probability)
+    branches = branches[branches > 1]
+    parents[branches] = rng.integers(0, branches)
+    lengths = np.full(n_compartments, length)
+    diameters = rng.uniform(diameter_range[0], diameter_range[1], n_compartments)
+    lengths[0] = diameters[0] = soma_diameter
+    types = np.full(n_compartments, SWC_BASAL_DENDRITE, dtype=np.int32)
+    types[0] = SWC_SOMA
+    return Morphology(parents, lengths, diameters, types=types)
@@ -1 +1,131 @@
-# Synaptic dynamics and models
\ No newline at end of file
+# Synaptic dynamics and models
+
+import numpy as np
+from ..common.constants import MAX_SYNAPTIC_DELAY
+from ..common.error_handling import ParameterValueError
+from ..circuits.connectivity_matrix import expand_rows
+
+def _ensure_capacity(buffer, size):
+    """Return ``buffer`` or a larger replacement that holds at least ``size`` items."""
+    if len(buffer) >= size:
+        return buffer
+    return np.empty(max(size, 2 * len(buffer)), dtype=buffer.dtype)
+
+class SynapticDelayQueue:
+    """Preallocated circular buffer of pending synaptic input.
+
+    The buffer has one slot per delay step and one column per target neuron.
+    Input scheduled with a delay of ``d`` steps is handed out by the
+    ``d + 1``-th following call to ``deliver``, i.e. it reaches the target's
+    update ``d`` steps after the end of the step in which the spike was
+    emitted. Scheduling and delivery are O(1) per event and the memory
+    footprint is fixed regardless of the firing rate.
+    """
+    def __init__(self, n_targets, max_delay_steps):
+        if max_delay_steps < 1:
+            raise ParameterValueError('max_delay_steps', "Delay queue needs at least one delay step")
+        self.n_targets = int(n_targets)
+        self.n_slots = int(max_delay_steps) + 1
+        self.buffer = np.zeros((self.n_slots, self.n_targets))
+        self.head = 0
+        self.state_version = 0
+        self._flat = self.buffer.reshape(-1)
+        self._positions = np.empty(1024, dtype=np.int64)
+
+    def schedule(self, targets, delay_steps, weights):
+        """Queue input for ``targets`` arriving after ``delay_steps`` (0..n_slots - 1) steps."""
+        count = len(targets)
+        if count == 0:
+            return
+        self._positions = _ensure_capacity(self._positions, count)
+        positions = self._positions[:count]
+        np.add(delay_steps, self.head, out=positions)
+        np.remainder(positions, self.n_slots, out=positions)
+        positions *= self.n_targets
+        positions += targets
+        np.add.at(self._flat, positions, weights)
+        self.state_version += 1
+
+    def deliver(self, target):
+        """Add the input due in the next step to ``target`` and advance the head."""
+        slot = self.buffer[self.head]
+        target += slot
+        slot.fill(0.0)
+        self.head = (self.head + 1) % self.n_slots
+        self.state_version += 1
+
+    def pending(self):
+        """Total input still queued for each target."""
+        return self.buffer.sum(axis=0)
+
+    def clear(self):
+        """Drop all queued input."""
+        self.buffer.fill(0.0)
+        self.head = 0
+        self.state_version += 1
+
+    def checkpoint_state(self):
+        return {'buffer': self.buffer, 'head': np.array([self.head])}
+
+    def restore_state(self, arrays):
+        """Adopt a checkpointed buffer in place of the current one."""
+        if arrays['buffer'].shape != self.buffer.shape:
+            raise ParameterValueError('buffer', "Checkpointed delay buffer has a different shape")
+        self.buffer = arrays['buffer']
+        self._flat = self.buffer.reshape(-1)
+        self.head = int(arrays['head'][0])
+        self.state_version += 1
+
+class SynapticPathway:
+    """Connectivity matrix whose spikes arrive after their per-synapse delays.
+
+    Drop-in replacement for a bare connectivity matrix in
+    ``NeuronSimulation.connect``: spikes are scheduled into a delay queue
+    and each call delivers the input due for the next step.
+    """
+    def __init__(self, connectivity, max_delay=None):
+        self.connectivity = connectivity
+        queue_delay = MAX_SYNAPTIC_DELAY if max_delay is None else max_delay
+        capacity = max(int(round(queue_delay / connectivity.time_step)), 1)
+        longest = int(connectivity.delays.max()) if connectivity.n_synapses else 1
+        if longest > capacity:
+            if max_delay is not None:
+                raise ParameterValueError('max_delay', "Synaptic delays exceed the delay queue length")
+            capacity = longest
+        self.queue = SynapticDelayQueue(connectivity.n_post, capacity)
+        self._synapses = np.empty(1024, dtype=np.intp)
+        self._targets = np.empty(1024, dtype=np.int32)
+        self._delays = np.empty(1024, dtype=np.int32)
+        self._weights = np.empty(1024, dtype=np.float32)
+
+    @property
+    def state_version(self):
+        """The queue changes on every step, the weights only when plasticity touches them."""
+        queue = self.queue.state_version
+        return {'queue/buffer': queue, 'queue/head': queue, 'weights': self.connectivity.state_version}
+
+    def checkpoint_state(self):
+        arrays = {f'queue/{name}': array for name, array in self.queue.checkpoint_state().items()}
+        arrays['weights'] = self.connectivity.weights
+        return arrays
+
+    def restore_state(self, arrays):
+        self.queue.restore_state({name[len('queue/'):]: array for name, array in arrays.items()
+                                  if name.startswith('queue/')})
+        self.connectivity.restore_state({'weights': arrays['weights']})
+
+    def propagate(self, spike_indices, target):
+        """Schedule the spikes of this step and deliver the input due next step."""
+        if len(spike_indices):
+            indptr = self.connectivity.indptr
+            count = int((indptr[spike_indices + 1] - indptr[spike_indices]).sum())
+            self._synapses = _ensure_capacity(self._synapses, count)
+            synapses = expand_rows(indptr, spike_indices, out=self._synapses)
+            self._targets = _ensure_capacity(self._targets, count)
+            self._delays = _ensure_capacity(self._delays, count)
+            self._weights = _ensure_capacity(self._weights, count)
+            targets = np.take(self.connectivity.indices, synapses, out=self._targets[:count])
+            delays = np.take(self.connectivity.delays, synapses, out=self._delays[:count])
+            weights = np.take(self.connectivity.weights, synapses, out=self._weights[:count])
+            self.queue.schedule(targets, delays, weights)
+        self.queue.deliver(target)
@@ -1 +1,305 @@
-# Applying information theory to neuronal signals
\ No newline at end of file
+# Information-theoretic analysis of neural codes
+
+import os
+import time
+import numpy as np
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..common.parallel_processing import process_pool_executor
+
+LN2 = np.log(2.0)
+
+def spike_words(binned, word_length, step=None):
+    """Binary spike words of ``word_length`` consecutive bins across all neurons, packed into integers.
+
+    Args:
+        binned (np.ndarray): Spike counts of shape ``(n_neurons, n_bins)`` or ``(n_bins,)``;
+            counts above one are treated as one.
+        word_length (int): Bins per word.
+        step (int): Bins between the starts of consecutive words; defaults to ``word_length``.
+
+    Returns:
+        np.ndarray: One code per word (see ``pack_words``).
+    """
+    binned = np.atleast_2d(np.asarray(binned)) > 0
+    step = word_length if step is None else step
+    n_words = (binned.shape[1] - word_length) // step + 1
+    if n_words < 1:
+        raise ParameterValueError('word_length', "Word length exceeds the number of bins")
+    starts = np.arange(n_words) * step
+    # Bits ordered neuron by neuron, bin by bin within the word.
+    bits = binned[:, starts[:, None] + np.arange(word_length)]
+    return pack_words(bits.transpose(1, 0, 2).reshape(n_words, -1))
+
+def pack_words(bits):
+    """Encode every row of a boolean ``(n_words, n_bits)`` array as one sortable code.
+
+    Up to 64 bits become ``uint64`` integers; longer words become
+    fixed-size byte strings of the packed bits. Either way the codes can be
+    counted with ``np.unique`` instead of a dictionary of tuples.
+    """
+    bits = np.asarray(bits, dtype=bool)
+    n_bits = bits.shape[1]
+    if n_bits <= 64:
+        weights = np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64))
+        return np.bitwise_or.reduce(np.where(bits, weights, np.uint64(0)), axis=1)
+    packed = np.ascontiguousarray(np.packbits(bits, axis=1))
+    return packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+
+def word_counts(words):
+    """Occurrences of every distinct word."""
+    return np.unique(words, return_counts=True)[1]
+
+def plugin_entropy(counts):
+    """Maximum-likelihood entropy in bits of a histogram given by its counts."""
+    counts = np.asarray(counts, dtype=np.float64)
+    counts = counts[counts > 0]
+    total = counts.sum()
+    return float(np.log2(total) - np.dot(counts, np.log2(counts)) / total)
+
+def panzeri_treves_bins(counts, n_states, block=1024):
+    """Number of relevant response bins estimated with the Bayesian procedure of Panzeri & Treves (1996).
+
+    Starting from the observed bins, extra unobserved bins are added as
+    long as the expected number of occupied bins under the resulting
+    posterior approaches the observed number. Candidate numbers of extra
+    bins are evaluated ``block`` at a time, over the distinct count values
+    only.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    values, multiplicity = np.unique(counts[counts > 0], return_counts=True)
+    total = np.dot(values, multiplicity)
+    observed = int(multiplicity.sum())
+    if n_states <= observed:
+        return float(observed)
+    previous = abs(((1.0 - values / total) ** total) @ multiplicity)
+    shrink = 1.0 - (total / (total + observed)) ** (1.0 / total)
+    limit = n_states - observed
+    for first in range(1, int(min(limit, 2 ** 62)) + 1, block):
+        extra = np.arange(first, min(first + block, limit + 1), dtype=np.float64)[:, None]
+        gamma = extra * shrink
+        occupied = (1.0 - gamma) / (total + observed) * (values + 1.0)
+        expected = (1.0 - (1.0 - occupied) ** total) @ multiplicity
+        expected += extra[:, 0] * (1.0 - (1.0 - gamma[:, 0] / extra[:, 0]) ** total)
+        deviation = np.concatenate(([previous], np.abs(observed - expected)))
+        # The procedure stops at the first extra bin that no longer reduces the deviation.
+        rising = np.flatnonzero(np.diff(deviation) >= 0)
+        if len(rising):
+            return float(observed + first - 1 + rising[0])
+        previous = deviation[-1]
+    return float(n_states)
+
+def panzeri_treves_entropy(counts, n_states=np.inf):
+    """Plug-in entropy (bits) with the Panzeri-Treves bias correction ``(R - 1) / (2 N ln 2)``."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    relevant = panzeri_treves_bins(counts, n_states)
+    return plugin_entropy(counts) + (relevant - 1.0) / (2.0 * total * LN2)
+
+def nsb_entropy(counts, n_states, grid_size=2000):
+    """Entropy in bits with the NSB estimator (Nemenman, Shafee & Bialek, 2002).
+
+    The posterior mean of the entropy is averaged over Dirichlet priors
+    with concentration ``beta``, weighted so that the prior on the entropy
+    is nearly flat. The integral over ``beta`` is evaluated on a
+    logarithmic grid, with the counts grouped by value so the cost depends
+    on the number of distinct counts rather than of words. The grid spans
+    the total prior count ``kappa = K beta`` from ``1e-3`` to ``1e3 N``,
+    which holds the evidence peak whatever the alphabet size ``K``; for
+    long words ``beta`` itself lies far below any fixed range.
+
+    Args:
+        counts (np.ndarray): Occurrences of every observed word.
+        n_states (int): Size of the alphabet, e.g. ``2 ** bits_per_word``.
+    """
+    from scipy.special import betaln, digamma, gammaln, polygamma
+
+    counts = np.asarray(counts, dtype=np.float64)
+    counts = counts[counts > 0]
+    if n_states < len(counts):
+        raise ParameterValueError('n_states', "Alphabet is smaller than the number of observed words")
+    values, multiplicity = np.unique(counts, return_counts=True)
+    total = counts.sum()
+    unobserved = n_states - len(counts)
+    kappa = np.logspace(-3.0, 3.0 + np.log10(total), grid_size)
+    beta = (kappa / float(n_states))[:, None]
+    k_beta = n_states * beta
+    # betaln keeps log(Gamma(K beta) / Gamma(N + K beta)) accurate for very large alphabets.
+    log_evidence = (betaln(k_beta, total) - gammaln(total)
+                    + (multiplicity * (gammaln(values + beta) - gammaln(beta))).sum(axis=1, keepdims=True))
+    prior = n_states * polygamma(1, k_beta + 1.0) - polygamma(1, beta + 1.0)
+    log_weight = (log_evidence + np.log(prior) + np.log(beta)).ravel()
+    weight = np.exp(log_weight - log_weight.max())
+    denominator = total + k_beta
+    entropy = digamma(denominator + 1.0) - \
+        ((multiplicity * (values + beta) * digamma(values + beta + 1.0)).sum(axis=1, keepdims=True)
+         + unobserved * beta * digamma(beta + 1.0)) / denominator
+    # A logarithmic grid makes d(beta) proportional to beta, folded into the weights above.
+    return float(np.dot(weight, entropy.ravel()) / weight.sum() / LN2)
+
+ENTROPY_ESTIMATORS = ('plugin', 'panzeri_treves', 'nsb')
+
+def word_entropy(words, estimator='plugin', n_states=None):
+    """Entropy in bits of a sequence of packed words.
+
+    Args:
+        words (np.ndarray): Codes from ``spike_words`` or ``pack_words``.
+        estimator (str): One of ``ENTROPY_ESTIMATORS``.
+        n_states (int): Alphabet size, e.g. ``2 ** bits_per_word``; required by the
+            bias-corrected estimators.
+    """
+    counts = word_counts(words)
+    if estimator == 'plugin':
+        return plugin_entropy(counts)
+    if n_states is None:
+        raise ParameterValueError('n_states', "Bias-corrected estimators need the alphabet size")
+    if estimator == 'panzeri_treves':
+        return panzeri_treves_entropy(counts, n_states)
+    if estimator == 'nsb':
+        return nsb_entropy(counts, n_states)
+    raise ParameterValueError('estimator', f"Unknown entropy estimator: {estimator}")
+
+def mutual_information(stimuli, words, estimator='plugin', n_states=None):
+    """Information in bits that response words carry about stimulus labels, ``H(R) - H(R|S)``.
+
+    The conditional entropy is the stimulus-weighted average of the
+    entropies of the responses to each stimulus, with the same estimator.
+    """
+    stimuli = np.asarray(stimuli)
+    if len(stimuli) != len(words):
+        raise DataValidationError("Every response word needs a stimulus label")
+    labels, inverse = np.unique(stimuli, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    boundaries = np.searchsorted(inverse[order], np.arange(1, len(labels)))
+    conditional = 0.0
+    for group in np.split(order, boundaries):
+        conditional += len(group) / len(words) * word_entropy(words[group], estimator, n_states)
+    return word_entropy(words, estimator, n_states) - conditional
+
+def _shuffled_information(stimuli, words, estimator, n_states, n_shuffles, seed):
+    rng = np.random.default_rng(seed)
+    return [mutual_information(rng.permutation(stimuli), words, estimator, n_states) for _ in range(n_shuffles)]
+
+def shuffle_test(stimuli, words, estimator='plugin', n_states=None, n_shuffles=200, max_workers=None, rng=None):
+    """Mutual information with its shuffle distribution and significance.
+
+    Stimulus labels are permuted to destroy any relation to the responses;
+    the shuffles are split into one batch per worker process so the data
+    is sent to every worker once.
+
+    Returns:
+        dict: 'information', 'shuffled' (all shuffle values), 'bias'
+        (their mean, subtractable from the information) and 'p_value'.
+    """
+    information = mutual_information(stimuli, words, estimator, n_states)
+    workers = max_workers or os.cpu_count() or 1
+    batches = [len(batch) for batch in np.array_split(np.arange(n_shuffles), workers) if len(batch)]
+    seeds = np.random.SeedSequence(np.random.default_rng(rng).integers(2 ** 63)).spawn(len(batches))
+    results = process_pool_executor(
+        _shuffled_information,
+        [(stimuli, words, estimator, n_states, size, seed) for size, seed in zip(batches, seeds)],
+        max_workers=workers)
+    shuffled = np.concatenate([np.asarray(batch) for batch in results])
+    return {
+        'information': information,
+        'shuffled': shuffled,
+        'bias': float(shuffled.mean()),
+        'p_value': float((np.sum(shuffled >= information) + 1) / (len(shuffled) + 1)),
+    }
+
+def _prepare_samples(samples, noise, rng):
+    samples = np.asarray(samples, dtype=np.float64)
+    samples = samples[:, None] if samples.ndim == 1 else samples
+    if noise:
+        # Break ties between identical (e.g. integer) samples, which the estimators assume away.
+        samples = samples + noise * np.random.default_rng(rng).standard_normal(samples.shape)
+    return samples
+
+def knn_entropy(samples, k=3, noise=1e-10, rng=None, workers=-1):
+    """Differential entropy in bits with the Kozachenko-Leonenko k-nearest-neighbour estimator.
+
+    Distances use the maximum norm, as in the KSG estimator.
+    """
+    from scipy.spatial import cKDTree
+    from scipy.special import digamma
+
+    samples = _prepare_samples(samples, noise, rng)
+    n, dimensions = samples.shape
+    distances = cKDTree(samples).query(samples, k + 1, p=np.inf, workers=workers)[0][:, -1]
+    return float((digamma(n) - digamma(k) + dimensions * np.mean(np.log(2.0 * distances))) / LN2)
+
+def ksg_mutual_information(x, y, k=3, noise=1e-10, rng=None, workers=-1):
+    """Mutual information in bits between continuous variables (Kraskov, Stoegbauer & Grassberger, 2004).
+
+    The distance to the k-th neighbour of every sample in the joint space
+    is found with a KD-tree, and the neighbours within that distance in
+    each marginal space are counted with KD-trees as well, so the cost is
+    ``O(n log n)`` instead of the ``O(n^2)`` of pairwise distances. Tree
+    queries run on ``workers`` threads (-1 for all cores).
+    """
+    from scipy.spatial import cKDTree
+    from scipy.special import digamma
+
+    rng = np.random.default_rng(rng)
+    x = _prepare_samples(x, noise, rng)
+    y = _prepare_samples(y, noise, rng)
+    if len(x) != len(y):
+        raise DataValidationError("Both variables need the same number of samples")
+    n = len(x)
+    joint = np.hstack((x, y))
+    radius = cKDTree(joint).query(joint, k + 1, p=np.inf, workers=workers)[0][:, -1]
+    # Strictly closer than the k-th neighbour; the sample itself is counted and removed.
+    radius = np.nextafter(radius, 0.0)
+    n_x = cKDTree(x).query_ball_point(x, radius, p=np.inf, workers=workers, return_length=True) - 1
+    n_y = cKDTree(y).query_ball_point(y, radius, p=np.inf, workers=workers, return_length=True) - 1
+    information = digamma(k) + digamma(n) - np.mean(digamma(n_x + 1) + digamma(n_y + 1))
+    return float(max(information, 0.0) / LN2)
+
+def _dictionary_entropy(binned, word_length):
+    """Reference implementation counting words as tuples in a dictionary."""
+    binned = np.atleast_2d(binned) > 0
+    counts = {}
+    for start in range(0, binned.shape[1] - word_length + 1, word_length):
+        word = tuple(binned[:, start:start + word_length].ravel().tolist())
+        counts[word] = counts.get(word, 0) + 1
+    return plugin_entropy(np.fromiter(counts.values(), dtype=np.float64))
+
+def benchmark_entropy_estimators(word_lengths=(4, 8, 16, 32), sample_counts=(1_000, 10_000, 100_000),
+                                 n_neurons=1, spike_probability=0.1, knn_dimensions=2, rng=None):
+    """Run time of every estimator over word length and sample count.
+
+    For the word estimators, samples are words of independent Bernoulli
+    bins; the dictionary-of-tuples reference is timed alongside. The KSG
+    estimator is timed on correlated Gaussian samples of
+    ``knn_dimensions`` per variable, whose true information is known.
+
+    Returns:
+        dict: Seconds per estimator keyed by ``(word_length, n_samples)``,
+        and KSG seconds and error keyed by ``n_samples``.
+    """
+    rng = np.random.default_rng(rng)
+    results = {'words': {}, 'ksg': {}}
+    for word_length in word_lengths:
+        for n_samples in sample_counts:
+            binned = rng.random((n_neurons, word_length * n_samples)) < spike_probability
+            timings = {}
+            start = time.perf_counter()
+            words = spike_words(binned, word_length)
+            timings['packing'] = time.perf_counter() - start
+            for estimator in ENTROPY_ESTIMATORS:
+                start = time.perf_counter()
+                word_entropy(words, estimator, n_states=2.0 ** (word_length * n_neurons))
+                timings[estimator] = time.perf_counter() - start
+            start = time.perf_counter()
+            _dictionary_entropy(binned, word_length)
+            timings['dictionary'] = time.perf_counter() - start
+            results['words'][(word_length, n_samples)] = timings
+
+    correlation = 0.6
+    exact = -0.5 * knn_dimensions * np.log2(1.0 - correlation ** 2)
+    for n_samples in sample_counts:
+        x = rng.standard_normal((n_samples, knn_dimensions))
+        y = correlation * x + np.sqrt(1.0 - correlation ** 2) * rng.standard_normal((n_samples, knn_dimensions))
+        start = time.perf_counter()
+        estimate = ksg_mutual_information(x, y, rng=rng)
+        results['ksg'][n_samples] = {'seconds': time.perf_counter() - start, 'error': estimate - exact}
+    return results
@@ -1 +1,126 @@
-# Modeling and analysis of population coding strategies
\ No newline at end of file
+# Modeling and analysis of population coding strategies
+
+import numpy as np
+from ..common.error_handling import DataValidationError, ParameterValueError
+
+class TuningCurves:
+    """Mean firing rates (Hz) of a population as a function of a scalar stimulus."""
+    n_neurons = 0
+
+    def rates(self, stimuli):
+        """Rates of shape ``(len(stimuli), n_neurons)``."""
+        raise NotImplementedError("Rates method must be implemented.")
+
+    def derivatives(self, stimuli):
+        """Derivatives of the rates with respect to the stimulus, same shape as ``rates``."""
+        raise NotImplementedError("Derivatives method must be implemented.")
+
+class GaussianTuning(TuningCurves):
+    """Gaussian tuning around each neuron's preferred stimulus, on top of a baseline rate."""
+    def __init__(self, preferred, width=1.0, peak_rate=50.0, baseline=1.0):
+        self.preferred = np.asarray(preferred, dtype=np.float64)
+        self.n_neurons = len(self.preferred)
+        self.width = np.broadcast_to(np.asarray(width, dtype=np.float64), self.preferred.shape)
+        self.peak_rate = peak_rate
+        self.baseline = baseline
+        if np.any(self.width <= 0):
+            raise ParameterValueError('width', "Tuning widths must be positive")
+
+    def _offsets(self, stimuli):
+        return (np.asarray(stimuli, dtype=np.float64)[:, None] - self.preferred) / self.width
+
+    def rates(self, stimuli):
+        return self.baseline + self.peak_rate * np.exp(-0.5 * self._offsets(stimuli) ** 2)
+
+    def derivatives(self, stimuli):
+        offsets = self._offsets(stimuli)
+        return -self.peak_rate * np.exp(-0.5 * offsets ** 2) * offsets / self.width
+
+class VonMisesTuning(TuningCurves):
+    """Von Mises tuning to a circular stimulus (radians), e.g. orientation or head direction."""
+    def __init__(self, preferred, concentration=2.0, peak_rate=50.0, baseline=1.0):
+        self.preferred = np.asarray(preferred, dtype=np.float64)
+        self.n_neurons = len(self.preferred)
+        self.concentration = concentration
+        self.peak_rate = peak_rate
+        self.baseline = baseline
+
+    def rates(self, stimuli):
+        angle = np.asarray(stimuli, dtype=np.float64)[:, None] - self.preferred
+        return self.baseline + self.peak_rate * np.exp(self.concentration * (np.cos(angle) - 1.0))
+
+    def derivatives(self, stimuli):
+        angle = np.asarray(stimuli, dtype=np.float64)[:, None] - self.preferred
+        return -self.peak_rate * self.concentration * np.sin(angle) * \
+            np.exp(self.concentration * (np.cos(angle) - 1.0))
+
+def evenly_tuned(n_neurons, low, high, circular=False, **options):
+    """Population whose preferred stimuli tile ``[low, high)``."""
+    preferred = np.linspace(low, high, n_neurons, endpoint=not circular)
+    return VonMisesTuning(preferred, **options) if circular else GaussianTuning(preferred, **options)
+
+class LogTuningTable:
+    """Expected spike counts of a population on a stimulus grid, with their logarithms.
+
+    With ``log_counts`` of shape ``(n_grid, n_neurons)`` the Poisson
+    log-likelihood of a whole batch of count vectors on every grid point
+    is one matrix product, ``counts @ log_counts.T - total_counts`` (up to
+    terms that do not depend on the stimulus). Rows can be replaced in
+    place when tuning estimates change.
+
+    Args:
+        grid (np.ndarray): Stimulus values at which the table is sampled.
+        expected_counts (np.ndarray): Mean counts per bin, shape ``(n_grid, n_neurons)``.
+        floor (float): Smallest expected count, so silent neurons do not give ``log(0)``.
+    """
+    def __init__(self, grid, expected_counts, floor=1e-6):
+        self.grid = np.asarray(grid, dtype=np.float64)
+        self.floor = floor
+        expected_counts = np.asarray(expected_counts, dtype=np.float64)
+        if expected_counts.shape[0] != len(self.grid):
+            raise DataValidationError("Expected counts need one row per grid point")
+        self.log_counts = np.empty_like(expected_counts)
+        self.total_counts = np.empty(len(self.grid))
+        self.update_rows(slice(None), expected_counts)
+
+    @classmethod
+    def from_tuning(cls, tuning, grid, bin_size, floor=1e-6):
+        """Table for tuning curves in Hz and time bins of ``bin_size`` ms."""
+        return cls(grid, tuning.rates(grid) * bin_size * 1e-3, floor)
+
+    @property
+    def n_neurons(self):
+        return self.log_counts.shape[1]
+
+    def update_rows(self, rows, expected_counts):
+        """Replace the expected counts at some grid points."""
+        expected_counts = np.maximum(expected_counts, self.floor)
+        self.log_counts[rows] = np.log(expected_counts)
+        self.total_counts[rows] = expected_counts.sum(axis=-1)
+
+    def log_likelihood(self, counts):
+        """Poisson log-likelihood (without ``log(counts!)``) of ``(n_bins, n_neurons)`` counts on the grid."""
+        return np.asarray(counts, dtype=np.float64) @ self.log_counts.T - self.total_counts
+
+class PopulationCode:
+    """Independent Poisson population with the given tuning, observed in bins of ``bin_size`` ms."""
+    def __init__(self, tuning, bin_size=10.0):
+        if bin_size <= 0:
+            raise ParameterValueError('bin_size', "Bin size must be positive")
+        self.tuning = tuning
+        self.bin_size = bin_size
+
+    def expected_counts(self, stimuli):
+        return self.tuning.rates(stimuli) * self.bin_size * 1e-3
+
+    def sample_counts(self, stimuli, rng=None):
+        """Poisson spike counts of shape ``(len(stimuli), n_neurons)``."""
+        return np.random.default_rng(rng).poisson(self.expected_counts(stimuli))
+
+    def fisher_information(self, stimuli):
+        """Fisher information about the stimulus per bin, ``sum(f'^2 / f)`` over neurons."""
+        scale = self.bin_size * 1e-3
+        return (self.tuning.derivatives(stimuli) ** 2 / self.tuning.rates(stimuli)).sum(axis=1) * scale
+
+    def table(self, grid, floor=1e-6):
+        return LogTuningTable.from_tuning(self.tuning, grid, self.bin_size, floor)
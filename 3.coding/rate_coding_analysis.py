@@ -1 +1,170 @@
-# Analyzing and simulating rate coding in neurons
\ No newline at end of file
+# Analyzing and simulating rate coding in neurons
+
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import ParameterValueError
+from ..common.performance_metrics import measure_throughput
+
+class ExponentialRateEstimator:
+    """Online firing rate of every neuron with a causal exponential kernel.
+
+    Each spike adds ``1000 / time_constant`` Hz to its neuron's estimate,
+    which decays with ``time_constant`` ms. Decay is applied lazily, only
+    to neurons that spike or are read, so a step costs time proportional
+    to its number of spikes and memory stays at two arrays per population.
+
+    Register it with ``simulation.add_monitor`` or feed it with ``update``.
+    """
+    def __init__(self, n_neurons, time_constant=100.0, population_index=0):
+        if time_constant <= 0:
+            raise ParameterValueError('time_constant', "Time constant must be positive")
+        self.time_constant = time_constant
+        self.population_index = population_index
+        self.values = np.zeros(n_neurons)
+        self.last_update = np.zeros(n_neurons)
+
+    def __call__(self, simulation):
+        time = (simulation.current_time + 1) * simulation.time_step
+        self.update(simulation.spikes[self.population_index], time)
+
+    def update(self, spikes, time):
+        """Add the spikes emitted at ``time`` ms."""
+        if len(spikes) == 0:
+            return
+        self.values[spikes] = self.rates(time, spikes) + 1e3 / self.time_constant
+        self.last_update[spikes] = time
+
+    def rates(self, time, neurons=None):
+        """Rate estimates (Hz) at ``time`` ms, for all or the given neurons."""
+        neurons = slice(None) if neurons is None else neurons
+        return self.values[neurons] * np.exp((self.last_update[neurons] - time) / self.time_constant)
+
+    def reset(self):
+        self.values[:] = 0.0
+        self.last_update[:] = 0.0
+
+class SlidingWindowRate:
+    """Online firing rate of every neuron over the last ``window`` ms.
+
+    Spike counts are kept in a ring of ``n_bins`` sub-windows with a
+    running total, so the footprint is ``n_bins`` count arrays however
+    long the run is. A spike costs one increment; each time a sub-window
+    closes its counts are subtracted from the total. The window therefore
+    slides in steps of ``window / n_bins`` ms.
+    """
+    def __init__(self, n_neurons, window=100.0, n_bins=10, population_index=0):
+        if window <= 0 or n_bins < 1:
+            raise ParameterValueError('window', "Window and number of bins must be positive")
+        self.window = window
+        self.bin_width = window / n_bins
+        self.population_index = population_index
+        self.bins = np.zeros((n_bins, n_neurons), dtype=np.int64)
+        self.totals = np.zeros(n_neurons, dtype=np.int64)
+        self.current_bin = 0
+
+    def __call__(self, simulation):
+        time = (simulation.current_time + 1) * simulation.time_step
+        self.update(simulation.spikes[self.population_index], time)
+
+    def _advance(self, time):
+        # A spike at the end of a sub-window still belongs to it.
+        target = max(int(np.ceil(time / self.bin_width - 1e-9)) - 1, 0)
+        n_bins = len(self.bins)
+        for index in range(self.current_bin + 1, min(target, self.current_bin + n_bins) + 1):
+            row = self.bins[index % n_bins]
+            self.totals -= row
+            row[:] = 0
+        self.current_bin = max(self.current_bin, target)
+
+    def update(self, spikes, time):
+        """Add the (distinct) neurons that spiked at ``time`` ms; times must not decrease."""
+        self._advance(time)
+        self.bins[self.current_bin % len(self.bins), spikes] += 1
+        self.totals[spikes] += 1
+
+    def rates(self, time):
+        """Rates (Hz) over the window ending at ``time`` ms.
+
+        The oldest sub-window is dropped as soon as a new one starts, so
+        the counts cover between ``window - window / n_bins`` and
+        ``window`` ms; rates are normalized by the span actually covered.
+        """
+        self._advance(time)
+        covered = min(time, self.window - self.bin_width * (self.current_bin + 1) + time)
+        return self.totals * (1e3 / max(covered, 1e-12))
+
+    def reset(self):
+        self.bins[:] = 0
+        self.totals[:] = 0
+        self.current_bin = 0
+
+class PopulationRateMonitor:
+    """Population rate (Hz per neuron) averaged over the last ``window`` ms.
+
+    Streaming counterpart of ``utilities.rolling_average`` applied to the
+    per-step spike count of a population: a ring buffer of the last
+    ``window / time_step`` counts with a running sum gives each new value
+    in constant time. ``history`` optionally keeps the most recent values.
+    """
+    def __init__(self, n_neurons, window=10.0, time_step=SIMULATION_TIME_STEP, population_index=0,
+                 history=0):
+        self.window_steps = max(int(round(window / time_step)), 1)
+        self.scale = 1e3 / (n_neurons * self.window_steps * time_step)
+        self.population_index = population_index
+        self.counts = np.zeros(self.window_steps, dtype=np.int64)
+        self.total = 0
+        self.steps = 0
+        self.history = np.zeros(history)
+        self.rate = 0.0
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.steps = 0
+        self.rate = 0.0
+
+    def __call__(self, simulation):
+        self.update(len(simulation.spikes[self.population_index]))
+
+    def update(self, count):
+        """Add the spike count of one step and return the current rate."""
+        slot = self.steps % self.window_steps
+        self.total += count - self.counts[slot]
+        self.counts[slot] = count
+        self.steps += 1
+        self.rate = self.total * self.scale
+        if len(self.history):
+            self.history[(self.steps - 1) % len(self.history)] = self.rate
+        return self.rate
+
+    def recent(self):
+        """The stored recent rates, oldest first."""
+        if not len(self.history):
+            return self.history
+        kept = min(self.steps, len(self.history))
+        return np.roll(self.history, -(self.steps % len(self.history)))[len(self.history) - kept:]
+
+def benchmark_streaming_rates(n_neurons=100_000, rate=5.0, n_steps=1000, time_step=SIMULATION_TIME_STEP,
+                              rng=None):
+    """Steps per second of the streaming rate estimators on Poisson spikes."""
+    rng = np.random.default_rng(rng)
+    probability = rate * time_step * 1e-3
+    spikes = [np.flatnonzero(rng.random(n_neurons) < probability) for _ in range(n_steps)]
+    estimators = {'exponential': ExponentialRateEstimator(n_neurons),
+                  'sliding_window': SlidingWindowRate(n_neurons)}
+    results = {}
+    for name, estimator in estimators.items():
+        def run():
+            estimator.reset()
+            for step, fired in enumerate(spikes):
+                estimator.update(fired, (step + 1) * time_step)
+        results[name] = measure_throughput(run, n_steps)
+    population = PopulationRateMonitor(n_neurons, time_step=time_step)
+    counts = [len(fired) for fired in spikes]
+
+    def run_population():
+        population.reset()
+        for count in counts:
+            population.update(count)
+    results['population'] = measure_throughput(run_population, n_steps)
+    return results
@@ -1 +1,179 @@
-# Analysis and simulation of temporal coding patterns
\ No newline at end of file
+# Analysis and simulation of temporal coding patterns
+
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import ParameterValueError
+
+class FirstSpikeLatency:
+    """Online first-spike latency of every neuron after stimulus onsets.
+
+    Call ``stimulus_onset(time)`` whenever a stimulus is presented (e.g.
+    from a process registered with ``simulation.add_process``); the first
+    spike of each neuron within ``window`` ms of the onset sets its latency
+    for that trial. When the next onset arrives the finished trial is
+    folded into running per-neuron statistics (Welford's algorithm), so
+    memory does not grow with the number of trials.
+
+    Register it with ``simulation.add_monitor`` or feed it with ``update``.
+    """
+    def __init__(self, n_neurons, window=np.inf, population_index=0):
+        if window <= 0:
+            raise ParameterValueError('window', "Response window must be positive")
+        self.window = window
+        self.population_index = population_index
+        self.latency = np.full(n_neurons, np.nan)
+        self.onset = None
+        self.trials = 0
+        self.responses = np.zeros(n_neurons, dtype=np.int64)
+        self._mean = np.zeros(n_neurons)
+        self._squares = np.zeros(n_neurons)
+
+    def __call__(self, simulation):
+        time = (simulation.current_time + 1) * simulation.time_step
+        self.update(simulation.spikes[self.population_index], time)
+
+    def stimulus_onset(self, time):
+        """Close the current trial and start a new one at ``time`` ms."""
+        self._finish_trial()
+        self.onset = time
+
+    def _finish_trial(self):
+        if self.onset is None:
+            return
+        self.trials += 1
+        responded = np.flatnonzero(~np.isnan(self.latency))
+        self.responses[responded] += 1
+        delta = self.latency[responded] - self._mean[responded]
+        self._mean[responded] += delta / self.responses[responded]
+        self._squares[responded] += delta * (self.latency[responded] - self._mean[responded])
+        self.latency[:] = np.nan
+
+    def update(self, spikes, time):
+        """Register the neurons that spiked at ``time`` ms."""
+        if self.onset is None or len(spikes) == 0 or time - self.onset > self.window:
+            return
+        first = spikes[np.isnan(self.latency[spikes])]
+        self.latency[first] = time - self.onset
+
+    def statistics(self):
+        """Mean and standard deviation of the latency (ms) and response probability per neuron.
+
+        Includes the trial in progress. Neurons that never responded get NaN
+        latencies.
+        """
+        responses = self.responses.copy()
+        mean, squares = self._mean.copy(), self._squares.copy()
+        current = np.flatnonzero(~np.isnan(self.latency))
+        responses[current] += 1
+        delta = self.latency[current] - mean[current]
+        mean[current] += delta / responses[current]
+        squares[current] += delta * (self.latency[current] - mean[current])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(responses > 0, mean, np.nan)
+            std = np.sqrt(np.where(responses > 1, squares / (responses - 1), np.nan))
+        trials = self.trials + (self.onset is not None)
+        probability = responses / trials if trials else np.zeros(len(responses))
+        return mean, std, probability
+
+class OnlineOscillation:
+    """Causal estimate of the analytic signal of one frequency band.
+
+    The input passes through a cascade of ``order`` identical complex
+    one-pole filters centred on ``frequency`` Hz with a pole bandwidth of
+    ``bandwidth`` Hz. Such a filter passes only positive frequencies, so its
+    output approximates the analytic signal of the band (what a Hilbert
+    transform of the band-passed signal would give, offline) with zero
+    phase shift at the centre frequency. Each sample costs ``order``
+    complex multiply-adds.
+
+    Args:
+        frequency (float): Centre frequency (Hz).
+        bandwidth (float): Full width of each pole's passband (Hz).
+        time_step (float): Sampling interval (ms).
+        order (int): Number of cascaded poles; more give a narrower, sharper band.
+    """
+    def __init__(self, frequency, bandwidth=4.0, time_step=SIMULATION_TIME_STEP, order=2):
+        if frequency <= 0 or bandwidth <= 0 or order < 1:
+            raise ParameterValueError('frequency', "Frequency, bandwidth and order must be positive")
+        dt = time_step * 1e-3
+        self.frequency = frequency
+        self.pole = np.exp((-np.pi * bandwidth + 2j * np.pi * frequency) * dt)
+        self.gain = 1.0 - np.abs(self.pole)
+        self.stages = np.zeros(order, dtype=np.complex128)
+
+    def update(self, sample):
+        """Filter one sample and return the current phase (radians)."""
+        value = sample
+        for index in range(len(self.stages)):
+            value = self.stages[index] = self.pole * self.stages[index] + self.gain * value
+        return np.angle(value)
+
+    @property
+    def analytic(self):
+        return self.stages[-1]
+
+    @property
+    def phase(self):
+        return np.angle(self.stages[-1])
+
+    @property
+    def amplitude(self):
+        """Amplitude of the band component (twice the magnitude of the one-sided output)."""
+        return 2.0 * np.abs(self.stages[-1])
+
+    def reset(self):
+        self.stages[:] = 0.0
+
+class PhaseOfFiring:
+    """Online spike phase locking to an ongoing oscillation.
+
+    Every step one sample of a reference signal is passed to an
+    ``OnlineOscillation``, and each spike of the monitored population is
+    stamped with the current phase. Per neuron only the sum of unit phase
+    vectors and the spike count are kept, plus a phase histogram of the
+    whole population, so the footprint is fixed.
+
+    Args:
+        n_neurons (int): Size of the monitored population.
+        oscillation (OnlineOscillation): Band estimate driven by the reference signal.
+        population_index (int): Population whose spikes are stamped.
+        signal (function): ``signal(simulation)`` giving the reference sample;
+            by default the spike count of ``reference_index`` in the step.
+        reference_index (int): Population used by the default signal; the
+            monitored one if None.
+        n_phase_bins (int): Bins of the population phase histogram.
+    """
+    def __init__(self, n_neurons, oscillation, population_index=0, signal=None, reference_index=None,
+                 n_phase_bins=36):
+        self.oscillation = oscillation
+        self.population_index = population_index
+        reference_index = population_index if reference_index is None else reference_index
+        self.signal = signal or (lambda simulation: len(simulation.spikes[reference_index]))
+        self.vector_sums = np.zeros(n_neurons, dtype=np.complex128)
+        self.spike_counts = np.zeros(n_neurons, dtype=np.int64)
+        self.histogram = np.zeros(n_phase_bins, dtype=np.int64)
+
+    def __call__(self, simulation):
+        phase = self.oscillation.update(self.signal(simulation))
+        self.update(simulation.spikes[self.population_index], phase)
+
+    def update(self, spikes, phase):
+        """Stamp the (distinct) neurons that spiked with ``phase`` radians."""
+        if len(spikes) == 0:
+            return
+        self.vector_sums[spikes] += np.exp(1j * phase)
+        self.spike_counts[spikes] += 1
+        n_bins = len(self.histogram)
+        self.histogram[int((phase + np.pi) / (2 * np.pi) * n_bins) % n_bins] += len(spikes)
+
+    def preferred_phases(self):
+        """Mean firing phase of every neuron (radians; NaN for silent neurons)."""
+        return np.where(self.spike_counts > 0, np.angle(self.vector_sums), np.nan)
+
+    def vector_strength(self):
+        """Phase locking of every neuron, from 0 (none) to 1 (all spikes at one phase)."""
+        return np.abs(self.vector_sums) / np.maximum(self.spike_counts, 1)
+
+    def phase_histogram(self):
+        """Bin edges (radians) and spike counts of the population phase histogram."""
+        return np.linspace(-np.pi, np.pi, len(self.histogram) + 1), self.histogram.copy()
@@ -1 +1,350 @@
-# Models for representing circuit connectivity
\ No newline at end of file
+# Models for representing circuit connectivity
+
+import os
+import shutil
+import numpy as np
+from ..common.config_manager import config_hash
+from ..common.constants import SIMULATION_TIME_STEP, SYNAPTIC_WEIGHT_RANGE
+from ..common.data_handling import load_arrays, save_arrays
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..common.performance_metrics import measure_throughput
+from ..common.utilities import generate_random_weights
+
+def delays_to_steps(delays, time_step=SIMULATION_TIME_STEP):
+    """Convert delays in ms to whole time steps (at least one step)."""
+    steps = np.rint(np.asarray(delays, dtype=np.float64) / time_step)
+    return np.maximum(steps, 1).astype(np.int32)
+
+def expand_rows(indptr, rows, out=None):
+    """Return the positions of all entries stored in the given CSR rows.
+
+    With ``out`` (an intp array large enough for all positions) the
+    result is written into its head and that view is returned, so a
+    caller can reuse one buffer. Only per-row temporaries are allocated.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    total = int(counts.sum())
+    out = np.empty(total, dtype=np.intp) if out is None else out[:total]
+    if total == 0:
+        return out
+    nonempty = counts > 0
+    starts, counts = starts[nonempty], counts[nonempty]
+    # Positions rise by one within a row and jump to the next row's start in between.
+    jumps = starts.copy()
+    jumps[1:] -= starts[:-1] + counts[:-1] - 1
+    out.fill(1)
+    out[np.cumsum(counts) - counts] = jumps
+    np.cumsum(out, out=out)
+    return out
+
+class ConnectivityMatrix:
+    """Compressed sparse row store of synapses between two populations.
+
+    Synapses are grouped by presynaptic neuron: the outgoing synapses of
+    neuron ``i`` occupy positions ``indptr[i]:indptr[i + 1]`` of the
+    ``indices`` (postsynaptic neuron, int32), ``weights`` (float32) and
+    ``delays`` (in time steps, int32) arrays. Storage therefore grows with
+    the number of synapses rather than with ``n_pre * n_post``. The arrays
+    may be memory maps (see ``load``), in which case ``check=False`` skips
+    the validation pass that would read them in full.
+    """
+    def __init__(self, indptr, indices, weights, delays, n_post, time_step=SIMULATION_TIME_STEP,
+                 check=True):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.delays = np.asarray(delays, dtype=np.int32)
+        self.n_pre = len(self.indptr) - 1
+        self.n_post = int(n_post)
+        self.time_step = time_step
+        self.state_version = 0
+        self._column_index = None
+        if check:
+            self.validate()
+
+    def validate(self):
+        """Check that the CSR arrays describe a consistent matrix."""
+        if self.n_pre < 0 or self.indptr[0] != 0 or np.any(np.diff(self.indptr) < 0):
+            raise DataValidationError("Row pointer must start at 0 and be non-decreasing")
+        n_synapses = self.indptr[-1]
+        if not len(self.indices) == len(self.weights) == len(self.delays) == n_synapses:
+            raise DataValidationError("Indices, weights and delays must hold one entry per synapse")
+        if n_synapses and (self.indices.min() < 0 or self.indices.max() >= self.n_post):
+            raise DataValidationError("Postsynaptic index out of range")
+
+    @classmethod
+    def from_edges(cls, pre, post, weights, n_pre, n_post, delays=None, time_step=SIMULATION_TIME_STEP):
+        """Build a matrix from edge lists; delays are given in ms."""
+        pre = np.asarray(pre, dtype=np.int64)
+        post = np.asarray(post, dtype=np.int64)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float32), pre.shape)
+        if delays is None:
+            delay_steps = np.ones(pre.shape, dtype=np.int32)
+        else:
+            delay_steps = np.broadcast_to(delays_to_steps(delays, time_step), pre.shape)
+        if len(pre) and (pre.min() < 0 or pre.max() >= n_pre):
+            raise DataValidationError("Presynaptic index out of range")
+        order = np.argsort(pre * n_post + post, kind='stable')
+        indptr = np.zeros(n_pre + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pre, minlength=n_pre), out=indptr[1:])
+        return cls(indptr, post[order], weights[order], delay_steps[order], n_post, time_step)
+
+    @classmethod
+    def from_dense(cls, matrix, delays=None, time_step=SIMULATION_TIME_STEP):
+        """Build a matrix from the non-zero entries of a dense weight matrix."""
+        matrix = np.asarray(matrix)
+        pre, post = np.nonzero(matrix)
+        if delays is not None and np.ndim(delays) == 2:
+            delays = np.asarray(delays)[pre, post]
+        return cls.from_edges(pre, post, matrix[pre, post], matrix.shape[0], matrix.shape[1],
+                              delays, time_step)
+
+    @classmethod
+    def from_sorted_keys(cls, keys, n_pre, n_post, weights, delays=None, time_step=SIMULATION_TIME_STEP):
+        """Build a matrix from ascending, unique ``pre * n_post + post`` keys; delays are given in ms.
+
+        The keys already are the CSR order, so neither sorting nor a
+        validation pass is needed: the row pointer comes from one binary
+        search per row and ``weights`` and ``delays`` are taken as they are.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        indptr = np.searchsorted(keys, np.arange(n_pre + 1, dtype=np.int64) * n_post)
+        delay_steps = np.ones(len(keys), dtype=np.int32) if delays is None else \
+            np.broadcast_to(delays_to_steps(delays, time_step), keys.shape).astype(np.int32)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float32), keys.shape).astype(np.float32)
+        return cls(indptr, keys % n_post, weights, delay_steps, n_post, time_step, check=False)
+
+    @classmethod
+    def random(cls, n_pre, n_post, density, weight_range=SYNAPTIC_WEIGHT_RANGE, delays=None,
+               rng=None, time_step=SIMULATION_TIME_STEP):
+        """Draw a random matrix with the given connection density.
+
+        The number of synapses of every row is binomially distributed and
+        all targets are drawn in one batch, so no dense intermediate is ever
+        created. Duplicate targets within a row are merged.
+        """
+        if not 0.0 <= density <= 1.0:
+            raise ParameterValueError('density', "Connection density must lie in [0, 1]")
+        rng = np.random.default_rng(rng)
+        counts = rng.binomial(n_post, density, size=n_pre)
+        pre = np.repeat(np.arange(n_pre, dtype=np.int64), counts)
+        keys = np.unique(pre * n_post + rng.integers(0, n_post, size=len(pre)))
+        pre, post = np.divmod(keys, n_post)
+        weights = rng.uniform(weight_range[0], weight_range[1], size=len(keys))
+        return cls.from_edges(pre, post, weights, n_pre, n_post, delays, time_step)
+
+    def save(self, directory):
+        """Write the CSR arrays as binary files that ``load`` can memory-map."""
+        save_arrays(directory, {'indptr': self.indptr, 'indices': self.indices,
+                                'weights': self.weights, 'delays': self.delays},
+                    {'n_post': self.n_post, 'time_step': self.time_step})
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r', check=False):
+        """Open a matrix written by ``save``.
+
+        By default the arrays are read-only memory maps, so opening is
+        constant time and slicing a sub-network only pages in the rows it
+        touches.
+        """
+        arrays, metadata = load_arrays(directory, mmap_mode)
+        return cls(arrays['indptr'], arrays['indices'], arrays['weights'], arrays['delays'],
+                   metadata['n_post'], metadata['time_step'], check=check)
+
+    @property
+    def n_synapses(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """Memory held by the backing arrays in bytes."""
+        return self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes + self.delays.nbytes
+
+    def presynaptic_indices(self):
+        """Expand the row pointer into one presynaptic index per synapse."""
+        return np.repeat(np.arange(self.n_pre, dtype=np.int32), np.diff(self.indptr))
+
+    def outgoing(self, pre_indices):
+        """Positions of all synapses leaving the given presynaptic neurons."""
+        return expand_rows(self.indptr, pre_indices)
+
+    def column_index(self):
+        """Column pointer and synapse positions grouped by postsynaptic neuron, built on first use.
+
+        Together they form a compressed sparse column view of the same
+        synapses, so the synapses onto a neuron can be found without
+        scanning every row.
+        """
+        if self._column_index is None:
+            order = np.argsort(self.indices, kind='stable')
+            indptr = np.zeros(self.n_post + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.n_post), out=indptr[1:])
+            self._column_index = (indptr, order)
+        return self._column_index
+
+    def incoming(self, post_indices):
+        """Positions of all synapses onto the given postsynaptic neurons."""
+        indptr, order = self.column_index()
+        return order[expand_rows(indptr, post_indices)]
+
+    def row_slice(self, start, stop):
+        """Synapses leaving presynaptic neurons ``start:stop``, as views where possible.
+
+        Only the row pointer segment is copied, so slicing a memory-mapped
+        matrix reads nothing but the selected rows.
+        """
+        first, last = int(self.indptr[start]), int(self.indptr[stop])
+        return ConnectivityMatrix(self.indptr[start:stop + 1] - first, self.indices[first:last],
+                                  self.weights[first:last], self.delays[first:last], self.n_post,
+                                  self.time_step, check=False)
+
+    def column_slice(self, start, stop):
+        """Synapses onto postsynaptic neurons ``start:stop``, re-indexed from zero.
+
+        All presynaptic rows are kept, so the slice can be driven by global
+        spike indices while only touching a partition of the targets.
+        """
+        keep = (self.indices >= start) & (self.indices < stop)
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+        return ConnectivityMatrix(kept_before[self.indptr], self.indices[keep] - start,
+                                  self.weights[keep], self.delays[keep], stop - start, self.time_step)
+
+    def permuted(self, order):
+        """Renumber the neurons of a square matrix so new neuron ``i`` is old ``order[i]``."""
+        if self.n_pre != self.n_post:
+            raise DataValidationError("Only recurrent (square) matrices can be renumbered")
+        new_index = np.empty(self.n_pre, dtype=np.int64)
+        new_index[np.asarray(order)] = np.arange(self.n_pre)
+        pre = new_index[self.presynaptic_indices()]
+        post = new_index[self.indices]
+        order = np.argsort(pre * self.n_post + post, kind='stable')
+        indptr = np.zeros(self.n_pre + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pre, minlength=self.n_pre), out=indptr[1:])
+        return ConnectivityMatrix(indptr, post[order], self.weights[order], self.delays[order],
+                                  self.n_post, self.time_step)
+
+    def mark_changed(self):
+        """Record that the weights were changed in place.
+
+        Incremental checkpoints skip reading and hashing the weights while
+        ``state_version`` is unchanged, so code that writes to ``weights``
+        must call this.
+        """
+        self.state_version += 1
+
+    def checkpoint_state(self):
+        """Weights are the only part of the matrix that changes during a run."""
+        return {'weights': self.weights}
+
+    def restore_state(self, arrays):
+        if arrays['weights'].shape != self.weights.shape:
+            raise DataValidationError("Checkpointed weights do not match the connectivity")
+        self.weights = arrays['weights']
+        self.state_version += 1
+
+    def propagate(self, spike_indices, target):
+        """Add the weights of all synapses of spiking neurons to ``target``.
+
+        Only the rows of neurons that fired are touched, so the cost scales
+        with the number of transmitted spikes rather than with network size.
+        """
+        if len(spike_indices) == 0:
+            return
+        synapses = self.outgoing(spike_indices)
+        np.add.at(target, self.indices[synapses], self.weights[synapses])
+
+    def to_dense(self):
+        """Return the weights as a dense ``(n_pre, n_post)`` array."""
+        dense = np.zeros((self.n_pre, self.n_post), dtype=self.weights.dtype)
+        dense[self.presynaptic_indices(), self.indices] = self.weights
+        return dense
+
+def cached_connectivity(cache_directory, parameters, build, mmap_mode='c'):
+    """Load a generated matrix from an on-disk cache keyed by its parameters, or build and store it.
+
+    ``parameters`` must identify the matrix completely, including the
+    generator name and an integer seed; its hash names the cache entry. A
+    new entry is written to a temporary directory and renamed into place,
+    so concurrent builds never see a half-written matrix. Cached matrices
+    are memory-mapped (see ``ConnectivityMatrix.load``), which makes a
+    repeat build take constant time. The default copy-on-write
+    ``mmap_mode`` lets plasticity change the weights in memory without
+    touching the cache entry.
+
+    Args:
+        cache_directory (str): Directory holding one subdirectory per entry;
+            None disables caching.
+        parameters (dict): JSON-serializable description of the matrix.
+        build (function): Zero-argument callable returning the matrix.
+    """
+    if cache_directory is None:
+        return build()
+    if not isinstance(parameters.get('seed'), (int, np.integer)):
+        raise ParameterValueError('seed', "Cached networks need an integer seed")
+    path = os.path.join(cache_directory, config_hash(parameters))
+    if not os.path.exists(path):
+        temporary = f'{path}.{os.getpid()}.tmp'
+        build().save(temporary)
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.exists(path):
+                raise
+    return ConnectivityMatrix.load(path, mmap_mode)
+
+def benchmark_memory(n_neurons, density, rng=None):
+    """Compare memory per synapse of the CSR store and a dense float64 matrix.
+
+    The dense footprint is computed rather than allocated so that sizes
+    which would not fit in memory can still be reported.
+    """
+    matrix = ConnectivityMatrix.random(n_neurons, n_neurons, density, rng=rng)
+    dense_bytes = n_neurons * n_neurons * np.dtype(np.float64).itemsize
+    n_synapses = max(matrix.n_synapses, 1)
+    return {
+        'n_synapses': matrix.n_synapses,
+        'sparse_bytes': matrix.nbytes,
+        'dense_bytes': dense_bytes,
+        'sparse_bytes_per_synapse': matrix.nbytes / n_synapses,
+        'dense_bytes_per_synapse': dense_bytes / n_synapses,
+    }
+
+def benchmark_propagation(n_neurons, density, spike_fraction=0.01, steps=100,
+                          dense_limit=20_000, rng=None):
+    """Measure delivered synaptic events per second for sparse and dense storage.
+
+    Args:
+        n_neurons (int): Number of pre- and postsynaptic neurons.
+        density (float): Connection probability.
+        spike_fraction (float): Fraction of neurons firing in each step.
+        steps (int): Number of propagation steps per timed run.
+        dense_limit (int): Largest network size for which the dense baseline is run.
+        rng: Seed or generator for reproducible networks and spike patterns.
+
+    Returns:
+        dict: Events per second for the 'sparse' and, when run, 'dense' store.
+    """
+    rng = np.random.default_rng(rng)
+    matrix = ConnectivityMatrix.random(n_neurons, n_neurons, density, rng=rng)
+    n_spiking = max(int(n_neurons * spike_fraction), 1)
+    spike_sets = [rng.choice(n_neurons, n_spiking, replace=False) for _ in range(steps)]
+    target = np.zeros(n_neurons)
+    events = n_spiking * steps * density * n_neurons
+
+    def run_sparse():
+        for spikes in spike_sets:
+            matrix.propagate(spikes, target)
+
+    results = {'sparse': measure_throughput(run_sparse, events)}
+    if n_neurons <= dense_limit:
+        dense = generate_random_weights((n_neurons, n_neurons)) * (rng.random((n_neurons, n_neurons)) < density)
+
+        def run_dense():
+            for spikes in spike_sets:
+                np.add(target, dense[spikes].sum(axis=0), out=target)
+
+        results['dense'] = measure_throughput(run_dense, events)
+    return results
@@ -1 +1,317 @@
-# Rules for synaptic plasticity in circuits
\ No newline at end of file
+# Rules for synaptic plasticity in circuits
+
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP, SYNAPTIC_WEIGHT_RANGE
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..common.performance_metrics import measure_throughput
+from .connectivity_matrix import ConnectivityMatrix
+
+class SpikeTraces:
+    """Exponentially decaying spike traces of a population, updated lazily.
+
+    Every neuron has one trace per time constant that jumps by one at each
+    of its spikes. Instead of decaying all traces on every step, each
+    neuron remembers when its traces were last updated and the decay is
+    applied when they are read, so the cost is proportional to the number
+    of spikes and synapses involved rather than to the population size.
+    """
+    def __init__(self, size, time_constants):
+        if any(tau <= 0 for tau in time_constants):
+            raise ParameterValueError('time_constants', "Trace time constants must be positive")
+        self.time_constants = np.asarray(time_constants, dtype=np.float64)[:, None]
+        self.values = np.zeros((len(time_constants), size))
+        self.last_update = np.zeros(size)
+
+    def read(self, neurons, time):
+        """Trace values of ``neurons`` at ``time``, shape ``(n_traces, len(neurons))``."""
+        elapsed = time - self.last_update[neurons]
+        return self.values[:, neurons] * np.exp(-elapsed / self.time_constants)
+
+    def increment(self, neurons, time):
+        """Register spikes of ``neurons`` (unique) at ``time``."""
+        self.values[:, neurons] = self.read(neurons, time) + 1.0
+        self.last_update[neurons] = time
+
+    def reset(self):
+        self.values.fill(0.0)
+        self.last_update.fill(0.0)
+
+    def checkpoint_state(self):
+        return {'values': self.values, 'last_update': self.last_update}
+
+    def restore_state(self, arrays):
+        if arrays['values'].shape != self.values.shape:
+            raise DataValidationError("Checkpointed spike traces do not match the population")
+        self.values = arrays['values']
+        self.last_update = arrays['last_update']
+
+class PlasticityRule:
+    """Weight change computed from spike traces at the moment of a spike.
+
+    A rule declares the time constants of the traces it needs on the
+    presynaptic and postsynaptic side and returns one weight change per
+    synapse when a presynaptic (``on_pre``) or postsynaptic (``on_post``)
+    neuron fires. All arguments are arrays over the synapses of the
+    spiking neurons: ``own_traces`` are the spiking side's traces just
+    before its spike, ``other_traces`` those of the partner neurons, each of
+    shape ``(n_traces, n_synapses)``. Rules therefore stay vectorized
+    whatever their form.
+    """
+    pre_time_constants = ()
+    post_time_constants = ()
+
+    def on_pre(self, other_traces, own_traces, weights):
+        return np.zeros(weights.shape)
+
+    def on_post(self, other_traces, own_traces, weights):
+        return np.zeros(weights.shape)
+
+class PairSTDP(PlasticityRule):
+    """Pair-based STDP with all-to-all spike interactions.
+
+    A postsynaptic spike potentiates by ``a_plus`` times the presynaptic
+    trace (time constant ``tau_plus``); a presynaptic spike depresses by
+    ``a_minus`` times the postsynaptic trace (time constant ``tau_minus``).
+    """
+    def __init__(self, a_plus=0.01, a_minus=0.0105, tau_plus=20.0, tau_minus=20.0):
+        self.a_plus = a_plus
+        self.a_minus = a_minus
+        self.pre_time_constants = (tau_plus,)
+        self.post_time_constants = (tau_minus,)
+
+    def on_pre(self, other_traces, own_traces, weights):
+        return -self.a_minus * other_traces[0]
+
+    def on_post(self, other_traces, own_traces, weights):
+        return self.a_plus * other_traces[0]
+
+class TripletSTDP(PlasticityRule):
+    """Triplet STDP (Pfister & Gerstner, 2006) with all-to-all interactions.
+
+    Besides the pair terms, potentiation grows with a slow postsynaptic
+    trace (``tau_y``) and depression with a slow presynaptic trace
+    (``tau_x``), both read just before the current spike. This reproduces
+    the frequency dependence of plasticity that pair rules miss. Defaults
+    are the visual cortex all-to-all fit.
+    """
+    def __init__(self, a2_plus=5e-10, a3_plus=6.2e-3, a2_minus=7e-3, a3_minus=2.3e-4,
+                 tau_plus=16.8, tau_minus=33.7, tau_x=101.0, tau_y=125.0):
+        self.a2_plus = a2_plus
+        self.a3_plus = a3_plus
+        self.a2_minus = a2_minus
+        self.a3_minus = a3_minus
+        self.pre_time_constants = (tau_plus, tau_x)
+        self.post_time_constants = (tau_minus, tau_y)
+
+    def on_pre(self, other_traces, own_traces, weights):
+        return -other_traces[0] * (self.a2_minus + self.a3_minus * own_traces[1])
+
+    def on_post(self, other_traces, own_traces, weights):
+        return other_traces[0] * (self.a2_plus + self.a3_plus * own_traces[1])
+
+class RewardModulatedSTDP(PlasticityRule):
+    """Any trace rule whose changes are gated by a reward signal.
+
+    The weight changes of ``rule`` accumulate in a per-synapse eligibility
+    trace decaying with ``tau_eligibility``; weights only move when
+    ``SpikeTimingPlasticity.reward`` delivers a reward, by
+    ``learning_rate * reward * eligibility``.
+    """
+    def __init__(self, rule, tau_eligibility=1000.0, learning_rate=1.0):
+        if tau_eligibility <= 0:
+            raise ParameterValueError('tau_eligibility', "Eligibility time constant must be positive")
+        self.rule = rule
+        self.tau_eligibility = tau_eligibility
+        self.learning_rate = learning_rate
+        self.pre_time_constants = rule.pre_time_constants
+        self.post_time_constants = rule.post_time_constants
+
+    def on_pre(self, other_traces, own_traces, weights):
+        return self.rule.on_pre(other_traces, own_traces, weights)
+
+    def on_post(self, other_traces, own_traces, weights):
+        return self.rule.on_post(other_traces, own_traces, weights)
+
+class SpikeTimingPlasticity:
+    """Online plasticity of one sparse projection, driven by its pre- and postsynaptic spikes.
+
+    Only the synapses leaving presynaptic neurons that fired (through the
+    CSR rows) and entering postsynaptic neurons that fired (through the
+    column index of the matrix) are read and written, directly in the
+    matrix's weight array, and the result is clipped to ``weight_range`` in
+    place. With ``soft_bounds`` potentiation is scaled by the distance to
+    the upper bound and depression by the distance to the lower bound.
+
+    Spike times are those at the somata; synaptic delays are ignored. When
+    both sides fire in the same step, the presynaptic spike is processed
+    first. Instances are simulation monitors: ``add_monitor`` them after
+    ``connect`` to train the projection from ``source`` to ``target``.
+
+    Args:
+        connectivity (ConnectivityMatrix): Projection whose weights are modified.
+        rule (PlasticityRule): Learning rule.
+        source, target (int): Population indices in the simulation, for use as a monitor.
+        weight_range (tuple): Lower and upper weight bound.
+        soft_bounds (bool): Use multiplicative instead of additive weight dependence.
+        decay: Optional lazy weight decay (``touch(synapses, time)``) that is brought up
+            to date before weights are read.
+    """
+    def __init__(self, connectivity, rule, source=0, target=0, weight_range=SYNAPTIC_WEIGHT_RANGE,
+                 soft_bounds=False, decay=None):
+        self.connectivity = connectivity
+        self.rule = rule
+        self.source = source
+        self.target = target
+        self.weight_range = weight_range
+        self.soft_bounds = soft_bounds
+        self.decay = decay
+        self.state_version = 0
+        self.pre_traces = SpikeTraces(connectivity.n_pre, rule.pre_time_constants)
+        self.post_traces = SpikeTraces(connectivity.n_post, rule.post_time_constants)
+        self._sources = connectivity.presynaptic_indices()
+        connectivity.column_index()
+        if isinstance(rule, RewardModulatedSTDP):
+            self.eligibility = np.zeros(connectivity.n_synapses)
+            self._eligibility_time = np.zeros(connectivity.n_synapses)
+        else:
+            self.eligibility = None
+
+    def __call__(self, simulation):
+        # Monitors run before ``current_time`` advances; spikes belong to the end of the step.
+        time = (simulation.current_time + 1) * simulation.time_step
+        self.update(simulation.spikes[self.source], simulation.spikes[self.target], time)
+
+    def update(self, pre_spikes, post_spikes, time):
+        """Apply the rule for the spikes of one step, stamped at ``time`` ms."""
+        connectivity = self.connectivity
+        if len(pre_spikes) or len(post_spikes):
+            self.state_version += 1
+        if len(pre_spikes):
+            synapses = connectivity.outgoing(pre_spikes)
+            if self.decay is not None:
+                self.decay.touch(synapses, time)
+            own = self.pre_traces.read(pre_spikes, time)
+            counts = np.diff(connectivity.indptr)[pre_spikes]
+            change = self.rule.on_pre(self.post_traces.read(connectivity.indices[synapses], time),
+                                      np.repeat(own, counts, axis=1), connectivity.weights[synapses])
+            self._apply(synapses, change, time)
+            self.pre_traces.increment(pre_spikes, time)
+        if len(post_spikes):
+            synapses = connectivity.incoming(post_spikes)
+            if self.decay is not None:
+                self.decay.touch(synapses, time)
+            own = self.post_traces.read(connectivity.indices[synapses], time)
+            change = self.rule.on_post(self.pre_traces.read(self._sources[synapses], time), own,
+                                       connectivity.weights[synapses])
+            self._apply(synapses, change, time)
+            self.post_traces.increment(post_spikes, time)
+
+    def _decay_eligibility(self, synapses, time):
+        elapsed = time - self._eligibility_time[synapses]
+        self.eligibility[synapses] *= np.exp(-elapsed / self.rule.tau_eligibility)
+        self._eligibility_time[synapses] = time
+
+    def _apply(self, synapses, change, time):
+        if self.eligibility is not None:
+            self._decay_eligibility(synapses, time)
+            self.eligibility[synapses] += change
+        else:
+            self.change_weights(synapses, change)
+
+    def change_weights(self, synapses, change):
+        """Add ``change`` to the weights of ``synapses`` and clip them to the weight range."""
+        low, high = self.weight_range
+        weights = self.connectivity.weights[synapses]
+        if self.soft_bounds:
+            change = np.where(change > 0, change * (high - weights), change * (weights - low))
+        weights += change
+        np.clip(weights, low, high, out=weights)
+        self.connectivity.weights[synapses] = weights
+        self.connectivity.mark_changed()
+
+    def reward(self, value, time):
+        """Turn eligibility into weight change, scaled by ``value`` (reward-modulated rules only)."""
+        if self.eligibility is None:
+            raise ParameterValueError('rule', "Rewards require a RewardModulatedSTDP rule")
+        synapses = np.flatnonzero(self.eligibility)
+        self.state_version += 1
+        self._decay_eligibility(synapses, time)
+        if self.decay is not None:
+            self.decay.touch(synapses, time)
+        self.change_weights(synapses, self.rule.learning_rate * value * self.eligibility[synapses])
+
+    def reset(self):
+        self.state_version += 1
+        self.pre_traces.reset()
+        self.post_traces.reset()
+        if self.eligibility is not None:
+            self.eligibility.fill(0.0)
+            self._eligibility_time.fill(0.0)
+
+    def checkpoint_state(self):
+        """Traces and eligibility; the weights are checkpointed with the projection."""
+        arrays = {f'pre/{name}': array for name, array in self.pre_traces.checkpoint_state().items()}
+        arrays.update({f'post/{name}': array for name, array in self.post_traces.checkpoint_state().items()})
+        if self.eligibility is not None:
+            arrays['eligibility'] = self.eligibility
+            arrays['eligibility_time'] = self._eligibility_time
+        return arrays
+
+    def restore_state(self, arrays):
+        self.state_version += 1
+        for side, traces in (('pre/', self.pre_traces), ('post/', self.post_traces)):
+            traces.restore_state({name[len(side):]: array for name, array in arrays.items()
+                                  if name.startswith(side)})
+        if self.eligibility is not None:
+            if arrays['eligibility'].shape != self.eligibility.shape:
+                raise DataValidationError("Checkpointed eligibility does not match the connectivity")
+            self.eligibility = arrays['eligibility']
+            self._eligibility_time = arrays['eligibility_time']
+
+def pairing_response(rule, pre_times, post_times, weight=0.5, weight_range=(-np.inf, np.inf)):
+    """Final weight of a single synapse driven by the given pre- and postsynaptic spike times (ms)."""
+    matrix = ConnectivityMatrix.from_edges([0], [0], [weight], 1, 1)
+    plasticity = SpikeTimingPlasticity(matrix, rule, weight_range=weight_range)
+    spike = np.array([0])
+    empty = np.empty(0, dtype=np.intp)
+    # Presynaptic spikes sort first at equal times, as in ``update``.
+    events = sorted([(time, 0) for time in pre_times] + [(time, 1) for time in post_times])
+    for time, side in events:
+        if side == 0:
+            plasticity.update(spike, empty, time)
+        else:
+            plasticity.update(empty, spike, time)
+    return float(matrix.weights[0])
+
+def stdp_window(rule, time_differences, pairings=1, interval=1000.0, weight=0.5):
+    """Weight change of a single synapse after pairings at each spike-time difference.
+
+    A positive difference means the postsynaptic spike follows the
+    presynaptic one. Pairings are ``interval`` ms apart so that traces
+    decay between them.
+    """
+    changes = []
+    for delta in time_differences:
+        pre_times = np.arange(pairings) * interval + max(-delta, 0.0)
+        changes.append(pairing_response(rule, pre_times, pre_times + delta, weight) - weight)
+    return np.array(changes)
+
+def benchmark_plasticity(n_neurons=10_000, density=0.01, rate=10.0, steps=100, rule=None,
+                         time_step=SIMULATION_TIME_STEP, rng=None):
+    """Synapse updates per second of the trace engine on a random recurrent network.
+
+    Every step a Poisson fraction ``rate * time_step`` of the neurons fires
+    on both sides of the projection.
+    """
+    rng = np.random.default_rng(rng)
+    matrix = ConnectivityMatrix.random(n_neurons, n_neurons, density, rng=rng)
+    plasticity = SpikeTimingPlasticity(matrix, PairSTDP() if rule is None else rule)
+    probability = rate * time_step * 1e-3
+    spike_sets = [np.flatnonzero(rng.random(n_neurons) < probability) for _ in range(steps)]
+    updates = 2 * sum(len(spikes) for spikes in spike_sets) * density * n_neurons
+
+    def run():
+        for step, spikes in enumerate(spike_sets):
+            plasticity.update(spikes, spikes, step * time_step)
+
+    return {'synapse_updates_per_second': measure_throughput(run, updates)}
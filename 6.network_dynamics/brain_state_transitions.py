@@ -1 +1,151 @@
-# Simulating transitions between different brain states (e.g., sleep, wakefulness)
\ No newline at end of file
+# Simulating transitions between different brain states (e.g., sleep, wakefulness)
+
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import ParameterValueError
+from .oscillatory_activity import FREQUENCY_BANDS, SlidingSpectrum, band_powers, spectrogram
+
+# Bands whose share of the total power marks each state.
+BRAIN_STATE_BANDS = {'slow_wave_sleep': ('delta',), 'rem_sleep': ('theta',),
+                     'quiet_wakefulness': ('alpha',), 'active_wakefulness': ('beta', 'gamma')}
+
+def relative_band_powers(frequencies, spectra, bands=None):
+    """Share of every band in the power summed over all bands, stacked on a new last axis."""
+    powers = band_powers(frequencies, spectra, bands)
+    return powers / np.maximum(powers.sum(axis=-1, keepdims=True), np.finfo(np.float64).tiny)
+
+def classify_states(relative_powers, states=None, bands=None):
+    """Index of the state whose bands hold the largest share of the power.
+
+    Args:
+        relative_powers (np.ndarray): Output of ``relative_band_powers``,
+            ``(..., n_channels, n_bands)``; shares are averaged over channels.
+        states (dict): State name to the names of its bands (default ``BRAIN_STATE_BANDS``).
+        bands (dict): Bands the powers were computed for (default ``FREQUENCY_BANDS``).
+
+    Returns:
+        np.ndarray: State indices (in the order of ``states``) of shape ``(...)``.
+    """
+    states = BRAIN_STATE_BANDS if states is None else states
+    band_names = list(FREQUENCY_BANDS if bands is None else bands)
+    membership = np.zeros((len(band_names), len(states)))
+    for column, state_bands in enumerate(states.values()):
+        for name in state_bands:
+            if name not in band_names:
+                raise ParameterValueError('states', f"Unknown band: {name}")
+            membership[band_names.index(name), column] = 1.0
+    return np.argmax(np.asarray(relative_powers).mean(axis=-2) @ membership, axis=-1)
+
+def _debounce(labels, min_windows):
+    """Keep a new label only once it has held for ``min_windows`` consecutive windows."""
+    stable = labels.copy()
+    run_start = 0
+    for index in range(1, len(labels)):
+        if labels[index] != labels[index - 1]:
+            run_start = index
+        stable[index] = labels[index] if index - run_start + 1 >= min_windows else stable[index - 1]
+    return stable
+
+def state_sequence(signals, time_step=SIMULATION_TIME_STEP, window=2000.0, overlap=0.5, min_duration=0.0,
+                   states=None, bands=None, method='welch', bandwidth=2.0):
+    """Offline brain-state labels of consecutive windows of multichannel activity.
+
+    Every ``window`` ms segment of all channels is transformed in one pass
+    (``spectrogram``) and labelled by ``classify_states``. A change of
+    state is accepted once the new state has lasted ``min_duration`` ms.
+
+    Returns:
+        tuple: Window centre times (ms), state names per window, and the
+            transitions as ``(time, previous_state, next_state)`` tuples.
+    """
+    states = BRAIN_STATE_BANDS if states is None else states
+    times, frequencies, power = spectrogram(signals, time_step, window, overlap, method, bandwidth)
+    labels = classify_states(relative_band_powers(frequencies, power, bands).transpose(1, 0, 2), states, bands)
+    step = times[1] - times[0] if len(times) > 1 else window
+    labels = _debounce(labels, max(int(np.ceil(min_duration / step)), 1))
+    names = list(states)
+    changes = np.flatnonzero(np.diff(labels)) + 1
+    transitions = [(times[index], names[labels[index - 1]], names[labels[index]]) for index in changes]
+    return times, [names[label] for label in labels], transitions
+
+class BrainStateTracker:
+    """Live brain-state estimate from a streaming spectrum of network activity.
+
+    Samples feed a ``SlidingSpectrum``; whenever a new segment enters it,
+    the relative band powers over the window are classified as in
+    ``classify_states``. A candidate state replaces the current one after
+    it has been seen for ``min_duration`` ms, which keeps brief
+    fluctuations from counting as transitions. Transitions and the time
+    spent in each state are kept; the footprint is that of the spectrum.
+
+    Register it with ``simulation.add_monitor(tracker)``, which bins the
+    signal into ``time_step`` intervals as ``SlidingSpectrum`` does, or feed
+    it with ``update``.
+
+    Args:
+        n_channels (int): Number of signals (e.g. populations or regions).
+        window (float): Span (ms) of the spectrum.
+        segment_length (float): Length (ms) of each transformed segment.
+        time_step (float): Sampling interval of the signals (ms).
+        min_duration (float): Time (ms) a new state must persist.
+        states, bands: As for ``classify_states``.
+        signal (function): As for ``SlidingSpectrum``.
+    """
+    def __init__(self, n_channels, window=4000.0, segment_length=1000.0, time_step=1.0, min_duration=2000.0,
+                 states=None, bands=None, signal=None, method='welch', bandwidth=2.0):
+        self.states = BRAIN_STATE_BANDS if states is None else states
+        self.bands = bands
+        self.min_duration = min_duration
+        self.spectrum = SlidingSpectrum(n_channels, window, segment_length, time_step=time_step, method=method,
+                                        bandwidth=bandwidth, signal=signal)
+        self.names = list(self.states)
+        self.reset()
+
+    def __call__(self, simulation):
+        sample = self.spectrum.accumulate(simulation)
+        if sample is not None:
+            self.update(sample, simulation.time + simulation.time_step)
+
+    def reset(self):
+        self.spectrum.reset()
+        self.state = None
+        self.since = None
+        self.candidate = None
+        self.candidate_since = None
+        self.transitions = []
+        self.dwell_times = dict.fromkeys(self.names, 0.0)
+        self.relative_powers = None
+
+    def update(self, samples, time):
+        """Append samples (``(n_channels,)`` or ``(n_channels, n)``) ending at ``time`` ms.
+
+        Returns:
+            str: The current state (None until the first window is filled).
+        """
+        if not self.spectrum.update(samples):
+            return self.state
+        self.relative_powers = relative_band_powers(*self.spectrum.spectrum(), self.bands)
+        label = self.names[int(classify_states(self.relative_powers, self.states, self.bands))]
+        if self.state is None:
+            self.state, self.since = label, time
+        elif label == self.state:
+            self.candidate = None
+        else:
+            if label != self.candidate:
+                self.candidate, self.candidate_since = label, time
+            if time - self.candidate_since >= self.min_duration:
+                self._switch(self.candidate, self.candidate_since)
+        return self.state
+
+    def _switch(self, state, time):
+        self.dwell_times[self.state] += time - self.since
+        self.transitions.append((time, self.state, state))
+        self.state, self.since = state, time
+        self.candidate = None
+
+    def occupancy(self, time):
+        """Time (ms) spent in every state up to ``time`` ms."""
+        dwell = dict(self.dwell_times)
+        if self.state is not None:
+            dwell[self.state] += time - self.since
+        return dwell
@@ -1 +1,437 @@
-# Applying graph theory to understand network characteristics
\ No newline at end of file
+# Applying graph theory to understand network characteristics
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ..common.error_handling import NetworkTopologyError, ParameterValueError
+from ..circuits.connectivity_matrix import expand_rows
+
+def symmetric_graph(source, target, n_nodes, weights=None):
+    """Undirected CSR graph from an edge list, without self-loops or repeated edges.
+
+    Every edge is stored in both directions and neighbours are sorted
+    within each row. Weights of repeated edges are summed. This is the
+    layout ``network_topology.undirected_graph`` builds from a
+    ``ConnectivityMatrix``; the metrics below take its ``indptr`` and
+    ``indices``.
+
+    Returns:
+        tuple: ``(indptr, indices, edge_weights)`` arrays.
+    """
+    source = np.asarray(source, dtype=np.int64)
+    target = np.asarray(target, dtype=np.int64)
+    weights = np.ones(len(source)) if weights is None else \
+        np.broadcast_to(np.asarray(weights, dtype=np.float64), source.shape)
+    keep = source != target
+    keys = np.concatenate((source[keep] * n_nodes + target[keep], target[keep] * n_nodes + source[keep]))
+    keys, inverse = np.unique(keys, return_inverse=True)
+    edge_weights = np.bincount(inverse, weights=np.concatenate((weights[keep], weights[keep])),
+                               minlength=len(keys))
+    source, indices = np.divmod(keys, n_nodes)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n_nodes), out=indptr[1:])
+    return indptr, indices, edge_weights
+
+def edge_list(indptr, indices):
+    """Each undirected edge once, as ``(u, v)`` arrays with ``u < v``."""
+    source = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    upper = source < indices
+    return source[upper], np.asarray(indices, dtype=np.int64)[upper]
+
+def union_graph(sources, targets, n_nodes):
+    """Disjoint union of graphs given as stacked edge lists of shape ``(n_graphs, n_edges)``.
+
+    Graph ``r`` occupies nodes ``r * n_nodes`` to ``(r + 1) * n_nodes - 1``,
+    so metrics of a whole ensemble can be computed in one pass.
+    """
+    offsets = np.arange(len(sources), dtype=np.int64)[:, None] * n_nodes
+    return symmetric_graph((sources + offsets).ravel(), (targets + offsets).ravel(), n_nodes * len(sources))
+
+def _map_chunks(function, chunks, max_workers):
+    """Apply ``function`` to every chunk in a thread pool; NumPy releases the GIL in the heavy kernels."""
+    if max_workers == 1 or len(chunks) <= 1:
+        return [function(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, chunks))
+
+def _work_chunks(work, chunk_size):
+    """Split items into consecutive ranges of roughly ``chunk_size`` total work."""
+    if len(work) == 0:
+        return []
+    cumulative = np.cumsum(work)
+    bounds = np.searchsorted(cumulative, np.arange(chunk_size, cumulative[-1], chunk_size), side='right')
+    bounds = np.unique(np.concatenate(([0], bounds, [len(work)])))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _contains(sorted_keys, queries):
+    """Membership of every query in a sorted key array.
+
+    Queries are sorted first: binary searches for ascending queries walk
+    the keys in order and are several times faster than random lookups.
+    """
+    result = np.zeros(len(queries), dtype=bool)
+    if len(sorted_keys) == 0 or len(queries) == 0:
+        return result
+    order = np.argsort(queries)
+    ordered = queries[order]
+    position = np.minimum(np.searchsorted(sorted_keys, ordered), len(sorted_keys) - 1)
+    result[order] = sorted_keys[position] == ordered
+    return result
+
+def triangle_counts(indptr, indices, chunk_size=1 << 22, max_workers=None):
+    """Number of triangles through every node.
+
+    Edges are oriented from lower to higher (degree, index) rank, which
+    bounds every out-degree by ``sqrt(2 m)``. For each oriented edge
+    ``u -> v`` every out-neighbour ``w`` of ``v`` is tested for the edge
+    ``u -> w`` with one binary search in the sorted edge keys, so each
+    triangle is found exactly once. Edges are processed in chunks of about
+    ``chunk_size`` candidate tests, in parallel.
+    """
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), degree))] = np.arange(n)
+    source = np.repeat(np.arange(n, dtype=np.int64), degree)
+    forward = rank[source] < rank[indices]
+    source, target = source[forward], np.asarray(indices, dtype=np.int64)[forward]
+    out_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n), out=out_indptr[1:])
+    keys = source * n + target
+    if np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys, source, target = keys[order], source[order], target[order]
+
+    def count(bounds):
+        start, stop = bounds
+        first, second = source[start:stop], target[start:stop]
+        positions = expand_rows(out_indptr, second)
+        owner = np.repeat(np.arange(stop - start), np.diff(out_indptr)[second])
+        third = target[positions]
+        queries = first[owner] * n + third
+        found = np.searchsorted(keys, queries)
+        found = (found < len(keys)) & (keys[np.minimum(found, len(keys) - 1)] == queries)
+        closing = owner[found]
+        return (np.bincount(first[closing], minlength=n) + np.bincount(second[closing], minlength=n) +
+                np.bincount(third[found], minlength=n))
+
+    chunks = _work_chunks(np.diff(out_indptr)[target], chunk_size)
+    return sum(_map_chunks(count, chunks, max_workers), np.zeros(n, dtype=np.int64))
+
+def clustering_coefficients(indptr, indices, triangles=None, **options):
+    """Local clustering coefficient of every node (0 for degree below two)."""
+    triangles = triangle_counts(indptr, indices, **options) if triangles is None else triangles
+    degree = np.diff(indptr)
+    pairs = degree * (degree - 1) / 2.0
+    return np.divide(triangles, pairs, out=np.zeros(len(degree)), where=pairs > 0)
+
+def average_clustering(indptr, indices, **options):
+    return clustering_coefficients(indptr, indices, **options).mean()
+
+def transitivity(indptr, indices, triangles=None, **options):
+    """Global clustering: three times the triangles over the connected triples."""
+    triangles = triangle_counts(indptr, indices, **options) if triangles is None else triangles
+    degree = np.diff(indptr).astype(np.float64)
+    triples = (degree * (degree - 1) / 2.0).sum()
+    return triangles.sum() / triples if triples else 0.0
+
+def multi_source_bfs(indptr, indices, sources):
+    """Breadth-first search from up to 64 sources at once over bit-packed frontiers.
+
+    Every node holds one 64-bit word whose bit ``j`` records whether source
+    ``j`` has reached it, so one level of all searches is one gather of the
+    frontier words over the edges followed by a bitwise-or reduction per
+    row.
+
+    Returns:
+        dict: Per source, the sum of distances, the number of nodes reached,
+        the sum of inverse distances and the eccentricity (within its component).
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    if len(sources) > 64:
+        raise ParameterValueError('sources', "At most 64 sources can share one search")
+    n = len(indptr) - 1
+    nonempty = np.flatnonzero(np.diff(indptr))
+    starts = indptr[:-1][nonempty]
+    bits = np.left_shift(np.uint64(1), np.arange(len(sources), dtype=np.uint64))
+    visited = np.zeros(n, dtype=np.uint64)
+    np.bitwise_or.at(visited, sources, bits)
+    frontier = visited.copy()
+    totals = {name: np.zeros(len(sources)) for name in ('distance_sums', 'reached', 'inverse_sums',
+                                                         'eccentricity')}
+    reached = np.zeros(n, dtype=np.uint64)
+    level = 0
+    while True:
+        level += 1
+        reached[:] = 0
+        if len(starts):
+            reached[nonempty] = np.bitwise_or.reduceat(frontier[indices], starts)
+        reached &= ~visited
+        touched = np.flatnonzero(reached)
+        if len(touched) == 0:
+            break
+        visited[touched] |= reached[touched]
+        counts = np.unpackbits(reached[touched].view(np.uint8), bitorder='little').reshape(-1, 64)
+        counts = counts.sum(axis=0)[:len(sources)]
+        totals['distance_sums'] += level * counts
+        totals['reached'] += counts
+        totals['inverse_sums'] += counts / level
+        totals['eccentricity'][counts > 0] = level
+        frontier, reached = reached, frontier
+    return totals
+
+def path_length(indptr, indices, n_sources=256, confidence=0.95, rng=None, max_workers=None):
+    """Characteristic path length and global efficiency estimated from sampled sources.
+
+    Sources are drawn without replacement and searched 64 at a time with
+    ``multi_source_bfs``, batches running in parallel. With all nodes as
+    sources the results are exact. The mean path length is the ratio of
+    summed distances to reached pairs; its standard error comes from the
+    delta method (with finite-population correction), and a distribution-free
+    Hoeffding half-width uses the diameter bound ``2 * min(eccentricity)``.
+
+    Returns:
+        dict: ``mean_path_length``, ``standard_error``, ``confidence_interval``,
+        ``hoeffding_bound``, ``global_efficiency``, ``diameter_bounds`` and ``n_sources``.
+    """
+    from scipy.stats import norm
+
+    n = len(indptr) - 1
+    if n < 2:
+        raise NetworkTopologyError("Path lengths need at least two nodes")
+    rng = np.random.default_rng(rng)
+    k = min(int(n_sources), n)
+    sources = np.arange(n) if k == n else rng.choice(n, size=k, replace=False)
+    batches = _map_chunks(lambda batch: multi_source_bfs(indptr, indices, batch),
+                          [sources[start:start + 64] for start in range(0, k, 64)], max_workers)
+    totals = {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+    distances, reached = totals['distance_sums'], totals['reached']
+    if reached.sum() == 0:
+        raise NetworkTopologyError("Graph has no edges between sampled sources and other nodes")
+    mean = distances.sum() / reached.sum()
+    correction = 1.0 - k / n
+    if k > 1:
+        residual = distances - mean * reached
+        error = np.sqrt(correction * residual.var(ddof=1) / k) / reached.mean()
+    else:
+        error = np.inf
+    z = norm.ppf(0.5 + confidence / 2.0)
+    eccentricity = totals['eccentricity']
+    upper_diameter = 2.0 * eccentricity[eccentricity > 0].min()
+    hoeffding = 0.0 if k == n else \
+        (upper_diameter - 1.0) * np.sqrt(np.log(2.0 / (1.0 - confidence)) / (2.0 * k))
+    return {'mean_path_length': mean, 'standard_error': error,
+            'confidence_interval': (mean - z * error, mean + z * error), 'hoeffding_bound': hoeffding,
+            'global_efficiency': totals['inverse_sums'].sum() / (k * (n - 1)),
+            'diameter_bounds': (eccentricity.max(), upper_diameter), 'n_sources': k}
+
+def modularity(indptr, indices, labels, edge_weights=None):
+    """Newman modularity of a partition of an undirected (optionally weighted) graph."""
+    labels = np.asarray(labels, dtype=np.int64)
+    weights = np.ones(len(indices)) if edge_weights is None else edge_weights
+    source = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    total = weights.sum()
+    if total == 0:
+        return 0.0
+    internal = weights[labels[source] == labels[indices]].sum()
+    community_strength = np.bincount(labels, weights=np.bincount(source, weights=weights,
+                                                                 minlength=len(labels)))
+    return internal / total - np.sum((community_strength / total) ** 2)
+
+def _local_moving(source, target, weights, n, rng, max_passes, tolerance):
+    """Vectorized Louvain local moving on a directed-pair edge list (self-loops allowed).
+
+    All nodes pick their best neighbouring community from the same
+    snapshot; only a random half of the improving nodes move per pass so
+    that neighbours do not keep swapping communities. Passes stop once
+    modularity improves by less than ``tolerance``; a pass that lowers it
+    is undone.
+    """
+    strength = np.bincount(source, weights=weights, minlength=n)
+    total = weights.sum()
+    loops = weights[source == target].sum()
+    labels = np.arange(n)
+    off_diagonal = source != target
+    source, target, weights = source[off_diagonal], target[off_diagonal], weights[off_diagonal]
+    previous_labels, previous_quality = labels, -np.inf
+    for _ in range(max_passes):
+        community_total = np.bincount(labels, weights=strength, minlength=n)
+        keys = source * n + labels[target]
+        order = np.argsort(keys)
+        keys = keys[order]
+        boundaries = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        links = np.add.reduceat(weights[order], boundaries) if len(keys) else np.zeros(0)
+        node, community = np.divmod(keys[boundaries], n)
+        own = community == labels[node]
+        quality = (links[own].sum() + loops) / total - np.sum((community_total / total) ** 2)
+        if quality < previous_quality:
+            labels = previous_labels
+            break
+        if quality - previous_quality < tolerance or len(node) == 0:
+            break
+        previous_labels, previous_quality = labels.copy(), quality
+
+        removed_total = community_total[community] - np.where(own, strength[node], 0.0)
+        gain = links - strength[node] * removed_total / total
+        stay = -strength * (community_total[labels] - strength) / total
+        stay[node[own]] += links[own]
+        groups = np.flatnonzero(np.concatenate(([True], node[1:] != node[:-1])))
+        best_gain = np.maximum.reduceat(gain, groups)
+        is_best = gain >= np.repeat(best_gain, np.diff(np.append(groups, len(gain))))
+        best = np.maximum.reduceat(np.where(is_best, np.arange(len(gain)), -1), groups)
+        candidates = node[best]
+        improving = (gain[best] > stay[candidates] + 1e-12 * total) & (community[best] != labels[candidates])
+        if not np.any(improving):
+            break
+        movers = best[improving & (rng.random(len(best)) < 0.5)]
+        labels[node[movers]] = community[movers]
+    labels = np.unique(labels, return_inverse=True)[1]
+    return labels, labels.max(initial=-1) + 1 < n
+
+def louvain_communities(indptr, indices, edge_weights=None, max_levels=10, max_passes=50, tolerance=1e-4,
+                        rng=None):
+    """Community labels maximizing modularity with a vectorized Louvain method.
+
+    Each level runs synchronous local moving over all nodes (see
+    ``_local_moving``) and then merges every community into one node of
+    the next, coarser graph, until no communities merge.
+    """
+    rng = np.random.default_rng(rng)
+    n = len(indptr) - 1
+    source = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    target = np.asarray(indices, dtype=np.int64)
+    weights = np.ones(len(target)) if edge_weights is None else np.asarray(edge_weights, dtype=np.float64)
+    membership = np.arange(n)
+    size = n
+    for _ in range(max_levels):
+        labels, merged = _local_moving(source, target, weights, size, rng, max_passes, tolerance)
+        if not merged:
+            break
+        membership = labels[membership]
+        size = labels.max() + 1
+        keys, inverse = np.unique(labels[source] * size + labels[target], return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(keys))
+        source, target = np.divmod(keys, size)
+    return membership
+
+def rich_club_coefficients(indptr, indices):
+    """Rich-club coefficient ``phi(k)`` for every degree ``k`` from 0 to the maximum degree.
+
+    ``phi(k)`` is the edge density among nodes of degree above ``k``; NaN
+    where fewer than two such nodes exist. Computed from histograms of node
+    degrees and of the smaller endpoint degree of every edge.
+    """
+    degree = np.diff(indptr)
+    first, second = edge_list(indptr, indices)
+    max_degree = int(degree.max(initial=0))
+    smaller = np.minimum(degree[first], degree[second])
+    edges_above = np.cumsum(np.bincount(smaller, minlength=max_degree + 1)[::-1])[::-1]
+    nodes_above = np.cumsum(np.bincount(degree, minlength=max_degree + 1)[::-1])[::-1]
+    # Edges and nodes with degree strictly greater than k.
+    edges_above = np.append(edges_above[1:], 0).astype(np.float64)
+    nodes_above = np.append(nodes_above[1:], 0).astype(np.float64)
+    pairs = nodes_above * (nodes_above - 1) / 2.0
+    return np.divide(edges_above, pairs, out=np.full(len(pairs), np.nan), where=pairs > 0)
+
+def rewired_ensemble(indptr, indices, n_graphs=10, swaps_per_edge=10, rng=None, max_rounds=1000):
+    """Degree-preserving randomizations of a graph, generated together.
+
+    Edge lists of all ``n_graphs`` copies are held in ``(n_graphs, m)``
+    arrays. Every round pairs up the edges of each copy at random and
+    proposes all double-edge swaps ``(a, b), (c, d) -> (a, d), (c, b)`` at
+    once; swaps creating self-loops, existing edges or duplicates within
+    the round are rejected with one sort and binary search over the edge
+    keys of all copies. Rounds continue until every copy has accepted
+    ``swaps_per_edge * m`` swaps.
+
+    Returns:
+        tuple: Source and target arrays of shape ``(n_graphs, m)``; see
+        ``union_graph`` to analyse them together.
+    """
+    rng = np.random.default_rng(rng)
+    n = len(indptr) - 1
+    first, second = edge_list(indptr, indices)
+    m = len(first)
+    sources = np.tile(first, (n_graphs, 1))
+    targets = np.tile(second, (n_graphs, 1))
+    if m < 2:
+        return sources, targets
+    half = m // 2
+    rows = np.arange(n_graphs)[:, None]
+    offsets = rows.astype(np.int64) * n * n
+    accepted = np.zeros(n_graphs, dtype=np.int64)
+    goal = swaps_per_edge * m
+    flat_sources, flat_targets = sources.ravel(), targets.ravel()
+    for _ in range(max_rounds):
+        if np.all(accepted >= goal):
+            break
+        existing = np.sort((np.minimum(sources, targets) * n + np.maximum(sources, targets) + offsets).ravel())
+        order = rng.permuted(np.broadcast_to(np.arange(m), (n_graphs, m)), axis=1) + rows * m
+        left, right = order[:, :half].ravel(), order[:, half:2 * half].ravel()
+        a, b = flat_sources[left], flat_targets[left]
+        c, d = flat_sources[right], flat_targets[right]
+        flip = rng.random(len(left)) < 0.5
+        c, d = np.where(flip, d, c), np.where(flip, c, d)
+        graph_offsets = np.repeat(offsets.ravel(), half)
+        new_first = np.minimum(a, d) * n + np.maximum(a, d) + graph_offsets
+        new_second = np.minimum(c, b) * n + np.maximum(c, b) + graph_offsets
+        valid = (a != d) & (c != b) & np.repeat(accepted < goal, half)
+        candidates = np.flatnonzero(valid)
+        valid[candidates] = ~(_contains(existing, new_first[candidates]) |
+                              _contains(existing, new_second[candidates]))
+        candidates = np.flatnonzero(valid)
+        proposed = np.concatenate((new_first[candidates], new_second[candidates]))
+        order = np.argsort(proposed)
+        repeated = np.zeros(len(proposed), dtype=bool)
+        same = proposed[order[1:]] == proposed[order[:-1]]
+        repeated[order[1:][same]] = True
+        repeated[order[:-1][same]] = True
+        swapped = candidates[~repeated.reshape(2, -1).any(axis=0)]
+        flat_targets[left[swapped]] = d[swapped]
+        flat_sources[right[swapped]] = c[swapped]
+        flat_targets[right[swapped]] = b[swapped]
+        accepted += np.bincount(swapped // half, minlength=n_graphs)
+    return sources, targets
+
+def small_worldness(indptr, indices, n_null=10, swaps_per_edge=10, n_sources=256, rng=None, max_workers=None):
+    """Small-world coefficients against degree-preserving random graphs.
+
+    ``sigma = (C / C_rand) / (L / L_rand)`` uses the average clustering
+    ``C`` and characteristic path length ``L``; the null values come from
+    one pass over the union of a ``rewired_ensemble``. ``omega = L_rand / L
+    - C / C_lattice`` uses the clustering of a ring lattice with the same
+    mean degree, ``3 (k - 2) / (4 (k - 1))``.
+    """
+    rng = np.random.default_rng(rng)
+    n = len(indptr) - 1
+    clustering = average_clustering(indptr, indices, max_workers=max_workers)
+    length = path_length(indptr, indices, n_sources, rng=rng, max_workers=max_workers)['mean_path_length']
+    sources, targets = rewired_ensemble(indptr, indices, n_null, swaps_per_edge, rng)
+    null_indptr, null_indices, _ = union_graph(sources, targets, n)
+    null_clustering = average_clustering(null_indptr, null_indices, max_workers=max_workers)
+    null_length = path_length(null_indptr, null_indices, n_sources * n_null, rng=rng,
+                              max_workers=max_workers)['mean_path_length']
+    mean_degree = len(indices) / n
+    lattice_clustering = 3.0 * (mean_degree - 2.0) / (4.0 * (mean_degree - 1.0))
+    return {'sigma': (clustering / null_clustering) / (length / null_length),
+            'omega': null_length / length - clustering / lattice_clustering,
+            'clustering': clustering, 'path_length': length,
+            'null_clustering': null_clustering, 'null_path_length': null_length}
+
+def benchmark_graph_metrics(n_nodes=100_000, mean_degree=20, n_sources=256, rng=None, max_workers=None):
+    """Seconds taken by each metric on a random graph of ``n_nodes`` nodes."""
+    rng = np.random.default_rng(rng)
+    n_edges = n_nodes * mean_degree // 2
+    indptr, indices, _ = symmetric_graph(rng.integers(0, n_nodes, n_edges), rng.integers(0, n_nodes, n_edges),
+                                         n_nodes)
+    results = {}
+    for name, run in (
+            ('triangles', lambda: triangle_counts(indptr, indices, max_workers=max_workers)),
+            ('path_length', lambda: path_length(indptr, indices, n_sources, rng=rng, max_workers=max_workers)),
+            ('rich_club', lambda: rich_club_coefficients(indptr, indices)),
+            ('louvain', lambda: louvain_communities(indptr, indices, rng=rng)),
+            ('rewired_ensemble', lambda: rewired_ensemble(indptr, indices, 10, 1, rng))):
+        start = time.perf_counter()
+        run()
+        results[name] = time.perf_counter() - start
+    return results
@@ -1 +1,45 @@
-# Application of mean field theory in large-scale brain modeling
\ No newline at end of file
+# Application of mean field theory in large-scale brain modeling
+
+import numpy as np
+from .neural_mass_model import NeuralMassModel
+
+def wong_wang_transfer(current, gain=270.0, threshold=108.0, curvature=0.154):
+    """Population firing rate (Hz) for input current ``current`` (nA).
+
+    The mean-field approximation of a leaky integrate-and-fire population
+    used by the reduced Wong-Wang model, ``(a x - b) / (1 - exp(-d (a x - b)))``,
+    evaluated stably near ``a x = b``.
+    """
+    drive = gain * np.asarray(current, dtype=np.float64) - threshold
+    small = np.abs(drive) < 1e-9
+    safe = np.where(small, 1.0, drive)
+    return np.where(small, 1.0 / curvature + 0.5 * drive, safe / -np.expm1(-curvature * safe))
+
+class ReducedWongWang(NeuralMassModel):
+    """Reduced Wong-Wang model: NMDA gating of one excitatory population per region.
+
+    Mean-field reduction of a spiking attractor network (Deco et al., 2013):
+    ``dS/dt = -S / tau_s + (1 - S) gamma H(w J_N S + I_o + J_N coupling)``,
+    with ``H`` from ``wong_wang_transfer``. Regions couple through ``S``.
+    ``gamma`` is per ms for rates in Hz.
+    """
+    state_variables = ('S',)
+    defaults = {'a': 270.0, 'b': 108.0, 'd': 0.154, 'gamma': 0.641e-3, 'tau_s': 100.0,
+                'w': 0.9, 'J_N': 0.2609, 'I_o': 0.3}
+
+    def initial_state(self, shape, parameters, rng):
+        return rng.uniform(0.0, 0.2, (1,) + shape)
+
+    def derivatives(self, state, coupling, p):
+        gating = state[0]
+        current = p['w'] * p['J_N'] * gating + p['I_o'] + p['J_N'] * coupling
+        rate = wong_wang_transfer(current, p['a'], p['b'], p['d'])
+        return (-gating / p['tau_s'] + (1.0 - gating) * p['gamma'] * rate)[None]
+
+    def coupling_output(self, state, p):
+        return state[0]
+
+    def firing_rate(self, state, coupling, p):
+        """Population rate (Hz) of every region for a state and its coupling."""
+        current = p['w'] * p['J_N'] * state[0] + p['I_o'] + p['J_N'] * coupling
+        return wong_wang_transfer(current, p['a'], p['b'], p['d'])
@@ -1 +1,277 @@
-# Analysis of network structures and connectivity patterns
\ No newline at end of file
+# Analysis of network structures and connectivity patterns
+
+import numpy as np
+from ..common.error_handling import NetworkTopologyError, ParameterValueError
+from ..circuits.connectivity_matrix import expand_rows
+
+def undirected_graph(connectivity):
+    """Symmetric CSR graph of a recurrent connectivity matrix.
+
+    Self-connections are dropped and reciprocal or repeated synapses are
+    merged into one undirected edge whose weight counts them.
+
+    Returns:
+        tuple: ``(indptr, indices, edge_weights)`` arrays.
+    """
+    if connectivity.n_pre != connectivity.n_post:
+        raise NetworkTopologyError("Partitioning needs a recurrent (square) connectivity matrix")
+    n = connectivity.n_pre
+    pre = connectivity.presynaptic_indices().astype(np.int64)
+    post = connectivity.indices.astype(np.int64)
+    keep = pre != post
+    source = np.concatenate((pre[keep], post[keep]))
+    target = np.concatenate((post[keep], pre[keep]))
+    keys, counts = np.unique(source * n + target, return_counts=True)
+    source, target = np.divmod(keys, n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n), out=indptr[1:])
+    return indptr, target, counts.astype(np.float64)
+
+def breadth_first_order(indptr, indices):
+    """Visit order of a level-synchronous breadth-first search over all components.
+
+    Each search starts from the unvisited vertex of lowest degree, which
+    tends to lie at the periphery and yields long, narrow level sets.
+    """
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    visited = np.zeros(n, dtype=bool)
+    order = []
+    isolated = degree == 0
+    visited[isolated] = True
+    candidates = np.argsort(degree, kind='stable')
+    cursor = 0
+    while cursor < n:
+        start = candidates[cursor]
+        if visited[start]:
+            cursor += 1
+            continue
+        frontier = np.array([start])
+        visited[start] = True
+        while len(frontier):
+            order.append(frontier)
+            neighbours = indices[expand_rows(indptr, frontier)]
+            neighbours = np.unique(neighbours[~visited[neighbours]])
+            visited[neighbours] = True
+            frontier = neighbours
+    order.append(np.flatnonzero(isolated))
+    return np.concatenate(order).astype(np.int64)
+
+def vertex_weights(connectivity, compute_cost=None, synapse_cost=1.0):
+    """Load of each neuron: its own update cost plus the synapses it receives."""
+    cost = np.ones(connectivity.n_post) if compute_cost is None else \
+        np.broadcast_to(np.asarray(compute_cost, dtype=np.float64), (connectivity.n_post,))
+    return cost + synapse_cost * np.bincount(connectivity.indices, minlength=connectivity.n_post)
+
+def partition_connections(indptr, indices, edge_weights, labels, n_partitions):
+    """Total edge weight from every vertex into each partition it has edges into.
+
+    Only (vertex, partition) pairs joined by at least one edge are listed,
+    so memory grows with the number of edges rather than with
+    ``n * n_partitions``.
+
+    Returns:
+        tuple: ``(vertices, partitions, weights)`` arrays sorted by vertex, then partition.
+    """
+    n = len(indptr) - 1
+    source = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    keys, inverse = np.unique(source * n_partitions + labels[indices], return_inverse=True)
+    weights = np.bincount(inverse.reshape(-1), weights=edge_weights, minlength=len(keys))
+    vertices, partitions = np.divmod(keys, n_partitions)
+    return vertices, partitions, weights
+
+def _own_connections(connections, labels):
+    """Edge weight from every vertex into its own partition."""
+    vertices, partitions, weights = connections
+    own = np.zeros(len(labels))
+    inside = partitions == labels[vertices]
+    own[vertices[inside]] = weights[inside]
+    return own
+
+def _strongest_partitions(connections, eligible):
+    """For every vertex with an ``eligible`` entry, the eligible partition it is most tied to.
+
+    Returns:
+        tuple: ``(vertices, partitions, weights)`` with one entry per vertex.
+    """
+    vertices, partitions, weights = (array[eligible] for array in connections)
+    order = np.lexsort((-weights, vertices))
+    vertices, partitions, weights = vertices[order], partitions[order], weights[order]
+    first = np.ones(len(vertices), dtype=bool)
+    first[1:] = vertices[1:] != vertices[:-1]
+    return vertices[first], partitions[first], weights[first]
+
+def edge_cut(indptr, indices, edge_weights, labels):
+    """Total weight of undirected edges whose endpoints lie in different partitions."""
+    source = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return edge_weights[labels[source] != labels[indices]].sum() / 2.0
+
+def _refine(indptr, indices, edge_weights, labels, weights, capacity, n_partitions, passes):
+    """Greedy boundary refinement that moves vertices to the partition they are most tied to.
+
+    All moves of a pass are decided at once from the same snapshot. To keep
+    neighbours from swapping back and forth, even passes only move vertices
+    to higher-numbered partitions and odd passes to lower-numbered ones.
+    Each receiving partition accepts the highest-gain moves that fit under
+    its capacity.
+    """
+    idle_passes = 0
+    for iteration in range(passes):
+        connections = partition_connections(indptr, indices, edge_weights, labels, n_partitions)
+        own = _own_connections(connections, labels)
+        vertices, partitions, _ = connections
+        if iteration % 2 == 0:
+            allowed = partitions > labels[vertices]
+        else:
+            allowed = partitions < labels[vertices]
+        candidates, best, strongest = _strongest_partitions(connections, allowed)
+        gain = strongest - own[candidates]
+        positive = gain > 0
+        movers, best, gain = candidates[positive], best[positive], gain[positive]
+        if len(movers) == 0:
+            idle_passes += 1
+            if idle_passes == 2:
+                break
+            continue
+        idle_passes = 0
+        load = np.bincount(labels, weights=weights, minlength=n_partitions)
+        order = np.lexsort((-gain, best))
+        movers, destinations = movers[order], best[order]
+        cumulative = np.cumsum(weights[movers])
+        group_start = np.searchsorted(destinations, np.arange(n_partitions))
+        offset = np.concatenate(([0.0], cumulative))[group_start]
+        accepted = cumulative - offset[destinations] + load[destinations] <= capacity[destinations]
+        labels[movers[accepted]] = destinations[accepted]
+    return labels
+
+def partition_network(connectivity, n_partitions, compute_cost=None, synapse_cost=1.0,
+                      imbalance=0.05, refinement_passes=20):
+    """Split a network into balanced partitions with a small edge cut.
+
+    Two orders of the vertices are cut into chunks of equal load: the
+    given neuron numbering, which already keeps neighbours together in
+    generated networks such as ring lattices, and a breadth-first search,
+    which does so for arbitrarily numbered ones. Both are refined greedily
+    while no partition exceeds ``(1 + imbalance)`` times the mean load,
+    and the partition with the smaller edge cut is returned.
+
+    Args:
+        connectivity (ConnectivityMatrix): Recurrent synapses of the network.
+        n_partitions (int): Number of partitions (e.g. worker processes).
+        compute_cost (float or np.ndarray): Update cost of each neuron.
+        synapse_cost (float): Cost of one incoming synapse relative to ``compute_cost``.
+        imbalance (float): Allowed relative excess load of any partition.
+        refinement_passes (int): Maximum number of refinement passes.
+
+    Returns:
+        np.ndarray: Partition label of every neuron.
+    """
+    if n_partitions < 1:
+        raise ParameterValueError('n_partitions', "At least one partition is required")
+    indptr, indices, edge_weights = undirected_graph(connectivity)
+    weights = vertex_weights(connectivity, compute_cost, synapse_cost)
+    capacity = np.full(n_partitions, (1.0 + imbalance) * weights.sum() / n_partitions)
+    best_labels, best_cut = None, np.inf
+    for order in (np.arange(len(weights)), breadth_first_order(indptr, indices)):
+        cumulative = np.cumsum(weights[order])
+        chunk = np.minimum((cumulative - weights[order] / 2.0) * n_partitions // cumulative[-1],
+                           n_partitions - 1).astype(np.int64)
+        labels = np.empty(len(order), dtype=np.int64)
+        labels[order] = chunk
+        labels = _refine(indptr, indices, edge_weights, labels, weights, capacity, n_partitions,
+                         refinement_passes)
+        cut = edge_cut(indptr, indices, edge_weights, labels)
+        if cut < best_cut:
+            best_labels, best_cut = labels, cut
+    return best_labels
+
+def partition_bounds(labels, n_partitions=None):
+    """Neuron order that makes every partition contiguous, plus its boundaries.
+
+    The result can renumber a network (``connectivity.permuted(order)``)
+    for a simulation that expects one contiguous neuron range per worker.
+    """
+    n_partitions = int(labels.max()) + 1 if n_partitions is None else n_partitions
+    order = np.argsort(labels, kind='stable')
+    bounds = np.zeros(n_partitions + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=n_partitions), out=bounds[1:])
+    return order, bounds
+
+class LoadBalancer:
+    """Keeps a partition balanced against measured per-partition step times.
+
+    Feed it the time each partition spent computing with
+    ``record_step_times``; once the slowest partition exceeds the mean by
+    more than ``tolerance``, ``rebalance`` rescales every neuron's load by
+    the measured cost per unit of its partition and moves boundary neurons
+    out of the overloaded partitions.
+
+    To balance a running ``PartitionedSimulation``, build the balancer from
+    the connectivity and labels in the original neuron numbering and
+    migrate neurons with the labels it returns::
+
+        balancer.record_step_times(simulation.partition_times())
+        if balancer.needs_rebalance():
+            simulation.repartition(balancer.rebalance())
+    """
+    def __init__(self, connectivity, labels, compute_cost=None, synapse_cost=1.0,
+                 tolerance=0.1, smoothing=0.5):
+        self.graph = undirected_graph(connectivity)
+        self.weights = vertex_weights(connectivity, compute_cost, synapse_cost)
+        self.labels = np.asarray(labels, dtype=np.int64).copy()
+        self.n_partitions = int(self.labels.max()) + 1
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.step_times = None
+
+    def record_step_times(self, step_times):
+        """Blend new per-partition timings into an exponential moving average."""
+        step_times = np.asarray(step_times, dtype=np.float64)
+        if self.step_times is None:
+            self.step_times = step_times.copy()
+        else:
+            self.step_times += self.smoothing * (step_times - self.step_times)
+
+    def imbalance(self):
+        """Relative excess of the slowest partition over the mean step time."""
+        if self.step_times is None:
+            return 0.0
+        return self.step_times.max() / self.step_times.mean() - 1.0
+
+    def needs_rebalance(self):
+        return self.imbalance() > self.tolerance
+
+    def rebalance(self, refinement_passes=20):
+        """Move neurons out of slow partitions; returns the new labels."""
+        load = np.bincount(self.labels, weights=self.weights, minlength=self.n_partitions)
+        cost_per_unit = self.step_times / np.maximum(load, 1e-12)
+        effective = self.weights * cost_per_unit[self.labels]
+        indptr, indices, edge_weights = self.graph
+        capacity = np.full(self.n_partitions, (1.0 + self.tolerance / 2.0) * effective.sum() / self.n_partitions)
+
+        for _ in range(refinement_passes):
+            current = np.bincount(self.labels, weights=effective, minlength=self.n_partitions)
+            excess = current - capacity
+            if np.all(excess <= 0):
+                break
+            connections = partition_connections(indptr, indices, edge_weights, self.labels, self.n_partitions)
+            own = _own_connections(connections, self.labels)
+            candidates, best, strongest = _strongest_partitions(connections, excess[connections[1]] < 0)
+            overloaded = excess[self.labels[candidates]] > 0
+            candidates, best, strongest = candidates[overloaded], best[overloaded], strongest[overloaded]
+            if len(candidates) == 0:
+                break
+            loss = own[candidates] - strongest
+            order = np.lexsort((loss, self.labels[candidates]))
+            candidates, best = candidates[order], best[order]
+            sources = self.labels[candidates]
+            cumulative = np.cumsum(effective[candidates])
+            group_start = np.searchsorted(sources, np.arange(self.n_partitions))
+            offset = np.concatenate(([0.0], cumulative))[group_start]
+            within_excess = cumulative - offset[sources] - effective[candidates] < excess[sources]
+            self.labels[candidates[within_excess]] = best[within_excess]
+
+        self.labels = _refine(indptr, indices, edge_weights, self.labels, effective, capacity,
+                              self.n_partitions, refinement_passes)
+        self.step_times = None
+        return self.labels
@@ -1 +1,256 @@
-# Aggregated models of large-scale brain dynamics
\ No newline at end of file
+# Aggregated models of large-scale brain dynamics
+
+import time
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..common.simulation_framework import Simulation
+from ..circuits.connectivity_matrix import ConnectivityMatrix
+
+def parameter_grid(**values):
+    """Flatten the Cartesian product of parameter values into one batch.
+
+    Returns:
+        tuple: Number of parameter sets and a dict of arrays of that length,
+        ready to pass as batched parameters of a ``NeuralMassSimulation``.
+    """
+    grids = np.meshgrid(*[np.asarray(value, dtype=np.float64) for value in values.values()], indexing='ij')
+    batch = {name: grid.ravel() for name, grid in zip(values, grids)}
+    return (grids[0].size if grids else 1), batch
+
+class NeuralMassModel:
+    """Mean activity of one brain region, evaluated for many regions and parameter sets at once.
+
+    States have shape ``(n_state_variables, n_regions, n_batch)`` and
+    parameters broadcast against ``(n_regions, n_batch)``, so one call
+    covers a whole connectome for a whole parameter scan. ``coupling``
+    has shape ``(n_regions, n_batch)`` and is the delayed, weighted sum of
+    ``coupling_output`` over afferent regions.
+
+    Units: ms.
+    """
+    state_variables = ()
+    defaults = {}
+
+    def initial_state(self, shape, parameters, rng):
+        return np.zeros((len(self.state_variables),) + shape)
+
+    def derivatives(self, state, coupling, parameters):
+        raise NotImplementedError("Derivatives method must be implemented.")
+
+    def coupling_output(self, state, parameters):
+        """Quantity a region sends to the regions it projects to."""
+        raise NotImplementedError("Coupling output method must be implemented.")
+
+    def observable(self, state, parameters):
+        """Quantity recorded by ``NeuralMassSimulation.record``."""
+        return self.coupling_output(state, parameters)
+
+def _wilson_cowan_sigmoid(x, slope, threshold):
+    return 1.0 / (1.0 + np.exp(-slope * (x - threshold))) - 1.0 / (1.0 + np.exp(slope * threshold))
+
+class WilsonCowan(NeuralMassModel):
+    """Wilson-Cowan excitatory/inhibitory population pair; regions couple through E."""
+    state_variables = ('E', 'I')
+    defaults = {'c_ee': 16.0, 'c_ei': 12.0, 'c_ie': 15.0, 'c_ii': 3.0, 'tau_e': 10.0, 'tau_i': 10.0,
+                'slope_e': 1.3, 'threshold_e': 4.0, 'slope_i': 2.0, 'threshold_i': 3.7,
+                'refractory_e': 1.0, 'refractory_i': 1.0, 'P': 1.25, 'Q': 0.0}
+
+    def derivatives(self, state, coupling, p):
+        e, i = state
+        input_e = p['c_ee'] * e - p['c_ei'] * i + p['P'] + coupling
+        input_i = p['c_ie'] * e - p['c_ii'] * i + p['Q']
+        de = (-e + (1.0 - p['refractory_e'] * e) *
+              _wilson_cowan_sigmoid(input_e, p['slope_e'], p['threshold_e'])) / p['tau_e']
+        di = (-i + (1.0 - p['refractory_i'] * i) *
+              _wilson_cowan_sigmoid(input_i, p['slope_i'], p['threshold_i'])) / p['tau_i']
+        return np.stack((de, di))
+
+    def coupling_output(self, state, p):
+        return state[0]
+
+class JansenRit(NeuralMassModel):
+    """Jansen-Rit cortical column of pyramidal cells and excitatory and inhibitory interneurons.
+
+    Rates are per ms (``2 * e0`` is the maximum firing rate of 5 Hz) and
+    potentials in mV. The recorded observable is the pyramidal membrane potential
+    ``y1 - y2`` (an EEG proxy); regions exchange the pyramidal firing rate.
+    """
+    state_variables = ('y0', 'y1', 'y2', 'y3', 'y4', 'y5')
+    defaults = {'A': 3.25, 'B': 22.0, 'a': 0.1, 'b': 0.05, 'e0': 0.0025, 'v0': 6.0, 'r': 0.56,
+                'C': 135.0, 'p': 0.22}
+
+    @staticmethod
+    def _sigmoid(v, p):
+        return 2.0 * p['e0'] / (1.0 + np.exp(p['r'] * (p['v0'] - v)))
+
+    def derivatives(self, state, coupling, p):
+        y0, y1, y2, y3, y4, y5 = state
+        a, b, c = p['a'], p['b'], p['C']
+        dy3 = p['A'] * a * self._sigmoid(y1 - y2, p) - 2.0 * a * y3 - a * a * y0
+        dy4 = p['A'] * a * (p['p'] + 0.8 * c * self._sigmoid(c * y0, p) + coupling) - 2.0 * a * y4 - a * a * y1
+        dy5 = p['B'] * b * 0.25 * c * self._sigmoid(0.25 * c * y0, p) - 2.0 * b * y5 - b * b * y2
+        return np.stack((y3, y4, y5, dy3, dy4, dy5))
+
+    def coupling_output(self, state, p):
+        return self._sigmoid(state[1] - state[2], p)
+
+    def observable(self, state, p):
+        return state[1] - state[2]
+
+class NeuralMassSimulation(Simulation):
+    """All regions of a connectome and a batch of parameter sets integrated together.
+
+    Regions are coupled through a sparse region-to-region
+    ``ConnectivityMatrix`` whose delays are honoured with a ring buffer of
+    past coupling outputs: ``max_delay + 1`` slots of shape
+    ``(n_regions, n_batch)``. Each step gathers the delayed outputs of all
+    connections with one ``take`` and sums them per target region with one
+    sparse matrix product, then advances every region and parameter set
+    with one stochastic Heun step. A parameter scan of ``n_batch`` sets
+    therefore costs one simulation with wider arrays.
+
+    Model parameters not given in ``parameters`` take the model defaults.
+    Scalars apply everywhere, 1-D arrays of length ``n_batch`` give one
+    value per parameter set and ``(n_regions, 1)`` or ``(n_regions, n_batch)``
+    arrays vary across regions. ``global_coupling`` scales the coupling the
+    same way and ``noise`` is the standard deviation of additive noise per
+    sqrt(ms) for every state variable (scalar or one value per variable).
+
+    Args:
+        model (NeuralMassModel): Local dynamics of each region.
+        connectivity (ConnectivityMatrix): Region-to-region weights and delays.
+        n_batch (int): Number of parameter sets simulated side by side.
+        parameters (dict): ``time_step`` (ms), ``seed``, ``global_coupling``,
+            ``noise`` and overrides of model parameters.
+    """
+    def __init__(self, model, connectivity, n_batch=1, parameters=None):
+        super().__init__(dict(parameters or {}))
+        if connectivity.n_pre != connectivity.n_post:
+            raise DataValidationError("Region connectivity must be square")
+        self.model = model
+        self.n_regions = connectivity.n_pre
+        self.n_batch = int(n_batch)
+        self.time_step = self.parameters.get('time_step', SIMULATION_TIME_STEP)
+        self.rng = np.random.default_rng(self.parameters.get('seed'))
+        self.model_parameters = {name: self._batched(name, self.parameters.get(name, default))
+                                 for name, default in model.defaults.items()}
+        self.global_coupling = self._batched('global_coupling', self.parameters.get('global_coupling', 1.0))
+        noise = np.asarray(self.parameters.get('noise', 0.0), dtype=np.float64)
+        self.noise = None if not np.any(noise) else \
+            np.broadcast_to(noise.reshape(-1, 1, 1) if noise.ndim else noise,
+                            (len(model.state_variables), 1, 1)) * np.sqrt(self.time_step)
+
+        from scipy import sparse
+        column_indptr, order = connectivity.column_index()
+        delays = np.rint(connectivity.delays[order] * (connectivity.time_step / self.time_step))
+        self._delays = np.maximum(delays, 1).astype(np.intp)
+        self._sources = connectivity.presynaptic_indices()[order].astype(np.intp)
+        targets = np.repeat(np.arange(self.n_regions), np.diff(column_indptr))
+        # Weighted sum over connections per target region as one sparse product.
+        self._summation = sparse.csr_matrix(
+            (connectivity.weights[order].astype(np.float64), (targets, np.arange(len(targets)))),
+            shape=(self.n_regions, len(targets)))
+        self.history = np.zeros((int(self._delays.max(initial=0)) + 1, self.n_regions, self.n_batch))
+        self.initialize()
+
+    def _batched(self, name, value):
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 1:
+            if len(value) != self.n_batch:
+                raise ParameterValueError(name, "1-D parameters need one value per parameter set")
+            return value[None, :]
+        if value.ndim == 2 and value.shape[0] != self.n_regions:
+            raise ParameterValueError(name, "2-D parameters need one row per region")
+        return value
+
+    def initialize(self, state=None):
+        """Start from ``state`` (or the model's initial state) with a constant past."""
+        shape = (self.n_regions, self.n_batch)
+        self.state = self.model.initial_state(shape, self.model_parameters, self.rng) if state is None \
+            else np.array(np.broadcast_to(state, (len(self.model.state_variables),) + shape))
+        self.history[:] = self.model.coupling_output(self.state, self.model_parameters)
+        self.head = 0
+        self.current_time = 0
+
+    @property
+    def time(self):
+        return self.current_time * self.time_step
+
+    def coupling(self):
+        """Delayed, weighted input of every region, shape ``(n_regions, n_batch)``."""
+        slots = (self.head - self._delays) % len(self.history)
+        flat_history = self.history.reshape(-1, self.n_batch)
+        delayed = np.take(flat_history, slots * self.n_regions + self._sources, axis=0)
+        return (self._summation @ delayed) * self.global_coupling
+
+    def step(self):
+        """Advance all regions and parameter sets by one stochastic Heun step."""
+        dt = self.time_step
+        parameters = self.model_parameters
+        coupling = self.coupling()
+        slope = self.model.derivatives(self.state, coupling, parameters)
+        kick = 0.0 if self.noise is None else self.noise * self.rng.standard_normal(self.state.shape)
+        predicted = self.state + dt * slope + kick
+        self.state = self.state + 0.5 * dt * (slope + self.model.derivatives(predicted, coupling, parameters)) + kick
+        self.head = (self.head + 1) % len(self.history)
+        self.history[self.head] = self.model.coupling_output(self.state, parameters)
+
+    def record(self, duration, interval=1.0):
+        """Run for ``duration`` ms and sample the model observable every ``interval`` ms.
+
+        Returns:
+            tuple: Sample times (ms) and observables of shape ``(n_samples, n_regions, n_batch)``.
+        """
+        n_steps = int(round(duration / self.time_step))
+        every = max(int(round(interval / self.time_step)), 1)
+        samples = np.empty((n_steps // every, self.n_regions, self.n_batch))
+        times = np.empty(len(samples))
+        for step in range(1, n_steps + 1):
+            self.step()
+            self.current_time += 1
+            if step % every == 0:
+                samples[step // every - 1] = self.model.observable(self.state, self.model_parameters)
+                times[step // every - 1] = self.time
+        return times, samples
+
+def random_region_connectivity(n_regions, density=0.3, max_delay=20.0, time_step=SIMULATION_TIME_STEP,
+                               rng=None):
+    """Random region-to-region weights in [0, 1) with row sums of one and delays up to ``max_delay`` ms."""
+    rng = np.random.default_rng(rng)
+    weights = rng.random((n_regions, n_regions)) * (rng.random((n_regions, n_regions)) < density)
+    np.fill_diagonal(weights, 0.0)
+    weights /= np.maximum(weights.sum(axis=0, keepdims=True), 1e-12)
+    delays = rng.uniform(time_step, max_delay, (n_regions, n_regions))
+    return ConnectivityMatrix.from_dense(weights, delays, time_step)
+
+def benchmark_parameter_scan(model=None, n_regions=68, n_batch=1000, duration=100.0, n_sequential=5,
+                             time_step=SIMULATION_TIME_STEP, rng=None):
+    """Compare one batched scan over ``n_batch`` coupling strengths with separate simulations.
+
+    The sequential cost is extrapolated from ``n_sequential`` single-set
+    runs.
+
+    Returns:
+        dict: Seconds for the batched scan, estimated seconds for running
+        the sets one by one, and region updates per second of the batch.
+    """
+    model = model or JansenRit()
+    connectivity = random_region_connectivity(n_regions, time_step=time_step, rng=rng)
+    couplings = np.linspace(0.0, 0.1, n_batch)
+    n_steps = int(round(duration / time_step))
+
+    simulation = NeuralMassSimulation(model, connectivity, n_batch,
+                                      {'time_step': time_step, 'global_coupling': couplings, 'seed': rng})
+    start = time.perf_counter()
+    simulation.record(duration, duration)
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for coupling in couplings[:n_sequential]:
+        single = NeuralMassSimulation(model, connectivity, 1,
+                                      {'time_step': time_step, 'global_coupling': coupling, 'seed': rng})
+        single.record(duration, duration)
+    sequential = (time.perf_counter() - start) * n_batch / n_sequential
+    return {'batched_seconds': batched, 'sequential_seconds': sequential,
+            'region_updates_per_second': n_regions * n_batch * n_steps / batched}
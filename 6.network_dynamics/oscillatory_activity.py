@@ -1 +1,301 @@
-# Simulation of rhythmic patterns in neural networks
\ No newline at end of file
+# Simulation of rhythmic patterns in neural networks
+
+from functools import lru_cache
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+
+FREQUENCY_BANDS = {'delta': (1.0, 4.0), 'theta': (4.0, 8.0), 'alpha': (8.0, 13.0),
+                   'beta': (13.0, 30.0), 'gamma': (30.0, 80.0)}
+
+@lru_cache(maxsize=32)
+def spectral_tapers(n_samples, time_half_bandwidth=None):
+    """Unit-energy tapers of ``n_samples`` samples, shape ``(n_tapers, n_samples)``.
+
+    A periodic Hann window if ``time_half_bandwidth`` is None, otherwise the
+    ``2 NW - 1`` discrete prolate spheroidal (Slepian) sequences of that
+    time-half-bandwidth product ``NW``. Results are cached and read-only,
+    so repeated spectra of equal length reuse the same tapers.
+    """
+    if time_half_bandwidth is None:
+        tapers = 0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n_samples) / n_samples)[None, :]
+    else:
+        from scipy.signal import windows
+        n_tapers = max(int(2 * time_half_bandwidth) - 1, 1)
+        tapers = np.atleast_2d(windows.dpss(n_samples, time_half_bandwidth, n_tapers))
+    tapers = tapers / np.sqrt((tapers ** 2).sum(axis=1, keepdims=True))
+    tapers.setflags(write=False)
+    return tapers
+
+def _tapers(method, bandwidth, n_samples, time_step):
+    if method == 'welch':
+        return spectral_tapers(n_samples)
+    if method == 'multitaper':
+        # Rounded so that equal segment lengths hit the cache despite float noise.
+        return spectral_tapers(n_samples, round(bandwidth * n_samples * time_step * 1e-3, 6))
+    raise ParameterValueError('method', f"Unknown spectral method: {method}")
+
+def _segment_samples(segment_length, n_samples, time_step):
+    length = n_samples if segment_length is None else int(round(segment_length / time_step))
+    if not 1 < length <= n_samples:
+        raise ParameterValueError('segment_length', "Segments need at least two samples and must fit the signal")
+    return length
+
+def _hop(length, overlap):
+    if not 0.0 <= overlap < 1.0:
+        raise ParameterValueError('overlap', "Overlap must lie in [0, 1)")
+    return max(int(round(length * (1.0 - overlap))), 1)
+
+def _transform(segments, tapers, time_step):
+    """Scaled spectra of every taper of every (demeaned) segment, shape ``(..., n_tapers, n_frequencies)``."""
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    coefficients = np.fft.rfft(segments[..., None, :] * tapers, axis=-1)
+    # One-sided density: double every frequency that has a negative twin.
+    scale = np.full(coefficients.shape[-1], 2.0 * time_step * 1e-3)
+    scale[0] /= 2.0
+    if tapers.shape[-1] % 2 == 0:
+        scale[-1] /= 2.0
+    coefficients *= np.sqrt(scale)
+    return coefficients
+
+def tapered_fourier(signals, time_step=SIMULATION_TIME_STEP, segment_length=None, overlap=0.5,
+                    method='welch', bandwidth=2.0):
+    """Fourier coefficients of all tapered segments of all channels in one real FFT.
+
+    Each channel is cut into segments of ``segment_length`` ms (the whole
+    signal if None) overlapping by the fraction ``overlap``; every segment
+    is demeaned and multiplied by the cached tapers, Hann for 'welch' or
+    the Slepian sequences of half-bandwidth ``bandwidth`` Hz for
+    'multitaper', and the whole ``(channels, segments, tapers, samples)``
+    block goes through a single ``rfft``.
+
+    Args:
+        signals (np.ndarray): Signals of shape ``(n_channels, n_samples)``.
+        time_step (float): Sampling interval (ms).
+
+    Returns:
+        tuple: Frequencies (Hz) and coefficients of shape
+            ``(n_channels, n_estimates, n_frequencies)`` whose mean squared
+            magnitude over estimates is the one-sided spectral density
+            (signal units squared per Hz).
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+    if signals.ndim != 2:
+        raise DataValidationError("Signals must have shape (n_channels, n_samples)")
+    length = _segment_samples(segment_length, signals.shape[1], time_step)
+    segments = np.lib.stride_tricks.sliding_window_view(signals, length, axis=1)[:, ::_hop(length, overlap)]
+    coefficients = _transform(segments, _tapers(method, bandwidth, length, time_step), time_step)
+    frequencies = np.fft.rfftfreq(length, time_step * 1e-3)
+    return frequencies, coefficients.reshape(len(signals), -1, len(frequencies))
+
+def power_spectra(signals, time_step=SIMULATION_TIME_STEP, segment_length=None, overlap=0.5,
+                  method='welch', bandwidth=2.0):
+    """Welch or multitaper spectral density of every channel (see ``tapered_fourier``).
+
+    Returns:
+        tuple: Frequencies (Hz) and densities of shape ``(n_channels, n_frequencies)``.
+    """
+    frequencies, coefficients = tapered_fourier(signals, time_step, segment_length, overlap, method, bandwidth)
+    return frequencies, (coefficients.real ** 2 + coefficients.imag ** 2).mean(axis=1)
+
+def _band_mask(frequencies, band):
+    mask = (frequencies >= band[0]) & (frequencies < band[1])
+    if not mask.any():
+        raise ParameterValueError('band', f"No frequency resolved in the band {band} Hz")
+    return mask
+
+def cross_spectra(signals, time_step=SIMULATION_TIME_STEP, segment_length=None, overlap=0.5,
+                  method='welch', bandwidth=2.0, band=None):
+    """Cross-spectral densities of all channel pairs from one batched matrix product.
+
+    With the coefficients arranged as ``(n_frequencies, n_channels, n_estimates)``
+    the cross spectra of all pairs at all frequencies are ``C @ C^H``.
+    If ``band`` (Hz) is given the frequencies in it are stacked onto the
+    estimate axis instead, which yields the band-averaged matrix from a
+    single ``(n_channels, n_estimates * n_band)`` product.
+
+    Returns:
+        tuple: Frequencies (Hz) and complex densities of shape
+            ``(n_frequencies, n_channels, n_channels)``, or the frequencies in
+            the band and one ``(n_channels, n_channels)`` matrix.
+    """
+    frequencies, coefficients = tapered_fourier(signals, time_step, segment_length, overlap, method, bandwidth)
+    if band is not None:
+        mask = _band_mask(frequencies, band)
+        stacked = coefficients[:, :, mask].reshape(len(coefficients), -1)
+        return frequencies[mask], (stacked @ stacked.conj().T) / stacked.shape[1]
+    arranged = coefficients.transpose(2, 0, 1)
+    return frequencies, (arranged @ arranged.conj().transpose(0, 2, 1)) / coefficients.shape[1]
+
+def band_power(frequencies, spectra, band):
+    """Power in ``band`` (Hz): the density integrated over the band, along the last axis."""
+    mask = _band_mask(frequencies, band)
+    return spectra[..., mask].sum(axis=-1) * (frequencies[1] - frequencies[0])
+
+def band_powers(frequencies, spectra, bands=None):
+    """Power in every band of ``bands`` (default ``FREQUENCY_BANDS``), stacked on a new last axis."""
+    bands = FREQUENCY_BANDS if bands is None else bands
+    return np.stack([band_power(frequencies, spectra, band) for band in bands.values()], axis=-1)
+
+def spectrogram(signals, time_step=SIMULATION_TIME_STEP, segment_length=1000.0, overlap=0.5,
+                method='welch', bandwidth=2.0):
+    """Spectral density of every segment of every channel (see ``tapered_fourier``).
+
+    Returns:
+        tuple: Segment centre times (ms), frequencies (Hz) and densities of
+            shape ``(n_channels, n_segments, n_frequencies)``.
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+    frequencies, coefficients = tapered_fourier(signals, time_step, segment_length, overlap, method, bandwidth)
+    length = _segment_samples(segment_length, signals.shape[1], time_step)
+    hop = _hop(length, overlap)
+    n_segments = (signals.shape[1] - length) // hop + 1
+    power = (coefficients.real ** 2 + coefficients.imag ** 2).reshape(len(signals), n_segments, -1,
+                                                                     len(frequencies)).mean(axis=2)
+    times = (np.arange(n_segments) * hop + length / 2.0) * time_step
+    return times, frequencies, power
+
+class SlidingSpectrum:
+    """Streaming spectral density over the last ``window`` ms of a multichannel signal.
+
+    Samples go into a ring buffer holding one segment. Every
+    ``segment_length * (1 - overlap)`` ms the latest segment is tapered and
+    transformed with one real FFT for all channels and tapers; its power
+    (and its cross spectra if ``cross``) is added to running sums while
+    that of the segment leaving the window is subtracted. The estimate is
+    thus always the Welch (or multitaper) average over the window, at the
+    cost of one segment transform per hop. The sums are rebuilt from the
+    stored segments once per window so rounding errors do not accumulate.
+
+    Register it with ``simulation.add_monitor(spectrum)``: ``signal(simulation)``
+    is summed over every simulation step and each sum over ``time_step`` ms
+    (a multiple of the simulation step) becomes one sample, so spike counts
+    are binned rather than decimated. Or feed it with ``update``.
+
+    Args:
+        n_channels (int): Number of signals.
+        window (float): Span (ms) the spectrum is averaged over.
+        segment_length (float): Length (ms) of each transformed segment.
+        overlap (float): Fraction by which consecutive segments overlap.
+        time_step (float): Sampling interval of the signals (ms).
+        method, bandwidth: As for ``tapered_fourier``.
+        cross (bool): Also track cross spectra of all channel pairs (for coherence).
+        signal (function): ``signal(simulation)`` giving one value per
+            channel for the last step; by default the spike count of every population.
+    """
+    def __init__(self, n_channels, window=4000.0, segment_length=1000.0, overlap=0.5, time_step=1.0,
+                 method='welch', bandwidth=2.0, cross=False, signal=None):
+        length = int(round(segment_length / time_step))
+        if length < 2 or window < segment_length:
+            raise ParameterValueError('segment_length', "Segments need two samples and must fit the window")
+        self.time_step = time_step
+        self.hop = _hop(length, overlap)
+        self.tapers = _tapers(method, bandwidth, length, time_step)
+        self.frequencies = np.fft.rfftfreq(length, time_step * 1e-3)
+        self.signal = signal or (lambda simulation: [len(spikes) for spikes in simulation.spikes])
+        n_segments = (int(round(window / time_step)) - length) // self.hop + 1
+        n_frequencies = len(self.frequencies)
+        self.buffer = np.zeros((n_channels, length))
+        self.pending = np.zeros(n_channels)
+        self.power = np.zeros((n_segments, n_channels, n_frequencies))
+        self.total_power = np.zeros((n_channels, n_frequencies))
+        self.cross = np.zeros((n_segments, n_frequencies, n_channels, n_channels), dtype=np.complex128) \
+            if cross else None
+        self.total_cross = np.zeros(self.cross.shape[1:], dtype=np.complex128) if cross else None
+        self.reset()
+
+    def __call__(self, simulation):
+        sample = self.accumulate(simulation)
+        if sample is not None:
+            self.update(sample)
+
+    def accumulate(self, simulation):
+        """Add ``signal(simulation)`` for the step just taken to the current interval.
+
+        Returns:
+            numpy.ndarray: The sum over the interval once ``time_step`` ms are covered, else None.
+        """
+        if simulation.time_step > self.time_step * (1.0 + 1e-9):
+            raise ParameterValueError('time_step', "The sampling interval is shorter than the simulation step")
+        self.pending += np.asarray(self.signal(simulation), dtype=np.float64)
+        self.pending_time += simulation.time_step
+        if self.pending_time < self.time_step * (1.0 - 1e-9):
+            return None
+        sample = self.pending.copy()
+        self.pending[:] = 0.0
+        self.pending_time -= self.time_step
+        return sample
+
+    def reset(self):
+        self.buffer[:] = 0.0
+        self.pending[:] = 0.0
+        self.pending_time = 0.0
+        self.power[:] = 0.0
+        self.total_power[:] = 0.0
+        if self.cross is not None:
+            self.cross[:] = 0.0
+            self.total_cross[:] = 0.0
+        self.position = 0
+        self.n_samples = 0
+        self.n_segments = 0
+
+    def update(self, samples):
+        """Append samples of shape ``(n_channels,)`` or ``(n_channels, n)``.
+
+        Returns:
+            bool: Whether at least one new segment entered the estimate.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        samples = samples[:, None] if samples.ndim == 1 else samples
+        length = self.buffer.shape[1]
+        updated = False
+        start = 0
+        while start < samples.shape[1]:
+            # Copy up to the next segment boundary (or the end of the ring).
+            until_hop = self.hop - (self.n_samples - length) % self.hop if self.n_samples >= length \
+                else length - self.n_samples
+            count = min(samples.shape[1] - start, until_hop, length - self.position)
+            self.buffer[:, self.position:self.position + count] = samples[:, start:start + count]
+            self.position = (self.position + count) % length
+            self.n_samples += count
+            start += count
+            if self.n_samples >= length and (self.n_samples - length) % self.hop == 0:
+                self._add_segment()
+                updated = True
+        return updated
+
+    def _add_segment(self):
+        segment = np.concatenate((self.buffer[:, self.position:], self.buffer[:, :self.position]), axis=1)
+        coefficients = _transform(segment, self.tapers, self.time_step)
+        slot = self.n_segments % len(self.power)
+        power = (coefficients.real ** 2 + coefficients.imag ** 2).mean(axis=1)
+        self.total_power += power - self.power[slot]
+        self.power[slot] = power
+        if self.cross is not None:
+            arranged = coefficients.transpose(2, 0, 1)
+            cross = (arranged @ arranged.conj().transpose(0, 2, 1)) / coefficients.shape[1]
+            self.total_cross += cross - self.cross[slot]
+            self.cross[slot] = cross
+        self.n_segments += 1
+        if slot == len(self.power) - 1:
+            self.total_power[:] = self.power.sum(axis=0)
+            if self.cross is not None:
+                self.total_cross[:] = self.cross.sum(axis=0)
+
+    @property
+    def n_averaged(self):
+        return min(self.n_segments, len(self.power))
+
+    def spectrum(self):
+        """Frequencies (Hz) and the density of every channel averaged over the window."""
+        return self.frequencies, self.total_power / max(self.n_averaged, 1)
+
+    def cross_spectrum(self):
+        """Frequencies (Hz) and the window-averaged cross spectra, ``(n_frequencies, n_channels, n_channels)``."""
+        if self.cross is None:
+            raise ParameterValueError('cross', "Cross spectra are only tracked with cross=True")
+        return self.frequencies, self.total_cross / max(self.n_averaged, 1)
+
+    def band_powers(self, bands=None):
+        """Power of every channel in every band (default ``FREQUENCY_BANDS``), ``(n_channels, n_bands)``."""
+        return band_powers(*self.spectrum(), bands)
@@ -1 +1,131 @@
-# Modeling and analysis of scale-free properties of brain networks
\ No newline at end of file
+# Modeling and analysis of scale-free properties of brain networks
+
+import time
+import numpy as np
+from ..common.constants import SCALE_FREE_NETWORK_EXPONENT, SIMULATION_TIME_STEP, SYNAPTIC_WEIGHT_RANGE
+from ..common.error_handling import ParameterValueError
+from ..circuits.connectivity_matrix import cached_connectivity
+from .small_world_networks import undirected_network
+
+def barabasi_albert_edges(n_nodes, n_links, rng=None):
+    """Edges of a preferential-attachment graph (Batagelj-Brandes linearized chord diagram).
+
+    Conceptually node ``v`` appends ``n_links`` edges to a list in which
+    every node appears once per edge end, each new far end copying a
+    uniformly chosen earlier entry, which is degree-proportional sampling.
+    All choices are drawn in one batch; an entry that copies another far
+    end is resolved by following the copy pointers, all unresolved entries
+    advancing together, which takes a few rounds because every pointer
+    moves strictly backwards. Like the original algorithm this draws a few
+    self-loops and repeated edges, which ``undirected_network`` drops. The
+    degree distribution follows a power law with exponent 3.
+
+    Returns:
+        tuple: Endpoint arrays, one entry per drawn edge.
+    """
+    if n_links < 1:
+        raise ParameterValueError('n_links', "Every node must add at least one edge")
+    rng = np.random.default_rng(rng)
+    n_edges = n_nodes * n_links
+    edge = np.arange(n_edges, dtype=np.int64)
+    # Entry 2 j is the new node of edge j, entry 2 j + 1 copies entry choice[j] <= 2 j.
+    choice = (rng.random(n_edges) * (2 * edge + 1)).astype(np.int64)
+    target = choice.copy()
+    unresolved = np.flatnonzero(target % 2)
+    while len(unresolved):
+        target[unresolved] = choice[target[unresolved] // 2]
+        unresolved = unresolved[target[unresolved] % 2 == 1]
+    return edge // n_links, target // 2 // n_links
+
+def barabasi_albert_network(n_nodes, n_links=5, weight_range=SYNAPTIC_WEIGHT_RANGE, delay=None,
+                            time_step=SIMULATION_TIME_STEP, rng=None, cache_directory=None):
+    """Barabasi-Albert scale-free network as a recurrent ``ConnectivityMatrix`` (see ``cached_connectivity``)."""
+    parameters = {'generator': 'barabasi_albert', 'n_nodes': n_nodes, 'n_links': n_links,
+                  'weight_range': list(weight_range), 'delay': delay, 'time_step': time_step, 'seed': rng}
+
+    def build():
+        generator = np.random.default_rng(rng)
+        first, second = barabasi_albert_edges(n_nodes, n_links, generator)
+        return undirected_network(first, second, n_nodes, weight_range, delay, time_step, generator)
+
+    return cached_connectivity(cache_directory, parameters, build)
+
+def power_law_degrees(n_nodes, exponent=SCALE_FREE_NETWORK_EXPONENT, min_degree=2, max_degree=None, rng=None):
+    """Degrees drawn from ``P(k) ~ k^-exponent`` on ``[min_degree, max_degree]``, with an even sum.
+
+    ``max_degree`` defaults to the natural cutoff ``min_degree * n^(1 / (exponent - 1))``
+    (at most ``n - 1``).
+    """
+    if exponent <= 1:
+        raise ParameterValueError('exponent', "Power-law exponent must exceed 1")
+    rng = np.random.default_rng(rng)
+    if max_degree is None:
+        max_degree = min(int(min_degree * n_nodes ** (1.0 / (exponent - 1.0))), n_nodes - 1)
+    support = np.arange(min_degree, max_degree + 1)
+    probabilities = support ** -float(exponent)
+    cumulative = np.cumsum(probabilities / probabilities.sum())
+    degrees = support[np.minimum(np.searchsorted(cumulative, rng.random(n_nodes)), len(support) - 1)]
+    if degrees.sum() % 2:
+        degrees[rng.integers(n_nodes)] += 1
+    return degrees
+
+def configuration_model_edges(degrees, rng=None):
+    """Random pairing of edge stubs for a given degree sequence (even total).
+
+    Every node contributes one stub per unit of degree; one permutation
+    pairs all stubs at once. Self-loops and repeated edges are dropped
+    later (the erased configuration model), which slightly lowers the
+    degrees of the largest hubs.
+    """
+    degrees = np.asarray(degrees, dtype=np.int64)
+    if degrees.sum() % 2:
+        raise ParameterValueError('degrees', "Degree sum must be even")
+    rng = np.random.default_rng(rng)
+    stubs = rng.permutation(np.repeat(np.arange(len(degrees), dtype=np.int64), degrees))
+    return stubs[0::2], stubs[1::2]
+
+def configuration_model_network(n_nodes, exponent=SCALE_FREE_NETWORK_EXPONENT, min_degree=2, max_degree=None,
+                                weight_range=SYNAPTIC_WEIGHT_RANGE, delay=None, time_step=SIMULATION_TIME_STEP,
+                                rng=None, cache_directory=None):
+    """Scale-free network with power-law degrees as a recurrent ``ConnectivityMatrix``.
+
+    Degrees come from ``power_law_degrees`` and are wired with
+    ``configuration_model_edges``; see ``cached_connectivity`` for caching.
+    """
+    parameters = {'generator': 'configuration_model', 'n_nodes': n_nodes, 'exponent': exponent,
+                  'min_degree': min_degree, 'max_degree': max_degree, 'weight_range': list(weight_range),
+                  'delay': delay, 'time_step': time_step, 'seed': rng}
+
+    def build():
+        generator = np.random.default_rng(rng)
+        degrees = power_law_degrees(n_nodes, exponent, min_degree, max_degree, generator)
+        first, second = configuration_model_edges(degrees, generator)
+        return undirected_network(first, second, n_nodes, weight_range, delay, time_step, generator)
+
+    return cached_connectivity(cache_directory, parameters, build)
+
+def degree_exponent(degrees, min_degree=None):
+    """Maximum-likelihood power-law exponent of a degree sequence (discrete approximation).
+
+    Uses ``1 + n / sum(log(k / (k_min - 1/2)))`` over degrees of at least ``min_degree``.
+    """
+    degrees = np.asarray(degrees, dtype=np.float64)
+    min_degree = degrees[degrees > 0].min() if min_degree is None else min_degree
+    tail = degrees[degrees >= min_degree]
+    return 1.0 + len(tail) / np.log(tail / (min_degree - 0.5)).sum()
+
+def benchmark_scale_free_generation(n_nodes=1_000_000, n_links=5, cache_directory=None, rng=0):
+    """Seconds to generate Barabasi-Albert and configuration-model networks, and to reload them cached."""
+    results = {}
+    for name, build in (('barabasi_albert', lambda: barabasi_albert_network(
+                             n_nodes, n_links, rng=rng, cache_directory=cache_directory)),
+                        ('configuration_model', lambda: configuration_model_network(
+                             n_nodes, rng=rng, cache_directory=cache_directory))):
+        start = time.perf_counter()
+        connectivity = build()
+        results[name] = {'seconds': time.perf_counter() - start, 'synapses': connectivity.n_synapses}
+        if cache_directory is not None:
+            start = time.perf_counter()
+            build()
+            results[name]['cached_seconds'] = time.perf_counter() - start
+    return results
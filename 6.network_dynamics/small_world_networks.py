@@ -1 +1,210 @@
-# Simulation of small-world properties in neural networks
\ No newline at end of file
+# Simulation of small-world properties in neural networks
+
+import time
+import hashlib
+import numpy as np
+from ..common.constants import (AXONAL_CONDUCTION_VELOCITY, SIMULATION_TIME_STEP,
+                                SMALL_WORLD_REWIRING_PROBABILITY, SYNAPTIC_WEIGHT_RANGE)
+from ..common.error_handling import ParameterValueError
+from ..circuits.connectivity_matrix import ConnectivityMatrix, cached_connectivity
+
+def undirected_network(first, second, n_nodes, weight_range=SYNAPTIC_WEIGHT_RANGE, delays=None,
+                       time_step=SIMULATION_TIME_STEP, rng=None):
+    """Recurrent ``ConnectivityMatrix`` holding every undirected edge as two synapses.
+
+    Self-loops and repeated edges are dropped. The edge keys are sorted
+    once and become the CSR arrays directly; weights are drawn per synapse
+    afterwards, so nothing is permuted.
+
+    Args:
+        first, second (np.ndarray): Endpoints of the edges.
+        delays (float): Delay of every synapse (ms); one time step if None.
+    """
+    rng = np.random.default_rng(rng)
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    keep = first != second
+    first, second = first[keep], second[keep]
+    keys = np.unique(np.concatenate((first * n_nodes + second, second * n_nodes + first)))
+    weights = rng.uniform(weight_range[0], weight_range[1], len(keys))
+    return ConnectivityMatrix.from_sorted_keys(keys, n_nodes, n_nodes, weights, delays, time_step)
+
+def watts_strogatz_edges(n_nodes, n_neighbours, rewiring_probability=SMALL_WORLD_REWIRING_PROBABILITY,
+                         rng=None, max_rounds=100):
+    """Edges of a Watts-Strogatz graph: a ring lattice with randomly rewired far ends.
+
+    Every node is joined to its ``n_neighbours / 2`` successors on the ring
+    and each of those edges gets a uniformly random new far end with
+    ``rewiring_probability``. Rewired edges that would form a self-loop or
+    repeat an existing edge are redrawn together in the next round.
+
+    Returns:
+        tuple: Endpoint arrays, one entry per undirected edge.
+    """
+    if n_neighbours % 2 or not 0 < n_neighbours < n_nodes:
+        raise ParameterValueError('n_neighbours', "Neighbour count must be even and below the node count")
+    if not 0.0 <= rewiring_probability <= 1.0:
+        raise ParameterValueError('rewiring_probability', "Rewiring probability must lie in [0, 1]")
+    rng = np.random.default_rng(rng)
+    half = n_neighbours // 2
+    first = np.repeat(np.arange(n_nodes, dtype=np.int64), half)
+    second = (first + np.tile(np.arange(1, half + 1), n_nodes)) % n_nodes
+    rewired = rng.random(len(first)) < rewiring_probability
+    redraw = np.flatnonzero(rewired)
+    for _ in range(max_rounds):
+        if len(redraw) == 0:
+            break
+        second[redraw] = rng.integers(0, n_nodes, len(redraw))
+        keys = np.minimum(first, second) * n_nodes + np.maximum(first, second)
+        # Within a group of equal keys the lattice edge (if any) sorts first and is kept.
+        order = np.lexsort((rewired, keys))
+        repeated = np.zeros(len(keys), dtype=bool)
+        repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+        redraw = np.flatnonzero((first == second) | repeated)
+    return first, second
+
+def watts_strogatz_network(n_nodes, n_neighbours=10, rewiring_probability=SMALL_WORLD_REWIRING_PROBABILITY,
+                           weight_range=SYNAPTIC_WEIGHT_RANGE, delay=None, time_step=SIMULATION_TIME_STEP,
+                           rng=None, cache_directory=None):
+    """Watts-Strogatz small-world network as a recurrent ``ConnectivityMatrix``.
+
+    With ``cache_directory`` and an integer ``rng`` seed the matrix is
+    stored on disk and later calls with the same arguments memory-map it
+    instead of generating it again (see ``cached_connectivity``).
+    """
+    parameters = {'generator': 'watts_strogatz', 'n_nodes': n_nodes, 'n_neighbours': n_neighbours,
+                  'rewiring_probability': rewiring_probability, 'weight_range': list(weight_range),
+                  'delay': delay, 'time_step': time_step, 'seed': rng}
+
+    def build():
+        generator = np.random.default_rng(rng)
+        first, second = watts_strogatz_edges(n_nodes, n_neighbours, rewiring_probability, generator)
+        return undirected_network(first, second, n_nodes, weight_range, delay, time_step, generator)
+
+    return cached_connectivity(cache_directory, parameters, build)
+
+def random_positions(n_nodes, extent=(1000.0, 1000.0, 1000.0), rng=None):
+    """Positions (um) drawn uniformly in a box of the given extent."""
+    rng = np.random.default_rng(rng)
+    return rng.random((n_nodes, len(extent))) * np.asarray(extent, dtype=np.float64)
+
+_CUTOFF_PROBABILITY = 1e-3
+
+def connection_profile(distances, connection_probability, length_constant, profile='exponential'):
+    """Connection probability as a function of distance (um)."""
+    scaled = np.asarray(distances, dtype=np.float64) / length_constant
+    if profile == 'exponential':
+        return connection_probability * np.exp(-scaled)
+    if profile == 'gaussian':
+        return connection_probability * np.exp(-0.5 * scaled ** 2)
+    raise ParameterValueError('profile', f"Unknown connection profile: {profile}")
+
+def bernoulli_positions(n_trials, probability, rng):
+    """Indices of successes among ``n_trials`` Bernoulli trials, drawn by geometric skipping."""
+    if n_trials == 0 or probability <= 0:
+        return np.empty(0, dtype=np.int64)
+    if probability >= 1:
+        return np.arange(n_trials, dtype=np.int64)
+    expected = n_trials * probability
+    positions = np.cumsum(rng.geometric(probability, int(expected + 6 * np.sqrt(expected) + 16))) - 1
+    while positions[-1] < n_trials:
+        more = np.cumsum(rng.geometric(probability, int(expected / 4 + 16))) + positions[-1]
+        positions = np.concatenate((positions, more))
+    return positions[positions < n_trials]
+
+def distance_dependent_network(positions, connection_probability=0.5, length_constant=100.0,
+                               profile='exponential', cutoff=None, cell_size=None,
+                               weight_range=SYNAPTIC_WEIGHT_RANGE, velocity=AXONAL_CONDUCTION_VELOCITY,
+                               time_step=SIMULATION_TIME_STEP, rng=None, cache_directory=None):
+    """Directed network whose connection probability falls off with distance.
+
+    Every ordered pair of neurons closer than ``cutoff`` is connected
+    independently with ``connection_profile`` probability (1e-3 of the
+    peak at the default cutoff). Neurons are binned into cubic cells of
+    ``cell_size`` (default ``length_constant``). For each cell offset the
+    smallest possible distance bounds the probability of all pairs between
+    a cell and its offset neighbour, so candidates are drawn from all those
+    pairs at once by geometric skipping with the bound and then thinned
+    with the exact probability. The cost thus grows with the number of
+    connections, not with the number of nearby pairs. Delays are distance
+    over conduction ``velocity`` (m/s, i.e. um per us).
+
+    Args:
+        positions (np.ndarray): Neuron positions (um), shape ``(n, dimensions)``.
+        connection_probability (float): Probability at zero distance.
+        length_constant (float): Space constant of the profile (um).
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if cutoff is None:
+        cutoff = length_constant * (np.log(1.0 / _CUTOFF_PROBABILITY) if profile == 'exponential' else
+                                    np.sqrt(2.0 * np.log(1.0 / _CUTOFF_PROBABILITY)))
+    cell_size = length_constant if cell_size is None else cell_size
+    n, dimensions = positions.shape
+    parameters = {'generator': 'distance_dependent',
+                  'positions': hashlib.sha256(np.ascontiguousarray(positions).tobytes()).hexdigest(),
+                  'shape': [n, dimensions], 'connection_probability': connection_probability,
+                  'length_constant': length_constant, 'profile': profile, 'cutoff': cutoff,
+                  'cell_size': cell_size, 'weight_range': list(weight_range), 'velocity': velocity,
+                  'time_step': time_step, 'seed': rng}
+
+    def build():
+        generator = np.random.default_rng(rng)
+        cells = np.floor((positions - positions.min(axis=0)) / cell_size).astype(np.int64)
+        shape = cells.max(axis=0) + 1
+        strides = np.concatenate((np.cumprod(shape[::-1])[::-1][1:], [1]))
+        cell_ids = cells @ strides
+        order = np.argsort(cell_ids, kind='stable')
+        n_cells = int(np.prod(shape))
+        cell_start = np.searchsorted(cell_ids[order], np.arange(n_cells + 1))
+        occupancy = np.diff(cell_start)
+        occupied = np.flatnonzero(occupancy)
+        occupied_cells = np.stack(np.unravel_index(occupied, shape), axis=1)
+        reach = int(np.ceil(cutoff / cell_size))
+        keys = []
+        for offset in np.stack(np.meshgrid(*[np.arange(-reach, reach + 1)] * dimensions, indexing='ij'),
+                               axis=-1).reshape(-1, dimensions):
+            nearest = cell_size * np.sqrt(np.sum(np.maximum(np.abs(offset) - 1, 0) ** 2))
+            if nearest >= cutoff:
+                continue
+            bound = float(connection_profile(nearest, connection_probability, length_constant, profile))
+            shifted = occupied_cells + offset
+            inside = np.all((shifted >= 0) & (shifted < shape), axis=1)
+            first_cells = occupied[inside]
+            second_cells = shifted[inside] @ strides
+            pairs = occupancy[first_cells] * occupancy[second_cells]
+            ends = np.cumsum(pairs)
+            drawn = bernoulli_positions(int(ends[-1]) if len(ends) else 0, bound, generator)
+            block = np.searchsorted(ends, drawn, side='right')
+            local = drawn - (ends[block] - pairs[block])
+            first_local, second_local = np.divmod(local, occupancy[second_cells[block]])
+            pre = order[cell_start[first_cells[block]] + first_local]
+            post = order[cell_start[second_cells[block]] + second_local]
+            distance = np.sqrt(((positions[pre] - positions[post]) ** 2).sum(axis=1))
+            probability = connection_profile(distance, connection_probability, length_constant, profile)
+            accepted = (generator.random(len(pre)) * bound < probability) & (distance < cutoff) & (pre != post)
+            keys.append(pre[accepted] * n + post[accepted])
+        keys = np.sort(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+        pre, post = np.divmod(keys, n)
+        distances = np.sqrt(((positions[pre] - positions[post]) ** 2).sum(axis=1))
+        weights = generator.uniform(weight_range[0], weight_range[1], len(keys))
+        return ConnectivityMatrix.from_sorted_keys(keys, n, n, weights, distances / (velocity * 1e3), time_step)
+
+    return cached_connectivity(cache_directory, parameters, build)
+
+def benchmark_small_world_generation(n_nodes=1_000_000, n_neighbours=10, n_spatial=100_000,
+                                     cache_directory=None, rng=0):
+    """Seconds to generate a Watts-Strogatz and a distance-dependent network, and to reload them cached."""
+    results = {}
+    positions = random_positions(n_spatial, rng=rng)
+    for name, build in (('watts_strogatz', lambda: watts_strogatz_network(
+                             n_nodes, n_neighbours, rng=rng, cache_directory=cache_directory)),
+                        ('distance_dependent', lambda: distance_dependent_network(
+                             positions, length_constant=50.0, rng=rng, cache_directory=cache_directory))):
+        start = time.perf_counter()
+        connectivity = build()
+        results[name] = {'seconds': time.perf_counter() - start, 'synapses': connectivity.n_synapses}
+        if cache_directory is not None:
+            start = time.perf_counter()
+            build()
+            results[name]['cached_seconds'] = time.perf_counter() - start
+    return results
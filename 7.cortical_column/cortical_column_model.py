@@ -1 +1,297 @@
-# Core model of a cortical column
\ No newline at end of file
+# Core model of a cortical column
+
+import time
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..circuits.connectivity_matrix import ConnectivityMatrix, expand_rows
+from ..neurons.neuron_model import LIFPopulation
+from ..neurons.synapse_model import SynapticPathway
+from .layered_network import potjans_diesmann_layers
+from .microcircuitry import potjans_diesmann_microcircuit
+
+class InstancedConnectivity:
+    """Block-diagonal projection that repeats one template block in every column.
+
+    Presynaptic neuron ``column * n_pre + i`` connects like neuron ``i`` of
+    the template, with postsynaptic indices offset by ``column * n_post``.
+    The template's CSR arrays are shared by all columns, so memory does not
+    grow with the number of columns. ``weights`` is a read-only
+    ``(n_columns, n_synapses)`` view of the template weights until
+    ``writable_weights`` or ``jitter_weights`` first copies it
+    (copy-on-write). Delays stay shared; ``to_connectivity`` expands the
+    projection into an ordinary ``ConnectivityMatrix`` where one is needed.
+    """
+    def __init__(self, template, n_columns):
+        self.template = template
+        self.n_columns = int(n_columns)
+        self.n_pre = template.n_pre * self.n_columns
+        self.n_post = template.n_post * self.n_columns
+        self.time_step = template.time_step
+        self._weights = None
+
+    @property
+    def n_synapses(self):
+        return self.template.n_synapses * self.n_columns
+
+    @property
+    def shared(self):
+        """Whether the weights are still those of the template."""
+        return self._weights is None
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            return np.broadcast_to(self.template.weights, (self.n_columns, self.template.n_synapses))
+        return self._weights
+
+    @property
+    def nbytes(self):
+        """Memory held by this projection beyond the shared template, in bytes."""
+        return 0 if self._weights is None else self._weights.nbytes
+
+    def writable_weights(self):
+        """Weights of every column, ``(n_columns, n_synapses)``, copied from the template on first use."""
+        if self._weights is None:
+            self._weights = np.tile(self.template.weights, (self.n_columns, 1))
+        return self._weights
+
+    def jitter_weights(self, relative_sd, rng=None):
+        """Scale every weight by an independent factor ``1 + relative_sd * N(0, 1)``, clipped at zero."""
+        rng = np.random.default_rng(rng)
+        weights = self.writable_weights()
+        factors = np.maximum(1.0 + relative_sd * rng.standard_normal(weights.shape, dtype=np.float32), 0.0)
+        weights *= factors
+
+    def checkpoint_state(self):
+        """Template weights while shared, otherwise the weights of every column."""
+        return {'weights': self.template.weights if self._weights is None else self._weights}
+
+    def restore_state(self, arrays):
+        weights = arrays['weights']
+        if weights.shape == self.template.weights.shape:
+            # The template is shared with every sheet built from it, so it is never written to.
+            self._weights = None if np.array_equal(weights, self.template.weights) else \
+                np.tile(weights, (self.n_columns, 1))
+        elif weights.shape == (self.n_columns, self.template.n_synapses):
+            self._weights = weights
+        else:
+            raise DataValidationError("Checkpointed weights do not match the connectivity")
+
+    def outgoing(self, pre_indices):
+        """Columns and template positions of all synapses leaving the given neurons."""
+        columns, local = np.divmod(np.asarray(pre_indices, dtype=np.intp), self.template.n_pre)
+        positions = expand_rows(self.template.indptr, local)
+        counts = self.template.indptr[local + 1] - self.template.indptr[local]
+        return np.repeat(columns, counts), positions
+
+    def propagate(self, spike_indices, target):
+        """Add the weights of all synapses of spiking neurons to ``target``."""
+        if len(spike_indices) == 0:
+            return
+        columns, positions = self.outgoing(spike_indices)
+        post = self.template.indices[positions] + columns * self.template.n_post
+        weights = self.template.weights[positions] if self._weights is None else self._weights[columns, positions]
+        np.add.at(target, post, weights)
+
+    def to_connectivity(self):
+        """Expand into a ``ConnectivityMatrix`` of the whole sheet in one vectorized pass."""
+        template = self.template
+        columns = np.arange(self.n_columns, dtype=np.int64)[:, None]
+        indptr = np.append((template.indptr[:-1][None, :] + columns * template.n_synapses).ravel(),
+                           self.n_synapses)
+        indices = (template.indices[None, :] + columns * template.n_post).ravel()
+        delays = np.broadcast_to(template.delays, (self.n_columns, template.n_synapses)).ravel()
+        return ConnectivityMatrix(indptr, indices, self.weights.ravel(), delays, self.n_post, self.time_step,
+                                  check=False)
+
+class ColumnTemplate:
+    """One cortical column compiled into CSR blocks and parameter values, for instancing.
+
+    The synapses of every projection of the ``microcircuit`` are drawn
+    once, and every neuron parameter is resolved to one value per
+    population. ``instantiate`` then repeats the column by offsetting
+    indices instead of drawing and storing every column again.
+
+    Args:
+        populations (LayeredPopulations): Populations of the column.
+        microcircuit (Microcircuit): Connection rules within the column.
+        neuron_parameters (dict): Keyword arguments of the neuron
+            population class; a value is either used for every population
+            or is a dict with one value per population name.
+    """
+    def __init__(self, populations, microcircuit, neuron_parameters=None, time_step=SIMULATION_TIME_STEP,
+                 rng=None):
+        if microcircuit.populations.names != populations.names:
+            raise DataValidationError("Microcircuit and column must have the same populations")
+        self.populations = populations
+        self.time_step = time_step
+        self.blocks = microcircuit.sample_all(time_step, rng)
+        self.parameters = {name: {} for name in populations.names}
+        for parameter, value in (neuron_parameters or {}).items():
+            for name in populations.names:
+                self.parameters[name][parameter] = value[name] if isinstance(value, dict) else value
+
+    @property
+    def n_neurons(self):
+        return self.populations.n_neurons
+
+    @property
+    def n_synapses(self):
+        return sum(block.n_synapses for block in self.blocks.values())
+
+    def instantiate(self, n_columns, positions=None):
+        """A ``CorticalSheet`` of ``n_columns`` copies of this column."""
+        return CorticalSheet(self, n_columns, positions)
+
+class CorticalSheet:
+    """Many instances of a ``ColumnTemplate``, with one population per template population.
+
+    Population ``name`` of the sheet holds that population of every column,
+    neuron ``column * size + i`` being neuron ``i`` of ``column``. Its
+    parameters therefore stay the template's single values, shared by all
+    columns, until ``jitter_parameters`` gives a parameter one value per
+    neuron, and every projection of the template becomes one
+    ``InstancedConnectivity``. Links between columns are added with
+    ``add_projection`` (see ``intercolumnar_interaction``).
+
+    Args:
+        template (ColumnTemplate): The column to repeat.
+        n_columns (int): Number of columns.
+        positions (np.ndarray): Column positions (um), kept for building links.
+    """
+    def __init__(self, template, n_columns, positions=None):
+        if n_columns < 1:
+            raise ParameterValueError('n_columns', "A sheet needs at least one column")
+        self.template = template
+        self.n_columns = int(n_columns)
+        self.positions = positions
+        self.parameters = {name: dict(values) for name, values in template.parameters.items()}
+        self.projections = [(source, target, InstancedConnectivity(block, self.n_columns))
+                            for (source, target), block in template.blocks.items()]
+
+    @property
+    def n_neurons(self):
+        return self.template.n_neurons * self.n_columns
+
+    def size(self, name):
+        """Neurons of population ``name`` across all columns."""
+        return self.template.populations.size(name) * self.n_columns
+
+    def neuron_indices(self, name, columns):
+        """Indices within population ``name`` of all its neurons in the given columns."""
+        size = self.template.populations.size(name)
+        return (np.asarray(columns, dtype=np.int64)[:, None] * size + np.arange(size)).ravel()
+
+    def jitter_parameters(self, relative_sd, rng=None):
+        """Give parameters independent per-neuron values around the template's, in one pass.
+
+        Args:
+            relative_sd (dict): Parameter name to relative standard deviation;
+                every value becomes ``value * (1 + sd * N(0, 1))``.
+        """
+        rng = np.random.default_rng(rng)
+        names = self.template.populations.names
+        sizes = self.template.populations.sizes * self.n_columns
+        for parameter, sd in relative_sd.items():
+            if any(parameter not in self.parameters[name] for name in names):
+                raise ParameterValueError(parameter, "Only parameters set in the template can be jittered")
+            base = np.concatenate([np.broadcast_to(self.parameters[name][parameter], (size,))
+                                   for name, size in zip(names, sizes)])
+            values = base * (1.0 + sd * rng.standard_normal(len(base)))
+            for name, chunk in zip(names, np.split(values, np.cumsum(sizes)[:-1])):
+                self.parameters[name][parameter] = chunk
+
+    def jitter_weights(self, relative_sd, rng=None):
+        """Jitter the weights of every intracolumnar projection (see ``InstancedConnectivity``)."""
+        rng = np.random.default_rng(rng)
+        for _, _, projection in self.projections:
+            if isinstance(projection, InstancedConnectivity):
+                projection.jitter_weights(relative_sd, rng)
+
+    def add_projection(self, source, target, connectivity):
+        """Add synapses between populations of the sheet, e.g. from ``intercolumnar_projection``."""
+        if connectivity.n_pre != self.size(source) or connectivity.n_post != self.size(target):
+            raise DataValidationError("Projection does not match the population sizes of the sheet")
+        self.projections.append((source, target, connectivity))
+
+    def nbytes(self):
+        """Memory of the synapses in bytes: the shared template blocks plus per-sheet copies and links."""
+        shared = sum(block.nbytes for block in self.template.blocks.values())
+        return shared + sum(projection.nbytes for _, _, projection in self.projections)
+
+    def build(self, simulation, population_class=LIFPopulation, delayed=False):
+        """Add the sheet's populations and projections to a ``NeuronSimulation``.
+
+        Parameters named in the population class's ``parameter_arrays``
+        (such as ``bias_current``) are written into its arrays; all others
+        are passed to the constructor as shared scalars or per-neuron
+        arrays. With ``delayed`` every projection is expanded and wrapped in
+        a ``SynapticPathway`` so synaptic delays are honoured.
+
+        Returns:
+            dict: Population name to its index in the simulation.
+        """
+        indices = {}
+        for name in self.template.populations.names:
+            parameters = dict(self.parameters[name])
+            arrays = {key: parameters.pop(key) for key in population_class.parameter_arrays if key in parameters}
+            population = population_class(self.size(name), simulation.time_step, **parameters)
+            for key, value in arrays.items():
+                getattr(population, key)[:] = value
+            indices[name] = simulation.add_population(population)
+        for source, target, projection in self.projections:
+            if delayed:
+                matrix = projection.to_connectivity() if isinstance(projection, InstancedConnectivity) \
+                    else projection
+                projection = SynapticPathway(matrix)
+            simulation.connect(indices[source], indices[target], projection)
+        return indices
+
+def _scratch_sheet(populations, microcircuit, n_columns, time_step, rng):
+    """Reference: draw every column separately and assemble each projection by concatenation."""
+    rng = np.random.default_rng(rng)
+    columns = [microcircuit.sample_all(time_step, rng) for _ in range(n_columns)]
+    projections = {}
+    for pair in columns[0]:
+        blocks = [column[pair] for column in columns]
+        counts = np.concatenate([np.diff(block.indptr) for block in blocks])
+        indices = np.concatenate([block.indices.astype(np.int64) + column * block.n_post
+                                  for column, block in enumerate(blocks)])
+        projections[pair] = ConnectivityMatrix(np.concatenate(([0], np.cumsum(counts))), indices,
+                                               np.concatenate([block.weights for block in blocks]),
+                                               np.concatenate([block.delays for block in blocks]),
+                                               blocks[0].n_post * n_columns, time_step, check=False)
+    return projections
+
+def benchmark_sheet_construction(n_columns=100, scale=0.02, time_step=SIMULATION_TIME_STEP, rng=0):
+    """Seconds and bytes to build a sheet of Potjans-Diesmann columns from a template and from scratch.
+
+    The template path compiles one column, instances it and jitters
+    weights and parameters; 'instanced_expanded' additionally expands
+    every projection into a ``ConnectivityMatrix``.
+    """
+    populations = potjans_diesmann_layers(scale)
+    microcircuit = potjans_diesmann_microcircuit(populations)
+    results = {}
+
+    start = time.perf_counter()
+    template = ColumnTemplate(populations, microcircuit, {'tau_m': 10.0, 'v_thresh': -50.0}, time_step, rng)
+    sheet = template.instantiate(n_columns)
+    results['instanced'] = time.perf_counter() - start
+    results['instanced_bytes'] = sheet.nbytes()
+    start = time.perf_counter()
+    sheet.jitter_weights(0.1, rng)
+    sheet.jitter_parameters({'v_thresh': 0.02}, rng)
+    results['jitter'] = time.perf_counter() - start
+    results['jittered_bytes'] = sheet.nbytes()
+    start = time.perf_counter()
+    for _, _, projection in sheet.projections:
+        projection.to_connectivity()
+    results['instanced_expanded'] = time.perf_counter() - start + results['instanced']
+
+    start = time.perf_counter()
+    scratch = _scratch_sheet(populations, microcircuit, n_columns, time_step, rng)
+    results['scratch'] = time.perf_counter() - start
+    results['scratch_bytes'] = sum(projection.nbytes for projection in scratch.values())
+    return results
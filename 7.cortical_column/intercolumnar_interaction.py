@@ -1 +1,63 @@
-# Models interactions between different cortical columns
\ No newline at end of file
+# Models interactions between different cortical columns
+
+import numpy as np
+from ..common.constants import AXONAL_CONDUCTION_VELOCITY, SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..circuits.connectivity_matrix import ConnectivityMatrix
+from ..network_dynamics.small_world_networks import connection_profile
+
+def column_grid(n_columns, spacing=300.0):
+    """Positions (um) of ``n_columns`` columns on a square grid, row by row."""
+    side = int(np.ceil(np.sqrt(n_columns)))
+    index = np.arange(n_columns)
+    return np.stack((index % side, index // side), axis=1) * float(spacing)
+
+def intercolumnar_projection(positions, n_source, n_target, connection_probability=0.02, length_constant=500.0,
+                             profile='exponential', cutoff=None, weight=0.15, weight_sd=0.1, synaptic_delay=1.0,
+                             velocity=AXONAL_CONDUCTION_VELOCITY, time_step=SIMULATION_TIME_STEP, rng=None):
+    """Synapses from one population of every column to one population of every other column.
+
+    Neurons of the source population in column ``a`` connect to those of
+    the target population in column ``b != a`` with the
+    ``connection_profile`` probability of the distance between the
+    columns. All column pairs within ``cutoff`` (default where the
+    probability falls to 1e-3 of its peak) are found with one KD-tree
+    query; the synapse count of every pair is drawn in one binomial call
+    and the synapses themselves in one batch of local indices, so the
+    cost is independent of the number of columns once their pairs are
+    known. Repeated draws of one neuron pair are merged. Delays are the
+    ``synaptic_delay`` plus the conduction time between the columns.
+
+    Args:
+        positions (np.ndarray): Column positions (um), ``(n_columns, dimensions)``.
+        n_source, n_target (int): Neurons per column in the source and target populations.
+
+    Returns:
+        ConnectivityMatrix: ``(n_columns * n_source, n_columns * n_target)``
+            with neurons numbered column by column, as in ``CorticalSheet``.
+    """
+    from scipy.spatial import cKDTree
+
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim != 2:
+        raise DataValidationError("Column positions must have shape (n_columns, dimensions)")
+    if not 0.0 <= connection_probability <= 1.0:
+        raise ParameterValueError('connection_probability', "Connection probability must lie in [0, 1]")
+    rng = np.random.default_rng(rng)
+    n_columns = len(positions)
+    if cutoff is None:
+        cutoff = length_constant * (np.log(1e3) if profile == 'exponential' else np.sqrt(2.0 * np.log(1e3)))
+    pairs = cKDTree(positions).query_pairs(cutoff, output_type='ndarray')
+    pairs = np.concatenate((pairs, pairs[:, ::-1])).astype(np.int64)
+    distances = np.sqrt(((positions[pairs[:, 0]] - positions[pairs[:, 1]]) ** 2).sum(axis=1))
+    probabilities = connection_profile(distances, connection_probability, length_constant, profile)
+    counts = rng.binomial(n_source * n_target, probabilities)
+    pair = np.repeat(np.arange(len(pairs)), counts)
+    pre = pairs[pair, 0] * n_source + rng.integers(0, n_source, len(pair))
+    post = pairs[pair, 1] * n_target + rng.integers(0, n_target, len(pair))
+    n_post = n_columns * n_target
+    keys, first = np.unique(pre * n_post + post, return_index=True)
+    weights = weight * np.maximum(1.0 + weight_sd * rng.standard_normal(len(keys)), 0.0)
+    # Velocity in m/s is um per us, so distance / (velocity * 1e3) is in ms.
+    delays = synaptic_delay + distances[pair[first]] / (velocity * 1e3)
+    return ConnectivityMatrix.from_sorted_keys(keys, n_columns * n_source, n_post, weights, delays, time_step)
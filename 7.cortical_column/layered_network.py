@@ -1 +1,68 @@
-# Models the layered structure of the cortex
\ No newline at end of file
+# Models the layered structure of the cortex
+
+import numpy as np
+from ..common.error_handling import DataValidationError, ParameterValueError
+
+# Neurons per population under 1 mm^2 of early sensory cortex (Potjans & Diesmann, 2014).
+POTJANS_DIESMANN_SIZES = {'L23e': 20683, 'L23i': 5834, 'L4e': 21915, 'L4i': 5479,
+                          'L5e': 4850, 'L5i': 1065, 'L6e': 14395, 'L6i': 2948}
+
+class LayeredPopulations:
+    """Sizes, layers and cell types of the populations of one column.
+
+    Within a column the populations are numbered one after the other in
+    the given order, so population ``name`` occupies the column-local
+    indices ``slice(name)``.
+
+    Args:
+        sizes (dict): Population name to number of neurons, in column order.
+        layers (dict): Population name to layer; by default the name
+            without its trailing cell-type letter.
+        excitatory (dict): Population name to whether it is excitatory; by
+            default whether the name ends in 'e'.
+    """
+    def __init__(self, sizes, layers=None, excitatory=None):
+        self.names = list(sizes)
+        self.sizes = np.array([int(sizes[name]) for name in self.names], dtype=np.int64)
+        if len(self.names) == 0 or np.any(self.sizes < 1):
+            raise ParameterValueError('sizes', "A column needs populations of at least one neuron")
+        self.layers = [name[:-1] if layers is None else layers[name] for name in self.names]
+        self.excitatory = np.array([name.endswith('e') if excitatory is None else bool(excitatory[name])
+                                    for name in self.names])
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def n_neurons(self):
+        return int(self.offsets[-1])
+
+    def index(self, name):
+        if name not in self.names:
+            raise DataValidationError(f"Unknown population: {name}")
+        return self.names.index(name)
+
+    def size(self, name):
+        return int(self.sizes[self.index(name)])
+
+    def slice(self, name):
+        """Column-local indices of population ``name``."""
+        index = self.index(name)
+        return slice(int(self.offsets[index]), int(self.offsets[index + 1]))
+
+    def layer_populations(self, layer):
+        """Names of the populations in ``layer``."""
+        return [name for name, population_layer in zip(self.names, self.layers) if population_layer == layer]
+
+    def scaled(self, scale):
+        """The same populations with every size multiplied by ``scale`` (at least one neuron each)."""
+        if scale <= 0:
+            raise ParameterValueError('scale', "Scale must be positive")
+        sizes = {name: max(int(round(size * scale)), 1) for name, size in zip(self.names, self.sizes)}
+        return LayeredPopulations(sizes, dict(zip(self.names, self.layers)),
+                                  dict(zip(self.names, self.excitatory)))
+
+def potjans_diesmann_layers(scale=0.1):
+    """Layer 2/3, 4, 5 and 6 excitatory and inhibitory populations of the Potjans-Diesmann column."""
+    return LayeredPopulations(POTJANS_DIESMANN_SIZES).scaled(scale)
@@ -1 +1,97 @@
-# Detailed modeling of microcircuitry within a column
\ No newline at end of file
+# Detailed modeling of microcircuitry within a column
+
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP
+from ..common.error_handling import DataValidationError, ParameterValueError
+from ..circuits.connectivity_matrix import ConnectivityMatrix
+from ..network_dynamics.small_world_networks import bernoulli_positions
+from .layered_network import POTJANS_DIESMANN_SIZES
+
+# Connection probabilities [target, source] between the populations of
+# POTJANS_DIESMANN_SIZES, in the same order (Potjans & Diesmann, 2014, Table 5).
+POTJANS_DIESMANN_PROBABILITIES = np.array([
+    [0.1009, 0.1689, 0.0437, 0.0818, 0.0323, 0.0, 0.0076, 0.0],
+    [0.1346, 0.1371, 0.0316, 0.0515, 0.0755, 0.0, 0.0042, 0.0],
+    [0.0077, 0.0059, 0.0497, 0.1350, 0.0067, 0.0003, 0.0453, 0.0],
+    [0.0691, 0.0029, 0.0794, 0.1597, 0.0033, 0.0, 0.1057, 0.0],
+    [0.1004, 0.0622, 0.0505, 0.0057, 0.0831, 0.3726, 0.0204, 0.0],
+    [0.0548, 0.0269, 0.0257, 0.0022, 0.0600, 0.3158, 0.0086, 0.0],
+    [0.0156, 0.0066, 0.0211, 0.0166, 0.0572, 0.0197, 0.0396, 0.2252],
+    [0.0364, 0.0010, 0.0034, 0.0005, 0.0277, 0.0080, 0.0658, 0.1443],
+])
+
+class Microcircuit:
+    """Connection rules between the populations of one column.
+
+    Every ordered pair of neurons is connected independently with the
+    probability of its populations. Weights are drawn around their means
+    with a relative spread of ``weight_sd`` and keep their sign; delays
+    are drawn around their means with a relative spread of ``delay_sd``
+    and last at least one time step.
+
+    Args:
+        populations (LayeredPopulations): Populations of the column.
+        probabilities (np.ndarray): Connection probabilities ``[target, source]``.
+        weights (np.ndarray): Mean weights ``[target, source]`` (mV).
+        delays (np.ndarray): Mean delays ``[target, source]`` (ms).
+    """
+    def __init__(self, populations, probabilities, weights, delays, weight_sd=0.1, delay_sd=0.5):
+        shape = (len(populations), len(populations))
+        self.populations = populations
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), shape)
+        self.delays = np.broadcast_to(np.asarray(delays, dtype=np.float64), shape)
+        if self.probabilities.shape != shape:
+            raise DataValidationError("Need one connection probability per pair of populations")
+        if np.any((self.probabilities < 0) | (self.probabilities > 1)):
+            raise ParameterValueError('probabilities', "Connection probabilities must lie in [0, 1]")
+        self.weight_sd = weight_sd
+        self.delay_sd = delay_sd
+
+    def projections(self):
+        """(source, target) name pairs with a non-zero connection probability."""
+        names = self.populations.names
+        targets, sources = np.nonzero(self.probabilities)
+        return [(names[source], names[target]) for source, target in zip(sources, targets)]
+
+    def sample(self, source, target, time_step=SIMULATION_TIME_STEP, rng=None):
+        """Draw the synapses from population ``source`` to ``target`` as a ``ConnectivityMatrix``.
+
+        The keys of the synapses among all ``n_source * n_target`` pairs are
+        drawn in sorted order by geometric skipping, so memory grows with
+        the number of synapses rather than with the number of pairs.
+        """
+        rng = np.random.default_rng(rng)
+        source_index = self.populations.index(source)
+        target_index = self.populations.index(target)
+        n_pre, n_post = self.populations.sizes[source_index], self.populations.sizes[target_index]
+        probability = self.probabilities[target_index, source_index]
+        keys = bernoulli_positions(int(n_pre * n_post), probability, rng)
+        n_synapses = len(keys)
+        mean = self.weights[target_index, source_index]
+        weights = mean * np.maximum(1.0 + self.weight_sd * rng.standard_normal(n_synapses), 0.0)
+        delay = self.delays[target_index, source_index]
+        delays = np.maximum(delay * (1.0 + self.delay_sd * rng.standard_normal(n_synapses)), time_step)
+        return ConnectivityMatrix.from_sorted_keys(keys, n_pre, n_post, weights, delays, time_step)
+
+    def sample_all(self, time_step=SIMULATION_TIME_STEP, rng=None):
+        """Synapses of every projection, keyed by (source, target) name pairs."""
+        rng = np.random.default_rng(rng)
+        return {(source, target): self.sample(source, target, time_step, rng)
+                for source, target in self.projections()}
+
+def potjans_diesmann_microcircuit(populations, excitatory_weight=0.15, relative_inhibition=4.0,
+                                  excitatory_delay=1.5, inhibitory_delay=0.75):
+    """Microcircuit of the Potjans-Diesmann column for populations from ``potjans_diesmann_layers``.
+
+    Excitatory PSPs are ``excitatory_weight`` mV, inhibitory ones
+    ``relative_inhibition`` times larger and negative, and the layer 4 to
+    layer 2/3 excitatory projection is twice as strong.
+    """
+    if populations.names != list(POTJANS_DIESMANN_SIZES):
+        raise DataValidationError("Populations must be the eight Potjans-Diesmann populations")
+    excitatory = np.broadcast_to(populations.excitatory[None, :], (len(populations), len(populations)))
+    weights = np.where(excitatory, excitatory_weight, -relative_inhibition * excitatory_weight)
+    weights[populations.index('L23e'), populations.index('L4e')] *= 2.0
+    delays = np.where(excitatory, excitatory_delay, inhibitory_delay)
+    return Microcircuit(populations, POTJANS_DIESMANN_PROBABILITIES, weights, delays)
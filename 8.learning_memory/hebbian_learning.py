@@ -1 +1,37 @@
-# Models Hebbian learning mechanisms
\ No newline at end of file
+# Models Hebbian learning mechanisms
+
+from ..common.constants import SYNAPTIC_WEIGHT_RANGE
+from ..common.error_handling import ParameterValueError
+from ..circuits.plasticity_rules import PlasticityRule, SpikeTimingPlasticity
+
+class HebbianRule(PlasticityRule):
+    """Symmetric Hebbian rule: neurons that fire together within ``tau`` wire together.
+
+    Either spike order potentiates by ``learning_rate`` times the partner's
+    trace. At every presynaptic spike ``decay`` times the weight is
+    subtracted from that potentiation, which keeps weights bounded without
+    a hard limit in the spirit of Oja's rule. With additive bounds this
+    removes exactly the fraction ``decay`` of the weight; with
+    ``soft_bounds`` the net change of the spike is scaled as a whole, by
+    the distance to the upper bound if it is positive and to the lower
+    bound if it is negative.
+    """
+    def __init__(self, learning_rate=0.005, tau=20.0, decay=0.0):
+        if decay < 0:
+            raise ParameterValueError('decay', "Weight decay must not be negative")
+        self.learning_rate = learning_rate
+        self.decay = decay
+        self.pre_time_constants = (tau,)
+        self.post_time_constants = (tau,)
+
+    def on_pre(self, other_traces, own_traces, weights):
+        return self.learning_rate * other_traces[0] - self.decay * weights
+
+    def on_post(self, other_traces, own_traces, weights):
+        return self.learning_rate * other_traces[0]
+
+def hebbian_plasticity(connectivity, source=0, target=0, learning_rate=0.005, tau=20.0, decay=0.0,
+                       weight_range=SYNAPTIC_WEIGHT_RANGE, soft_bounds=True):
+    """Monitor that applies Hebbian learning to a projection of a ``NeuronSimulation``."""
+    return SpikeTimingPlasticity(connectivity, HebbianRule(learning_rate, tau, decay), source, target,
+                                 weight_range, soft_bounds)
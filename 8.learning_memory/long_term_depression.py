@@ -1 +1,30 @@
-# Models long-term depression for synaptic weakening
\ No newline at end of file
+# Models long-term depression for synaptic weakening
+
+import numpy as np
+from ..common.constants import SYNAPTIC_WEIGHT_RANGE
+from ..circuits.plasticity_rules import PairSTDP, pairing_response
+
+def depression_rule(a_minus=0.0105, tau_minus=20.0):
+    """Pair rule with its potentiation term removed, as when LTP is blocked."""
+    return PairSTDP(a_plus=0.0, a_minus=a_minus, tau_minus=tau_minus)
+
+def low_frequency_times(n_pulses=900, frequency=1.0):
+    """Spike times (ms) of low-frequency stimulation (900 pulses at 1 Hz by default)."""
+    return np.arange(n_pulses) * 1000.0 / frequency
+
+def induce_ltd(rule=None, pre_times=None, lag=10.0, weight=0.5):
+    """Weight change of one synapse when a postsynaptic spike precedes every presynaptic one by ``lag`` ms.
+
+    The weight is kept within ``SYNAPTIC_WEIGHT_RANGE``. 900 pairings at
+    the default pair amplitudes would depress the weight by several times
+    the whole range, so the default rule scales both amplitudes down by 30,
+    which lowers the weight by about 0.2 instead.
+
+    Args:
+        rule (PlasticityRule): Defaults to a full pair STDP rule with
+            ``a_plus=3.3e-4, a_minus=3.5e-4``.
+        pre_times (np.ndarray): Presynaptic spike times; defaults to low-frequency stimulation.
+    """
+    rule = PairSTDP(a_plus=3.3e-4, a_minus=3.5e-4) if rule is None else rule
+    pre_times = low_frequency_times() if pre_times is None else np.asarray(pre_times)
+    return pairing_response(rule, pre_times, pre_times - lag, weight, SYNAPTIC_WEIGHT_RANGE) - weight
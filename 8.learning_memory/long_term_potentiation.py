@@ -1 +1,40 @@
-# Simulates long-term potentiation in synaptic strength
\ No newline at end of file
+# Simulates long-term potentiation in synaptic strength
+
+import numpy as np
+from ..common.constants import SYNAPTIC_WEIGHT_RANGE
+from ..circuits.plasticity_rules import TripletSTDP, pairing_response
+
+def potentiation_rule(a2_plus=5e-10, a3_plus=6.2e-3, tau_plus=16.8, tau_y=125.0):
+    """Triplet rule with its depression terms removed, as when LTD is blocked.
+
+    Potentiation then depends on postsynaptic bursting, which is what makes
+    high-frequency and theta-burst stimulation effective.
+    """
+    return TripletSTDP(a2_plus=a2_plus, a3_plus=a3_plus, a2_minus=0.0, a3_minus=0.0,
+                       tau_plus=tau_plus, tau_y=tau_y)
+
+def theta_burst_times(n_bursts=10, spikes_per_burst=4, burst_frequency=100.0, theta_frequency=5.0):
+    """Spike times (ms) of theta-burst stimulation: bursts repeated at theta frequency."""
+    bursts = np.arange(n_bursts)[:, None] * 1000.0 / theta_frequency
+    return (bursts + np.arange(spikes_per_burst)[None, :] * 1000.0 / burst_frequency).ravel()
+
+def tetanus_times(n_pulses=100, frequency=100.0):
+    """Spike times (ms) of a high-frequency tetanus."""
+    return np.arange(n_pulses) * 1000.0 / frequency
+
+def induce_ltp(rule=None, pre_times=None, lag=5.0, weight=0.5):
+    """Weight change of one synapse when every presynaptic spike is followed by a postsynaptic one.
+
+    The weight is kept within ``SYNAPTIC_WEIGHT_RANGE``. The default rule
+    has its triplet amplitude scaled down so that the default protocol
+    raises the weight by about 0.2 rather than driving it into the bound,
+    and the result still reflects the rule and the protocol.
+
+    Args:
+        rule (PlasticityRule): Defaults to ``potentiation_rule(a3_plus=1.7e-3)``.
+        pre_times (np.ndarray): Presynaptic spike times; defaults to theta-burst stimulation.
+        lag (float): Delay (ms) of the evoked postsynaptic spikes.
+    """
+    rule = potentiation_rule(a3_plus=1.7e-3) if rule is None else rule
+    pre_times = theta_burst_times() if pre_times is None else np.asarray(pre_times)
+    return pairing_response(rule, pre_times, pre_times + lag, weight, SYNAPTIC_WEIGHT_RANGE) - weight
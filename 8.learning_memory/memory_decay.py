@@ -1 +1,133 @@
-# Models the decay of memories over time
\ No newline at end of file
+# Models the decay of memories over time
+
+import time
+import numpy as np
+from ..common.constants import SIMULATION_TIME_STEP, SYNAPTIC_DECAY_CONSTANT
+from ..common.error_handling import DataValidationError, ParameterValueError
+
+# SYNAPTIC_DECAY_CONSTANT is read in seconds.
+DEFAULT_DECAY_TIME_CONSTANT = SYNAPTIC_DECAY_CONSTANT * 1e3  # ms
+
+class LazySynapticDecay:
+    """Exponential relaxation of synaptic weights towards a baseline, applied only when needed.
+
+    Every synapse remembers when it was last brought up to date. Reading a
+    weight first applies the closed-form decay
+    ``w = baseline + (w - baseline) * exp(-elapsed / time_constant)`` for
+    the time since then, so synapses that are never read cost nothing
+    between coarse sweeps. ``baseline`` is a scalar or one value per
+    synapse.
+
+    Instances can be registered as slow processes
+    (``simulation.add_process(decay, period)``) to sweep every synapse at
+    a coarse period, which keeps weights read by other code close to date.
+    """
+    def __init__(self, connectivity, time_constant=DEFAULT_DECAY_TIME_CONSTANT, baseline=0.0):
+        if time_constant <= 0:
+            raise ParameterValueError('time_constant', "Decay time constant must be positive")
+        self.connectivity = connectivity
+        self.time_constant = time_constant
+        self.baseline = baseline
+        self.last_update = np.zeros(connectivity.n_synapses)
+        self.state_version = 0
+
+    def touch(self, synapses, time):
+        """Bring the weights of ``synapses`` (unique positions or a slice) up to ``time`` ms."""
+        weights = self.connectivity.weights
+        factor = np.exp((self.last_update[synapses] - time) / self.time_constant)
+        baseline = self.baseline[synapses] if np.ndim(self.baseline) else self.baseline
+        weights[synapses] = baseline + (weights[synapses] - baseline) * factor
+        self.last_update[synapses] = time
+        self.state_version += 1
+        self.connectivity.mark_changed()
+
+    def sweep(self, time):
+        """Bring every synapse up to ``time`` ms."""
+        self.touch(slice(None), time)
+
+    def __call__(self, simulation, time):
+        self.sweep(time)
+
+    def checkpoint_state(self):
+        return {'last_update': self.last_update}
+
+    def restore_state(self, arrays):
+        if arrays['last_update'].shape != self.last_update.shape:
+            raise DataValidationError("Checkpointed decay timestamps do not match the connectivity")
+        self.last_update = arrays['last_update']
+        self.state_version += 1
+
+class DecayingConnectivity:
+    """Connectivity matrix whose weights decay lazily, for ``NeuronSimulation.connect``.
+
+    Before the spikes of a step are propagated, only the synapses of the
+    neurons that fired are brought up to date, so the decay costs as much
+    as the propagation itself. The wrapper keeps its own clock, advanced
+    by ``time_step`` on every call, matching the once-per-step calls of
+    the simulation loop.
+    """
+    def __init__(self, connectivity, decay=None, time_step=SIMULATION_TIME_STEP):
+        self.connectivity = connectivity
+        self.decay = LazySynapticDecay(connectivity) if decay is None else decay
+        self.time_step = time_step
+        self.time = 0.0
+
+    def propagate(self, spike_indices, target):
+        self.time += self.time_step
+        if len(spike_indices):
+            self.decay.touch(self.connectivity.outgoing(spike_indices), self.time)
+        self.connectivity.propagate(spike_indices, target)
+
+    @property
+    def state_version(self):
+        """Versions of the weights and timestamps; the clock changes on every step."""
+        return {'weights': self.connectivity.state_version, 'last_update': self.decay.state_version}
+
+    def checkpoint_state(self):
+        return {'weights': self.connectivity.weights, 'last_update': self.decay.last_update,
+                'time': np.array([self.time])}
+
+    def restore_state(self, arrays):
+        self.connectivity.restore_state({'weights': arrays['weights']})
+        self.decay.restore_state({'last_update': arrays['last_update']})
+        self.time = float(arrays['time'][0])
+
+def benchmark_lazy_decay(n_neurons=10_000, density=0.01, rate=5.0, steps=1000, sweep_period=1000.0,
+                         time_step=SIMULATION_TIME_STEP, rng=None):
+    """Cost of lazy decay with periodic sweeps against decaying every synapse on every step.
+
+    Returns:
+        dict: Seconds per simulated step for both strategies and the largest
+        weight difference between them at the end.
+    """
+    from ..circuits.connectivity_matrix import ConnectivityMatrix
+
+    rng = np.random.default_rng(rng)
+    matrix = ConnectivityMatrix.random(n_neurons, n_neurons, density, rng=rng)
+    probability = rate * time_step * 1e-3
+    spike_sets = [np.flatnonzero(rng.random(n_neurons) < probability) for _ in range(steps)]
+    target = np.zeros(n_neurons)
+    sweep_steps = max(int(round(sweep_period / time_step)), 1)
+
+    eager = ConnectivityMatrix(matrix.indptr, matrix.indices, matrix.weights.copy(), matrix.delays, n_neurons)
+    factor = np.float32(np.exp(-time_step / DEFAULT_DECAY_TIME_CONSTANT))
+    start = time.perf_counter()
+    for spikes in spike_sets:
+        eager.weights *= factor
+        eager.propagate(spikes, target)
+    eager_seconds = time.perf_counter() - start
+
+    lazy = DecayingConnectivity(matrix, time_step=time_step)
+    start = time.perf_counter()
+    for step, spikes in enumerate(spike_sets, 1):
+        lazy.propagate(spikes, target)
+        if step % sweep_steps == 0:
+            lazy.decay.sweep(lazy.time)
+    lazy_seconds = time.perf_counter() - start
+    lazy.decay.sweep(lazy.time)
+    return {
+        'eager_seconds_per_step': eager_seconds / steps,
+        'lazy_seconds_per_step': lazy_seconds / steps,
+        'speedup': eager_seconds / lazy_seconds,
+        'max_difference': float(np.abs(eager.weights - matrix.weights).max()),
+    }
@@ -1 +1,76 @@
-# Simulates synaptic consolidation processes
\ No newline at end of file
+# Simulates synaptic consolidation processes
+
+import numpy as np
+from ..common.error_handling import DataValidationError, ParameterValueError
+from .memory_decay import LazySynapticDecay
+
+class SynapticConsolidation:
+    """Synaptic tagging and capture on top of lazily decaying weights.
+
+    The weight of every synapse is the sum of a consolidated (late-phase)
+    component and an early-phase change, which decays lazily towards the
+    consolidated weight with ``early_time_constant``. Synapses whose early
+    change exceeds ``tag_threshold`` are tagged; when the tagged fraction
+    exceeds ``protein_threshold`` (plasticity-related proteins are made),
+    tagged synapses capture a share ``1 - exp(-period / consolidation_time_constant)``
+    of their early change into the late component on every consolidation
+    sweep.
+
+    Consolidation is a slow process: register the instance with
+    ``simulation.add_process(consolidation, consolidation.period)`` and
+    pass ``consolidation.decay`` to code that reads or changes weights,
+    e.g. ``SpikeTimingPlasticity(..., decay=consolidation.decay)``.
+
+    Units: ms.
+    """
+    def __init__(self, connectivity, early_time_constant=3.6e6, consolidation_time_constant=6e5,
+                 tag_threshold=0.05, protein_threshold=0.01, period=1000.0):
+        if period <= 0 or consolidation_time_constant <= 0:
+            raise ParameterValueError('period', "Consolidation period and time constant must be positive")
+        self.connectivity = connectivity
+        self.tag_threshold = tag_threshold
+        self.protein_threshold = protein_threshold
+        self.period = period
+        self.capture_fraction = -np.expm1(-period / consolidation_time_constant)
+        self.late = connectivity.weights.copy()
+        self._late_version = 0
+        self.decay = LazySynapticDecay(connectivity, early_time_constant, baseline=self.late)
+
+    def early(self):
+        """Early-phase component of every synapse (as of the last update of each synapse)."""
+        return self.connectivity.weights - self.late
+
+    def tags(self):
+        return np.abs(self.early()) > self.tag_threshold
+
+    def consolidate(self, time):
+        """Bring all synapses to ``time`` ms and let tagged synapses capture proteins.
+
+        Returns:
+            int: Number of synapses that consolidated part of their change.
+        """
+        self.decay.sweep(time)
+        tagged = np.flatnonzero(self.tags())
+        if len(tagged) <= self.protein_threshold * len(self.late):
+            return 0
+        self.late[tagged] += self.capture_fraction * (self.connectivity.weights[tagged] - self.late[tagged])
+        self._late_version += 1
+        return len(tagged)
+
+    def __call__(self, simulation, time):
+        self.consolidate(time)
+
+    @property
+    def state_version(self):
+        return {'late': self._late_version, 'last_update': self.decay.state_version}
+
+    def checkpoint_state(self):
+        return {'late': self.late, 'last_update': self.decay.last_update}
+
+    def restore_state(self, arrays):
+        if arrays['late'].shape != self.late.shape:
+            raise DataValidationError("Checkpointed late-phase weights do not match the connectivity")
+        self.late = arrays['late']
+        self._late_version += 1
+        self.decay.baseline = self.late
+        self.decay.restore_state({'last_update': arrays['last_update']})
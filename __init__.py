@@ -26,11 +26,14 @@
 # │   ├── data_handling.py            # Functions for data import, export, and manipulation
 # │   ├── logging.py                  # Logging utilities for tracking and debugging
 # │   ├── config_manager.py           # Managing configuration settings for simulations
+# │   ├── parameter_sweep.py          # Parameter sweeps over configuration settings
 # │   ├── math_tools.py               # Common mathematical functions and algorithms
+# │   ├── reaction_network.py         # Stiff biochemical reaction networks integrated for many cells at once
 # │   ├── performance_metrics.py      # Tools for measuring and reporting simulation performance
 # │   ├── visualization_tools.py      # Utilities for generating plots, graphs, and other visual data representations
 # │   ├── simulation_framework.py     # Base classes and functions for setting up and running simulations
 # │   ├── parallel_processing.py      # Utilities for multi-threading and multi-processing
+# │   ├── checkpointing.py            # Checkpointing, restoring and forking of long-running simulations
 # │   ├── testing_utilities.py        # Tools and frameworks for conducting tests on the modules
 # │   └── ...
 # │